@@ -0,0 +1,272 @@
+"""
+Bounded, indexed store of the alert mails received by the smtpserver action.
+
+Only the Python standard library is used so that the mailbox can be loaded
+without the action's virtualenv.
+"""
+from collections import defaultdict
+from email.utils import parseaddr
+import json
+import os
+import re
+import threading
+import time
+
+# The Autoscaler's alert levels, see the alert_levels config option
+SEVERITIES = ("INFO", "NOTICE", "WARN", "ERROR", "FATAL")
+
+# Longest a wait for mail may block, in seconds.
+MAX_WAIT_TIMEOUT = 300
+
+_SEVERITY = re.compile(r"\b({})\b".format("|".join(SEVERITIES)))
+
+
+def _severity(message):
+    """
+    The alert severity, from the JSON alert in the body or else from the
+    subject.
+    """
+    try:
+        payload = message.get_payload(decode=True)
+        severity = json.loads(payload.decode("utf-8"))["severity"]
+        if severity in SEVERITIES:
+            return severity
+    except (AttributeError, TypeError, ValueError, KeyError):
+        pass
+
+    match = _SEVERITY.search(message.get("Subject", ""))
+    return match.group(1) if match else "UNKNOWN"
+
+
+class RecordLog:
+    """
+    Records in the order they were received, backed by a list so that they
+    can be indexed in constant time. Dropping the oldest record moves the
+    start of the log, the list is compacted once half of it is unused.
+    """
+    def __init__(self):
+        self._records = []
+        self._start = 0
+
+    def __len__(self):
+        return len(self._records) - self._start
+
+    def __getitem__(self, index):
+        return self._records[self._start + index]
+
+    def append(self, record):
+        self._records.append(record)
+
+    def popleft(self):
+        record = self._records[self._start]
+        self._records[self._start] = None
+        self._start += 1
+
+        if self._start * 2 >= len(self._records):
+            del self._records[:self._start]
+            self._start = 0
+
+        return record
+
+
+def _bisect(records, timestamp):
+    """
+    Index of the first record received at or after the timestamp. The records
+    are in the order they were received.
+    """
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if records[middle]["time"] < timestamp:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class Mailbox:
+    """
+    Keeps the most recently received mail, indexed by severity, sender and
+    subject. Only a summary of each mail is kept in memory, older mail is
+    dropped once the capacity is reached. The complete mail can be spilled to
+    a spool file, one JSON object per line. The spool is cut back to the
+    most recent ``capacity`` mail whenever it has grown to twice that.
+
+    :param capacity: Maximum number of mail to keep in memory and, after
+                     being cut back, in the spool
+    :type capacity: int
+    :param spool: Path to the spool file, no spooling if None
+    :type spool: str
+    """
+    INDEXES = ("severity", "sender", "subject")
+
+    def __init__(self, capacity, spool=None):
+        self.capacity = capacity
+        self.spool_path = spool
+        self.spool = None
+        self.spooled = 0
+        self.messages = RecordLog()
+        self.indexes = {key: defaultdict(RecordLog) for key in self.INDEXES}
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+        self.lock = threading.Condition()
+
+        if spool:
+            if os.path.exists(spool):
+                with open(spool) as spool_file:
+                    self.spooled = sum(1 for _ in spool_file)
+            self.spool = open(spool, "a")
+            self._cut_spool()
+
+    def add(self, message, now=None):
+        record = {
+            "time": time.time() if now is None else now,
+            "severity": _severity(message),
+            "sender": parseaddr(message.get("From", ""))[1],
+            "subject": message.get("Subject", "")
+        }
+
+        with self.lock:
+            self.received += 1
+            record["id"] = self.received
+
+            if self.spool is not None:
+                self.spool.write(json.dumps(dict(
+                    record, message=message.as_string())) + "\n")
+                self.spool.flush()
+                self.spooled += 1
+                self._cut_spool()
+
+            if len(self.messages) >= self.capacity:
+                self._drop()
+
+            self.messages.append(record)
+            for key in self.INDEXES:
+                self.indexes[key][record[key]].append(record)
+
+            self.lock.notify_all()
+
+    def _cut_spool(self):
+        """
+        Rewrite the spool with only the most recent mail once it holds twice
+        the capacity, the rewritten spool replaces the old one atomically.
+        """
+        if self.spooled < 2 * self.capacity:
+            return
+
+        self.spool.close()
+        with open(self.spool_path) as spool_file:
+            lines = spool_file.readlines()[-self.capacity:]
+
+        tmp = "{}.tmp".format(self.spool_path)
+        with open(tmp, "w") as tmp_file:
+            tmp_file.writelines(lines)
+        os.rename(tmp, self.spool_path)
+
+        self.spool = open(self.spool_path, "a")
+        self.spooled = len(lines)
+
+    def _drop(self):
+        # The oldest mail is first in the mailbox as well as in every index
+        record = self.messages.popleft()
+        self.dropped += 1
+
+        for key in self.INDEXES:
+            index = self.indexes[key]
+            index[record[key]].popleft()
+            if not index[record[key]]:
+                del index[record[key]]
+
+    def _select(self, filters, since, until):
+        """
+        Start from the smallest index matching the filters, narrow it down to
+        the time range and check the rest of the filters.
+        """
+        candidates = self.messages
+        for key, value in filters.items():
+            entries = self.indexes[key].get(value, ())
+            if len(entries) < len(candidates):
+                candidates = entries
+
+        start = _bisect(candidates, since) if since else 0
+        end = _bisect(candidates, until) if until else len(candidates)
+
+        for i in range(start, end):
+            record = candidates[i]
+            if all(record[key] == value for key, value in filters.items()):
+                yield record
+
+    @staticmethod
+    def _filters(severity, sender, subject):
+        return {key: value for key, value in (
+            ("severity", severity), ("sender", sender), ("subject", subject)
+        ) if value}
+
+    def query(self, severity=None, sender=None, subject=None, since=None,
+              until=None, limit=None):
+        """
+        List the mail which matches all of the given filters, oldest first.
+
+        :param since: Epoch timestamp, inclusive
+        :param until: Epoch timestamp, exclusive
+        :param limit: Maximum number of mail to list, the most recent are
+                      listed if there are more
+        :returns: list of mail summaries
+        """
+        filters = self._filters(severity, sender, subject)
+
+        with self.lock:
+            records = list(self._select(filters, since, until))
+
+        return records[-limit:] if limit else records
+
+    def count(self, **filters):
+        """
+        Count the mail which matches all of the given filters, see
+        :meth:`query`.
+        """
+        if not any(filters.values()):
+            return len(self.messages)
+        return len(self.query(**filters))
+
+    def wait(self, count, timeout, severity=None, sender=None, subject=None,
+             since=None):
+        """
+        Block until at least ``count`` of the mail received since the given
+        time matches the filters, until the timeout has passed or until the
+        mailbox is closed. Woken up by every received mail rather than
+        polling.
+
+        :param timeout: Seconds to wait at most, no more than
+                        :data:`MAX_WAIT_TIMEOUT`
+        :returns: Number of matching mail
+        """
+        filters = self._filters(severity, sender, subject)
+        timeout = min(timeout, MAX_WAIT_TIMEOUT)
+
+        def _matching():
+            return sum(1 for _ in self._select(filters, since, None))
+
+        with self.lock:
+            self.lock.wait_for(
+                lambda: self.closed or _matching() >= count, timeout)
+            return _matching()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "received": self.received,
+                "stored": len(self.messages),
+                "dropped": self.dropped,
+                "severity": {severity: len(records) for severity, records
+                             in self.indexes["severity"].items()}
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+            if self.spool is not None:
+                self.spool.close()
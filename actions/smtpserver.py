@@ -1,5 +1,7 @@
 #!/usr/bin/env python3.5
 import asyncio
+import functools
+import json
 import logging
 import sys
 
@@ -13,23 +15,28 @@ from aiozmq import rpc  # noqa: E402
 from charmhelpers.core import hookenv  # noqa: E402
 import zmq  # noqa: E402
 
+from alertbox import Mailbox  # noqa: E402
+
 
 class Inbox(Message):
-    def __init__(self):
-        self.mail = list()
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
         super().__init__()
 
     @property
     def count(self):
-        return len(self.mail)
+        return self.mailbox.received
 
     def handle_message(self, message):
-        self.mail.append(message)
+        # Called from the SMTP server's thread
+        self.mailbox.add(message)
 
 
 class SMTPHandler(rpc.AttrHandler):
-    def __init__(self):
-        self.inbox = Inbox()
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+        self.inbox = Inbox(mailbox)
+        self.stopped = asyncio.Event()
         self.controller = Controller(self.inbox, port=0, ready_timeout=1)
         self.controller.start()
 
@@ -39,26 +46,57 @@ class SMTPHandler(rpc.AttrHandler):
 
     @property
     def running(self):
-        return self.controller.thread.is_alive()
+        return not self.stopped.is_set()
+
+    def _stop(self):
+        self.controller.stop()
+        self.mailbox.close()
+        self.stopped.set()
 
     @rpc.method
     def inboxcount(self):
         return self.inbox.count
 
+    @rpc.method
+    def count(self, severity=None, sender=None, subject=None, since=None,
+              until=None):
+        return self.mailbox.count(severity=severity, sender=sender,
+                                  subject=subject, since=since, until=until)
+
+    @rpc.method
+    def list(self, severity=None, sender=None, subject=None, since=None,
+             until=None, limit=None):
+        return self.mailbox.query(severity=severity, sender=sender,
+                                  subject=subject, since=since, until=until,
+                                  limit=limit)
+
+    @rpc.method
+    async def wait(self, count, timeout, severity=None, sender=None,
+                   subject=None, since=None):
+        # The mailbox blocks, the event loop keeps serving meanwhile
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.mailbox.wait, count=count, timeout=timeout,
+            severity=severity, sender=sender, subject=subject, since=since))
+
+    @rpc.method
+    def stats(self):
+        return self.mailbox.stats()
+
     @rpc.method
     def stop(self):
         # TODO Call later is currently needed to let the RPC client recieve a
         #      response before the server exits.
         # See: https://github.com/aio-libs/aiozmq/issues/39
         loop = asyncio.get_event_loop()
-        loop.call_later(0.01, self.controller.stop)
+        loop.call_later(0.01, self._stop)
 
 
 class Server:
     @classmethod
-    async def start(cls):
+    async def start(cls, capacity, spool=None):
         self = cls()
-        self.smtp = SMTPHandler()
+        self.smtp = SMTPHandler(Mailbox(capacity, spool))
         self.server = await rpc.serve_rpc(self.smtp, bind="tcp://127.0.0.1:*")
         return self
 
@@ -67,12 +105,11 @@ class Server:
         return list(self.server.transport.bindings())[0].split(':')[-1]
 
     async def wait(self):
-        while self.smtp.running:
-            await asyncio.sleep(0)
+        await self.smtp.stopped.wait()
 
     async def stop(self):
         if self.smtp is not None and self.smtp.running:
-            self.smtp.stop()
+            self.smtp._stop()
         if self.server is not None:
             self.server.close()
             await self.server.wait_closed()
@@ -80,10 +117,10 @@ class Server:
 
 class Client:
     @classmethod
-    async def connect(cls, port):
+    async def connect(cls, port, timeout=3):
         self = cls()
         address = "tcp://127.0.0.1:{}".format(port)
-        self.client = await rpc.connect_rpc(connect=address, timeout=3)
+        self.client = await rpc.connect_rpc(connect=address, timeout=timeout)
         self.client.transport.setsockopt(zmq.LINGER, 0)
         return self
 
@@ -91,8 +128,21 @@ class Client:
         return getattr(self.client.call, name)
 
 
+def _filters():
+    """
+    The query filters given as action parameters, empty ones are left out.
+    """
+    filters = {}
+    for key in ("severity", "sender", "subject", "since", "until"):
+        value = hookenv.action_get(key)
+        if value:
+            filters[key] = value
+    return filters
+
+
 async def server():
-    server = await Server.start()
+    server = await Server.start(hookenv.action_get("capacity"),
+                                hookenv.action_get("spool") or None)
 
     ports = {
         "ports.rpc": server.port,
@@ -112,12 +162,37 @@ async def server():
 async def client(op):
     try:
         port = hookenv.action_get("port")
-        client = await Client.connect(port)
+        timeout = hookenv.action_get("timeout")
+        # The wait operation's call lasts until the mail has arrived
+        client = await Client.connect(
+            port, timeout=timeout + 3 if op == "wait" else 3)
 
         if op == "inboxcount":
             count = await client.inboxcount()
             hookenv.action_set({"count": count})
             hookenv.log("SMTP server inbox count: {}".format(count))
+        elif op == "count":
+            count = await client.count(**_filters())
+            hookenv.action_set({"count": count})
+        elif op == "list":
+            messages = await client.list(limit=hookenv.action_get("limit"),
+                                         **_filters())
+            hookenv.action_set({"count": len(messages),
+                                "messages": json.dumps(messages)})
+        elif op == "wait":
+            filters = _filters()
+            filters.pop("until", None)
+            count = await client.wait(count=hookenv.action_get("count"),
+                                      timeout=timeout, **filters)
+            hookenv.action_set({"count": count})
+        elif op == "stats":
+            stats = await client.stats()
+            hookenv.action_set({
+                "received": stats["received"],
+                "stored": stats["stored"],
+                "dropped": stats["dropped"],
+                "severity": json.dumps(stats["severity"])
+            })
         elif op == "stop":
             await client.stop()
             hookenv.log("SMTP server successfully stopped")
@@ -128,6 +203,8 @@ async def client(op):
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("asyncio").setLevel(logging.INFO)
+    # Don't log every mail during alert storms
+    logging.getLogger("mail.log").setLevel(logging.WARNING)
 
     op = hookenv.action_get("operation")
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3.5
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+import socketserver
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.append("lib")
+from charms.layer.basic import activate_venv  # noqa: E402
+activate_venv()
+
+from charmhelpers.core import hookenv  # noqa: E402
+from reactive.stats import summarize  # noqa: E402
+
+# Number of deliveries kept for the latency statistics.
+HISTORY = 10000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _timestamp(value):
+    """
+    Epoch seconds from the ISO 8601 timestamp of an alert.
+    """
+    value = re.sub(r"(\.\d{6})\d*", r"\1", value)
+    offset = timedelta()
+    match = re.search(r"([+-])(\d\d):?(\d\d)$", value)
+    if match:
+        sign = 1 if match.group(1) == "+" else -1
+        offset = sign * timedelta(hours=int(match.group(2)),
+                                  minutes=int(match.group(3)))
+        value = value[:match.start()]
+    value = value.rstrip("Z")
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in value else "%Y-%m-%dT%H:%M:%S"
+    return (datetime.strptime(value, fmt) - offset -
+            EPOCH).total_seconds()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data=None):
+        content = b"" if data is None else json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == "/deliveries":
+            return self._reply(200, self.server.deliveries())
+        self._reply(404)
+
+    def do_POST(self):
+        received = time.time()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if self.path == "/shutdown":
+            self._reply(200)
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        try:
+            alert = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return self._reply(400)
+
+        self.server.deliver(alert, received)
+        self._reply(200)
+
+
+class WebhookServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Receives alerts posted by the Autoscaler's HTTP alerter and keeps track
+    of the delivery latency, from the alert's timestamp until it was received.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+        self.severities = {}
+        self.latencies = deque(maxlen=HISTORY)
+        super().__init__(("0.0.0.0", 0), WebhookHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def deliver(self, alert, received):
+        try:
+            latency = received - _timestamp(alert["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            latency = None
+
+        with self.lock:
+            self.received += 1
+            severity = alert.get("severity", "UNKNOWN")
+            self.severities[severity] = self.severities.get(severity, 0) + 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def deliveries(self):
+        with self.lock:
+            return {
+                "count": self.received,
+                "severity": dict(self.severities),
+                "latency": summarize(list(self.latencies))
+            }
+
+
+def _request(port, path, method="GET"):
+    url = "http://127.0.0.1:{}{}".format(port, path)
+    request = urllib.request.Request(url, method=method)
+    with urllib.request.urlopen(request, timeout=3) as response:
+        content = response.read()
+    return json.loads(content.decode("utf-8")) if content else None
+
+
+def server():
+    server = WebhookServer()
+
+    hookenv.log("Webhook server started - port: {}".format(server.port))
+    hookenv.action_set({"port": server.port})
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def client(op):
+    port = hookenv.action_get("port")
+
+    if op == "deliveries":
+        deliveries = _request(port, "/deliveries")
+        output = {
+            "count": deliveries["count"],
+            "severity": json.dumps(deliveries["severity"])
+        }
+        for stat, value in (deliveries["latency"] or {}).items():
+            output["latency.{}".format(stat)] = "{:.3f}".format(value)
+        hookenv.action_set(output)
+    elif op == "stop":
+        _request(port, "/shutdown", method="POST")
+        hookenv.log("Webhook server successfully stopped")
+
+
+if __name__ == "__main__":
+    op = hookenv.action_get("operation")
+
+    try:
+        server() if op == "start" else client(op)
+    except Exception as e:
+        msg = str(e)
+        hookenv.action_fail(msg)
+        hookenv.log(msg, level=hookenv.ERROR)
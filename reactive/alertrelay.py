@@ -0,0 +1,55 @@
+from reactive.component import ScriptComponent
+from reactive.config import required
+
+# Hostname and port of the relay in the CharmScaler's Docker network.
+RELAY_HOST = "alertrelay"
+RELAY_PORT = 25
+
+
+def relay_enabled(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: True if alerts are sent through the relay
+    """
+    return bool(cfg["alert_enabled"] and cfg["alert_relay_enabled"])
+
+
+class AlertRelay(ScriptComponent):
+    """
+    Local SMTP relay which batches the Autoscaler's alerts into digests and
+    rate limits them per recipient before they are sent to the configured
+    SMTP server. The container only runs if the relay is enabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param tag: Docker image tag
+    :type tag: str
+    """
+    def __init__(self, cfg, image, tag):
+        super().__init__("alertrelay", "relay.py", relay_enabled(cfg),
+                         image=image, tag=tag)
+
+    def compose_context(self, cfg):
+        return compose_config(cfg)
+
+
+def compose_config(cfg):
+    """
+    Generates the relay's config dict.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: dict with the relay's Docker compose config
+    """
+    return {
+        "smtp": {
+            "host": required(cfg, "alert_smtp_host"),
+            "port": required(cfg, "alert_smtp_port"),
+            "ssl": required(cfg, "alert_smtp_ssl"),
+            "username": cfg["alert_smtp_username"],
+            "password": cfg["alert_smtp_password"]
+        },
+        "digest_interval": required(cfg, "alert_digest_interval"),
+        "rate_limit": required(cfg, "alert_rate_limit")
+    }
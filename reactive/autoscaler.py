@@ -1,15 +1,73 @@
-from requests.exceptions import HTTPError
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import socket
+from urllib.parse import urlparse
 
-from charmhelpers.core import hookenv
+from requests.exceptions import HTTPError, RequestException
+import yaml
 
-from reactive.component import ConfigComponent, DockerComponent
-from reactive.config import Config, required
+from charmhelpers.core import hookenv, unitdata
+
+from reactive.alertrelay import RELAY_HOST, RELAY_PORT, relay_enabled
+from reactive.component import (HTTP_TRANSPORTS, ConfigComponent,
+                                DockerComponent)
+from reactive.config import Config, ConfigurationException, required
+from reactive.lifecycle import GATE_HOST, GATE_PORT, lifecycle_enabled
+from reactive.logs import logging_config
+from reactive.querycache import cache_address
+from reactive.replicas import healthy_replicas
+
+# Host directory which is mounted as the Autoscaler's STORAGE_DIR.
+STORAGE_DIR = "/var/lib/elastisys/autoscaler"
+
+# Written next to the persisted instance state once the instance has been
+# started. Describes which blueprint and config the persisted state belongs to.
+MANIFEST_FILE = "charmscaler-{}.json"
+
+# The Autoscaler persists each instance in a directory named after its id.
+INSTANCES_DIR = "instances"
+
+# Retention policy created for the system historian's database.
+RETENTION_POLICY = "charmscaler"
+
+# Seconds to wait for InfluxDB while provisioning the system historian.
+HISTORIAN_TIMEOUT = 10
+
+INFLUXQL_DURATION = re.compile(r"^(INF|([0-9]+(u|ms|s|m|h|d|w))+)$")
+
+# Default seconds to wait for a webhook to connect and to respond.
+WEBHOOK_TIMEOUT = 5
+
+# Warnings of the last scaling rule analysis, shown in the unit's status.
+RULE_WARNINGS_KEY = "charmscaler.rule_warnings"
+HOST_NAMES_KEY = "charmscaler.host_names"
+
+# Units a scaling rule's resize can be given in. A percent resize is relative
+# to the current number of units and a factor is the size to scale to
+# relative to it, e.g., 2 doubles the pool and 0.5 halves it.
+RESIZE_UNITS = ("instances", "percent", "factor")
+
+# Rounding of the number of units added or removed by a proportional resize.
+RESIZE_ROUNDING = {
+    "up": math.ceil,
+    "down": math.floor,
+    "nearest": lambda value: math.floor(value + 0.5)
+}
 
 
 class MetricValidationException(Exception):
     pass
 
 
+class WebhookValidationException(Exception):
+    pass
+
+
 class Autoscaler(DockerComponent, ConfigComponent):
     """
     This class includes the specific instructions and manages the necesssary
@@ -29,23 +87,88 @@ class Autoscaler(DockerComponent, ConfigComponent):
             "start": "autoscaler/instances/{}/start".format(self.unit_id),
             "stop": "autoscaler/instances/{}/stop".format(self.unit_id)
         }, image=image, tag=tag)
+        self.transport = cfg["autoscaler_api_transport"]
 
-    def compose_up(self, *args, **kwargs):
+    def compose_up(self, cfg, *args, wait=True, **kwargs):
         """
         Generates and runs the Autoscaler's Docker compose file.
 
+        :param cfg: The charm configuration
+        :type cfg: dict
         :raises: component.DockerComponentUnhealthy
+        :raises: config.ConfigurationException
         """
+        if self.transport not in HTTP_TRANSPORTS:
+            raise ConfigurationException(
+                self.compose_config,
+                "Invalid Autoscaler API transport '{}', use {}".format(
+                    self.transport, " or ".join(HTTP_TRANSPORTS)))
+
+        # The container gets a new address if it is recreated
+        self._address = None
+
+        self.compose_base.extend(logging_config, cfg)
         self.compose_config.extend(lambda: {"port": self.port})
-        super().compose_up()
+        super().compose_up(wait=wait)
 
-    def initialize(self):
+    @property
+    def manifest_path(self):
+        return os.path.join(STORAGE_DIR, MANIFEST_FILE.format(self.unit_id))
+
+    def adopt(self, storage_dir=None):
         """
-        Render a blueprint configuration and launch an instance using said
-        blueprint.
+        Take over the persisted instance of another unit, e.g., after the
+        snapshot of another unit has been restored. The instance's directory,
+        the ids in its files and the manifest are moved to this unit's
+        instance id, so that it can be restored, see :meth:`restore`.
 
-        :raises: requests.exceptions.RequestException
+        :param storage_dir: Defaults to :data:`STORAGE_DIR`
+        :type storage_dir: str
+        :returns: The id of the adopted instance, or None if there is no
+                  instance of a single other unit
         """
+        storage_dir = storage_dir or STORAGE_DIR
+        own_manifest = os.path.join(storage_dir,
+                                    MANIFEST_FILE.format(self.unit_id))
+        if os.path.exists(own_manifest):
+            return None
+
+        manifests = glob.glob(os.path.join(storage_dir,
+                                           MANIFEST_FILE.format("*")))
+        if len(manifests) != 1:
+            return None
+
+        with open(manifests[0]) as manifest_file:
+            manifest = json.load(manifest_file)
+        old_id = manifest["id"]
+
+        instances = os.path.join(storage_dir, INSTANCES_DIR)
+        instance_dir = os.path.join(instances, self.unit_id)
+        if os.path.isdir(os.path.join(instances, old_id)):
+            # Stale state of this unit is replaced by the adopted instance
+            shutil.rmtree(instance_dir, ignore_errors=True)
+            os.rename(os.path.join(instances, old_id), instance_dir)
+
+        for path in glob.glob(os.path.join(instance_dir, "*.json")):
+            with open(path) as json_file:
+                data = json.load(json_file)
+            if isinstance(data, dict) and data.get("id") == old_id:
+                data["id"] = self.unit_id
+                with open(path, "w") as json_file:
+                    json.dump(data, json_file)
+
+        # The blueprint only holds the instance id
+        manifest.update(id=self.unit_id,
+                        blueprint=self._blueprint().digest())
+        with open(own_manifest, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.remove(manifests[0])
+
+        hookenv.log("Adopted persisted Autoscaler instance {}".format(
+            old_id))
+        return old_id
+
+    def _blueprint(self):
         blueprint_config = Config("blueprint.json", self.name)
 
         blueprint_config.extend(lambda: {
@@ -54,6 +177,17 @@ class Autoscaler(DockerComponent, ConfigComponent):
 
         blueprint_config.render()
 
+        return blueprint_config
+
+    def initialize(self):
+        """
+        Render a blueprint configuration and launch an instance using said
+        blueprint.
+
+        :raises: requests.exceptions.RequestException
+        """
+        blueprint_config = self._blueprint()
+
         with blueprint_config.open() as config_file:
             try:
                 self.send_request("initialize", method="POST",
@@ -84,12 +218,181 @@ class Autoscaler(DockerComponent, ConfigComponent):
         :type cfg: dict
         :param influxdb: InfluxDB information
         :type influxdb: dict
+        :raises: autoscaler.MetricValidationException
         :raises: config.ConfigurationException
         :raises: requests.exceptions.RequestException
         """
+        _check_scaling_rules(cfg, metrics)
         self.config.extend(autoscaler_config, cfg, influxdb, metrics)
+
+        self.config.render()
+        if self.config.has_changed():
+            self._provision_historian(historian_config(cfg, influxdb))
+
         super().configure()
 
+    def _provision_historian(self, historian):
+        """
+        Provision the retention policy configured with historian_retention
+        for the system historian's database, if any. A database which doesn't
+        exist yet is created with the policy as its default. The default
+        policy of an existing database, which may be shared, is left as is and
+        the charm's policy is only created next to it.
+
+        An InfluxDB user which isn't allowed to provision the policy only
+        causes a warning, the history is then kept as InfluxDB sees fit.
+
+        :param historian: System historian config
+        :type historian: dict
+        :raises: config.ConfigurationException
+        """
+        retention = historian["retention"]
+        if not retention:
+            return
+        if not INFLUXQL_DURATION.match(retention):
+            raise ConfigurationException(self.config, (
+                "Invalid historian_retention duration: {}").format(retention))
+
+        url = "http://{}:{}/query".format(historian["host"],
+                                          historian["port"])
+
+        def _query(statement):
+            """
+            :returns: The statement's results and its error, None if it
+                      succeeded
+            :rtype: tuple
+            """
+            try:
+                response = self._session.post(url, params={
+                    "q": statement,
+                    "u": historian["username"] or "",
+                    "p": historian["password"] or ""
+                }, timeout=HISTORIAN_TIMEOUT)
+                # Authorization errors come with an error message
+                if response.status_code not in (401, 403):
+                    response.raise_for_status()
+                body = response.json()
+            except (RequestException, ValueError) as err:
+                raise ConfigurationException(self.config, (
+                    "Could not provision the system historian: {}").format(
+                        err))
+
+            results = body.get("results", [])
+            errors = [error for error in [body.get("error")] +
+                      [result.get("error") for result in results] if error]
+            return results, errors[0] if errors else None
+
+        database = historian["database"].replace('"', '\\"')
+        results, error = _query("SHOW DATABASES")
+        if not error:
+            databases = [row[0] for result in results
+                         for series in result.get("series", [])
+                         for row in series.get("values", [])]
+
+            if historian["database"] in databases:
+                policy = 'RETENTION POLICY "{}" ON "{}" DURATION {} ' \
+                    'REPLICATION 1'.format(RETENTION_POLICY, database,
+                                           retention)
+                _, error = _query("CREATE " + policy)
+                # The policy is altered instead if it already exists
+                if error and "already exists" in error:
+                    _, error = _query("ALTER " + policy)
+                if not error:
+                    hookenv.log((
+                        "The system historian's database {} already exists, "
+                        "its default retention policy is left as is. Make "
+                        "the {} retention policy its default to expire the "
+                        "system history.").format(historian["database"],
+                                                  RETENTION_POLICY),
+                        level=hookenv.WARNING)
+            else:
+                _, error = _query(
+                    'CREATE DATABASE "{}" WITH DURATION {} REPLICATION 1 '
+                    'NAME "{}"'.format(database, retention,
+                                       RETENTION_POLICY))
+
+        if error and "authoriz" in error:
+            hookenv.log((
+                "Not allowed to provision the system historian's retention "
+                "policy: {}").format(error), level=hookenv.WARNING)
+        elif error:
+            raise ConfigurationException(self.config, (
+                "Could not provision the system historian: {}").format(error))
+
+    def restore(self, cfg, influxdb, metrics):
+        """
+        Check if the instance state persisted in the Autoscaler's storage
+        directory can be used as is. That is the case if it was persisted with
+        the same blueprint and config as the ones rendered now, and if the
+        Autoscaler has brought the instance back up in a started state.
+
+        No requests are retried, if anything is off the normal initialize,
+        configure and start procedure should be followed instead.
+
+        :param cfg: The charm configuration
+        :type cfg: dict
+        :param influxdb: InfluxDB information
+        :type influxdb: dict
+        :param metrics: Metric definitions
+        :type metrics: list
+        :returns: True if the persisted instance is up to date and started
+        :raises: autoscaler.MetricValidationException
+        :raises: config.ConfigurationException
+        """
+        _check_scaling_rules(cfg, metrics)
+
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return False
+
+        if manifest.get("blueprint") != self._blueprint().digest():
+            return False
+
+        self.config.extend(autoscaler_config, cfg, influxdb, metrics)
+        self.config.render()
+
+        if manifest.get("config") != self.config.digest():
+            return False
+
+        try:
+            response = self._session.get(self._get_url("status"))
+            response.raise_for_status()
+            state = response.json().get("state")
+        except (RequestException, ValueError) as err:
+            hookenv.log("Autoscaler status error: {}".format(err))
+            return False
+
+        if state != "STARTED":
+            return False
+
+        # The persisted instance already runs with this config
+        self.config.commit()
+
+        hookenv.log("Restored persisted Autoscaler instance {}".format(
+            self.unit_id))
+        return True
+
+    def persist(self):
+        """
+        Write the manifest which ties the persisted instance state to the
+        current blueprint and config, see :meth:`restore`.
+        """
+        manifest = {
+            "id": self.unit_id,
+            "blueprint": self._blueprint().digest(),
+            "config": self.config.digest()
+        }
+
+        try:
+            os.makedirs(STORAGE_DIR, exist_ok=True)
+            with open(self.manifest_path, "w") as manifest_file:
+                json.dump(manifest, manifest_file)
+        except OSError as err:
+            hookenv.log("Could not write instance manifest: {}".format(err),
+                        level=hookenv.WARNING)
+
     def start(self):
         """
         Start the Autoscaler.
@@ -107,6 +410,56 @@ class Autoscaler(DockerComponent, ConfigComponent):
         self.send_request("stop", method="POST")
 
 
+def webhooks_config(cfg):
+    """
+    Parses the alert_webhooks option, a YAML list with a mapping per webhook.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: list of webhook configuration dicts
+    :raises: autoscaler.WebhookValidationException
+    """
+    try:
+        webhooks = yaml.safe_load(cfg["alert_webhooks"] or "") or []
+    except yaml.YAMLError as err:
+        raise WebhookValidationException(
+            "Invalid alert_webhooks option: {}".format(err))
+
+    if not isinstance(webhooks, list):
+        raise WebhookValidationException(
+            "Invalid alert_webhooks option: not a list")
+
+    config = []
+    for webhook in webhooks:
+        if not isinstance(webhook, dict):
+            raise WebhookValidationException(
+                "Invalid webhook: {}".format(webhook))
+
+        url = str(webhook.get("url", ""))
+        if urlparse(url).scheme not in ("http", "https"):
+            raise WebhookValidationException(
+                "Invalid webhook URL: '{}'".format(url))
+
+        try:
+            timeout = float(webhook.get("timeout", WEBHOOK_TIMEOUT))
+        except (TypeError, ValueError):
+            timeout = 0
+        if timeout <= 0:
+            raise WebhookValidationException(
+                "Invalid webhook timeout for {}".format(url))
+
+        levels = webhook.get("levels") or required(cfg, "alert_levels")
+        config.append({
+            "url": url,
+            "levels": str(levels).split(),
+            "timeout": int(timeout * 1000),
+            "username": webhook.get("username"),
+            "password": webhook.get("password")
+        })
+
+    return config
+
+
 def alerts_config(cfg):
     """
     Generates the alerts config dict.
@@ -114,22 +467,49 @@ def alerts_config(cfg):
     :param cfg: The charm configuration
     :type cfg: dict
     :returns: dict with alert configuration options
+    :raises: autoscaler.WebhookValidationException
     """
-    if not required(cfg, "alert_enabled"):
+    webhooks = webhooks_config(cfg)
+
+    if not required(cfg, "alert_enabled") and not webhooks:
         return None
 
-    return {
-        "recipients": required(cfg, "alert_receivers").split(),
-        "levels": required(cfg, "alert_levels").split(),
-        "sender": required(cfg, "alert_sender"),
-        "smtp": {
+    config = {
+        "duplicate_suppression": required(cfg,
+                                          "alert_duplicate_suppression"),
+        "smtp": None,
+        "webhooks": webhooks
+    }
+
+    if not required(cfg, "alert_enabled"):
+        return config
+
+    if relay_enabled(cfg):
+        # The relay sends the alerts on to the configured SMTP server
+        smtp = {
+            "host": RELAY_HOST,
+            "port": RELAY_PORT,
+            "ssl": False,
+            "username": None,
+            "password": None
+        }
+    else:
+        smtp = {
             "host": required(cfg, "alert_smtp_host"),
             "port": required(cfg, "alert_smtp_port"),
             "ssl": required(cfg, "alert_smtp_ssl"),
             "username": required(cfg, "alert_smtp_username"),
             "password": required(cfg, "alert_smtp_password")
         }
-    }
+
+    config.update({
+        "recipients": required(cfg, "alert_receivers").split(),
+        "levels": required(cfg, "alert_levels").split(),
+        "sender": required(cfg, "alert_sender"),
+        "smtp": smtp
+    })
+
+    return config
 
 
 def influxdb_config(influxdb):
@@ -148,6 +528,152 @@ def influxdb_config(influxdb):
     }
 
 
+def metrics_influxdb_config(cfg, influxdb):
+    """
+    Generates the config dict of the InfluxDB which the metric streams query,
+    the query cache if there is one.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :returns: dict with InfluxDB configuration options
+    :raises: autoscaler.MetricValidationException
+    """
+    config = influxdb_config(influxdb)
+
+    try:
+        cache = cache_address(cfg)
+    except ValueError as err:
+        raise MetricValidationException(
+            "Invalid query_cache_address: {}".format(err))
+
+    if cache:
+        # The cache passes the credentials on to InfluxDB
+        config["host"], config["port"] = cache
+
+    return config
+
+
+def shard_metrics(cfg, metrics):
+    """
+    Spread the metrics over the metric streamers, either with all of a
+    database's metrics in the same streamer or by the hash of the metric
+    names. Streamers without metrics are left out.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: list of metric definition lists, one per streamer
+    :raises: autoscaler.MetricValidationException
+    """
+    shards = int(cfg["metric_streamer_shards"])
+    shard_by = cfg["metric_shard_by"]
+
+    if shards < 1:
+        raise MetricValidationException(
+            "There must be at least one metric streamer shard")
+
+    if shard_by == "database":
+        databases = sorted(set(metric["database"] for metric in metrics))
+
+        def _shard(metric):
+            return databases.index(metric["database"]) % shards
+    elif shard_by == "hash":
+        def _shard(metric):
+            digest = hashlib.md5(metric["name"].encode("utf-8")).hexdigest()
+            return int(digest, 16) % shards
+    else:
+        raise MetricValidationException(
+            "Invalid metric shard key '{}', use database or hash".format(
+                shard_by))
+
+    sharded = [[] for _ in range(shards)]
+    for metric in metrics:
+        sharded[_shard(metric)].append(metric)
+
+    return [shard for shard in sharded if shard]
+
+
+def metric_streamers_config(cfg, influxdb, metrics):
+    """
+    Generates the config of the metric streamers. The metric shards are
+    assigned to the healthy InfluxDB replicas in turn.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: list of dicts with the InfluxDB configuration options and the
+              metrics of each streamer
+    :raises: autoscaler.MetricValidationException
+    """
+    try:
+        replicas = healthy_replicas(cfg, influxdb)
+    except ValueError as err:
+        raise MetricValidationException(
+            "Invalid InfluxDB read replica: {}".format(err))
+
+    streamers = []
+    for i, shard in enumerate(shard_metrics(cfg, metrics)):
+        config = metrics_influxdb_config(cfg, influxdb)
+        if cache_address(cfg) is None:
+            # The cache forwards to the first healthy replica itself
+            config["host"], config["port"] = replicas[i % len(replicas)]
+        config["metrics"] = shard
+        streamers.append(config)
+
+    return streamers
+
+
+def cloudpool_url(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: URL of the cloud pool which the Autoscaler resizes, the
+              lifecycle gate if the scaling lifecycle is enabled
+    """
+    if lifecycle_enabled(cfg):
+        # The gate passes the pool size changes on to the Charmpool
+        return "http://{}:{}".format(GATE_HOST, GATE_PORT)
+
+    return required(cfg, "charmpool_url")
+
+
+def historian_config(cfg, influxdb):
+    """
+    Generates the system historian config dict. The historian writes to the
+    InfluxDB of the relation unless a separate host is configured.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :returns: dict with system historian configuration options
+    """
+    if cfg["historian_host"]:
+        config = {
+            "host": cfg["historian_host"],
+            "port": required(cfg, "historian_port"),
+            "username": cfg["historian_username"],
+            "password": cfg["historian_password"]
+        }
+    else:
+        config = influxdb_config(influxdb)
+
+    config.update({
+        "database": required(cfg, "historian_database"),
+        "interval": required(cfg, "historian_reporting_interval"),
+        "batch_size": required(cfg, "historian_batch_size"),
+        "retention": cfg["historian_retention"]
+    })
+
+    return config
+
+
 def _validate_config_options(cfg, options):
     for key, data_type in options:
         # Check if config value is missing
@@ -177,19 +703,456 @@ def _validate_metrics(metrics):
         except ValueError as err:
             raise MetricValidationException("Metric error: {}".format(err))
 
+        if not isinstance(metric.get("where") or "", str):
+            raise MetricValidationException(
+                "Metric error: The where condition of {} is not a "
+                "string".format(metric["name"]))
+
         try:
             for name, rule in metric["rules"].items():
                 _validate_config_options(rule, [
                     ("condition", str),
                     ("threshold", int),
                     ("period", int),
-                    ("resize", int)
+                    ("resize", float)
                 ])
+                _validate_resize(rule)
         except (TypeError, ValueError) as err:
             msg = "Scaling rule '{}' error: {}".format(name, err)
             raise MetricValidationException(msg)
 
 
+def _validate_resize(rule):
+    unit = rule.get("unit", "instances")
+    if unit not in RESIZE_UNITS:
+        raise ValueError("Invalid resize unit: {}".format(unit))
+
+    if unit == "instances":
+        if not float(rule["resize"]).is_integer():
+            raise ValueError("A resize in instances must be a whole number")
+        return
+
+    if unit == "factor" and float(rule["resize"]) <= 0:
+        raise ValueError("A resize factor must be positive")
+    if rule.get("rounding", "up") not in RESIZE_ROUNDING:
+        raise ValueError("Invalid resize rounding: {}".format(
+            rule["rounding"]))
+    if int(rule.get("min_step", 1)) < 0:
+        raise ValueError("The minimum step cannot be negative")
+
+
+def resize_direction(rule):
+    """
+    :param rule: Scaling rule
+    :type rule: dict
+    :returns: 1 if the rule scales out, -1 if it scales in and 0 otherwise
+    """
+    resize = float(rule["resize"])
+    if rule.get("unit", "instances") == "factor":
+        resize -= 1
+    return (resize > 0) - (resize < 0)
+
+
+def resize_step(rule, capacity):
+    """
+    The number of units a scaling rule adds, or removes if negative. A
+    proportional resize is rounded as set by the rule's rounding, "up" by
+    default, and is at least the rule's min_step, 1 by default.
+
+    :param rule: Scaling rule
+    :type rule: dict
+    :param capacity: Current number of units
+    :type capacity: int
+    :returns: int
+    """
+    unit = rule.get("unit", "instances")
+    if unit == "instances":
+        return int(rule["resize"])
+
+    if unit == "percent":
+        change = capacity * float(rule["resize"]) / 100
+    else:
+        change = capacity * (float(rule["resize"]) - 1)
+
+    direction = resize_direction(rule)
+    if not direction:
+        return 0
+
+    # Leave out the float noise, 30% of 10 units is 3 rather than 4 units
+    rounded = RESIZE_ROUNDING[rule.get("rounding", "up")](
+        round(abs(change), 9))
+    return direction * max(int(rounded), int(rule.get("min_step", 1)))
+
+
+def proportional(metrics):
+    """
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: True if any scaling rule resizes relative to the current number
+              of units
+    """
+    return any(rule.get("unit", "instances") != "instances"
+               for metric in metrics
+               for rule in (metric.get("rules") or {}).values())
+
+
+def resolve_resizes(metrics, capacity):
+    """
+    The Autoscaler only resizes by a number of instances. Proportional
+    resizes are resolved against the current number of units, and have to be
+    resolved again whenever it changes.
+
+    :param metrics: Metric definitions
+    :type metrics: list
+    :param capacity: Current number of units
+    :type capacity: int
+    :returns: list of metric definitions with the resolved scaling rules
+    :raises: autoscaler.MetricValidationException
+    """
+    _validate_metrics(metrics)
+
+    resolved = []
+    for metric in metrics:
+        rules = {name: dict(rule, unit="instances",
+                            resize=resize_step(rule, capacity))
+                 for name, rule in metric["rules"].items()}
+        resolved.append(dict(metric, rules=rules))
+
+    return resolved
+
+
+def _condition_range(rule):
+    """
+    The range of metric values for which the rule's condition holds, as a
+    (low, low inclusive, high, high inclusive) tuple.
+    """
+    condition = rule["condition"]
+    threshold = float(rule["threshold"])
+    if condition.startswith("ABOVE"):
+        return threshold, condition == "ABOVE_OR_EQUAL", math.inf, False
+    if condition.startswith("BELOW"):
+        return -math.inf, False, threshold, condition == "BELOW_OR_EQUAL"
+    raise MetricValidationException(
+        "Unknown scaling rule condition: {}".format(condition))
+
+
+def _overlap(a, b):
+    """
+    Returns the width of the overlap between two condition ranges, or None if
+    there is no overlap at all.
+    """
+    low, low_inclusive = max((a[0], a[1]), (b[0], b[1]),
+                             key=lambda bound: (bound[0], not bound[1]))
+    high, high_inclusive = min((a[2], a[3]), (b[2], b[3]),
+                               key=lambda bound: (bound[0], bound[1]))
+    if low < high or low == high and low_inclusive and high_inclusive:
+        return high - low
+    return None
+
+
+def analyze_scaling_rules(cfg, metrics):
+    """
+    Look for scaling rules which are valid but likely to make the pool
+    oscillate: scale-out and scale-in rules on the same metric whose
+    conditions overlap or meet without a band in between, rule periods
+    shorter than the downsample interval and cooldowns shorter than the
+    interval between new data points or scaling decisions.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: list of warning messages
+    :raises: autoscaler.MetricValidationException
+    """
+    _validate_metrics(metrics)
+
+    scaling_interval = required(cfg, "scaling_interval")
+    warnings = []
+
+    for metric in metrics:
+        name = metric["name"]
+        downsample = int(metric["downsample"])
+        cooldown = int(metric["cooldown"])
+        rules = sorted(metric["rules"].items())
+
+        for rule_name, rule in rules:
+            if int(rule["period"]) < downsample:
+                warnings.append(
+                    "{}: rule '{}' period is shorter than the downsample "
+                    "interval".format(name, rule_name))
+
+        scale_out = [(rule_name, _condition_range(rule))
+                     for rule_name, rule in rules
+                     if resize_direction(rule) > 0]
+        scale_in = [(rule_name, _condition_range(rule))
+                    for rule_name, rule in rules
+                    if resize_direction(rule) < 0]
+
+        for out_name, out_range in scale_out:
+            for in_name, in_range in scale_in:
+                width = _overlap(out_range, in_range)
+                if width is None:
+                    # Conditions which meet at the threshold, e.g., ABOVE 50
+                    # and BELOW 50, leave no room for the metric to settle
+                    thresholds = {out_range[0], out_range[2], in_range[0],
+                                  in_range[2]} - {math.inf, -math.inf}
+                    if len(thresholds) == 1:
+                        warnings.append(
+                            "{}: rules '{}' and '{}' have no band between "
+                            "their thresholds".format(name, out_name,
+                                                      in_name))
+                    continue
+
+                if width == math.inf:
+                    problem = "trigger on the same side of their thresholds"
+                elif width > 0:
+                    problem = "have inverted thresholds"
+                else:
+                    problem = "overlap at their threshold"
+                warnings.append("{}: rules '{}' and '{}' {}".format(
+                    name, out_name, in_name, problem))
+
+        if cooldown < scaling_interval:
+            warnings.append(
+                "{}: cooldown is shorter than the scaling interval".format(
+                    name))
+        if cooldown < downsample:
+            warnings.append(
+                "{}: cooldown is shorter than the downsample interval".format(
+                    name))
+
+    return warnings
+
+
+def _check_scaling_rules(cfg, metrics):
+    """
+    Log the scaling rule warnings, in strict mode they are errors instead.
+    The warnings are kept for :func:`rule_warnings`.
+
+    :raises: autoscaler.MetricValidationException
+    """
+    warnings = analyze_scaling_rules(cfg, metrics)
+    unitdata.kv().set(RULE_WARNINGS_KEY, warnings)
+
+    if warnings and required(cfg, "scaling_rules_strict"):
+        raise MetricValidationException(
+            "Scaling rule error: {}".format("; ".join(warnings)))
+
+    for warning in warnings:
+        hookenv.log("Scaling rule warning: {}".format(warning),
+                    level=hookenv.WARNING)
+
+
+def rule_warnings():
+    """
+    :returns: list of the warnings found when the Autoscaler was last
+              configured or restored
+    """
+    return unitdata.kv().get(RULE_WARNINGS_KEY, [])
+
+
+def limit_step(cfg, step):
+    """
+    Limit a number of units added, or removed if negative, to the largest
+    scale-out or scale-in step which may be taken in one scaling interval. A
+    limit of 0 means no limit.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param step: Number of units
+    :type step: int
+    :returns: int
+    :raises: autoscaler.MetricValidationException
+    """
+    max_out = int(cfg["scaling_max_step_out"])
+    max_in = int(cfg["scaling_max_step_in"])
+    if max_out < 0 or max_in < 0:
+        raise MetricValidationException(
+            "Scaling step limits cannot be negative")
+
+    if max_out and step > max_out:
+        return max_out
+    if max_in and step < -max_in:
+        return -max_in
+    return step
+
+
+def limit_steps(cfg, metrics):
+    """
+    Limit the resize of the scaling rules to the largest scale-out and
+    scale-in steps which may be taken in one scaling interval. Proportional
+    resizes are left as they are, they are limited once resolved.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: list of metric definitions with the limited scaling rules
+    :raises: autoscaler.MetricValidationException
+    """
+    limit_step(cfg, 0)
+
+    limited = []
+    for metric in metrics:
+        rules = {}
+        for name, rule in metric["rules"].items():
+            if rule.get("unit", "instances") == "instances":
+                rule = dict(rule, resize=limit_step(cfg, int(rule["resize"])))
+            rules[name] = rule
+        limited.append(dict(metric, rules=rules))
+
+    return limited
+
+
+def scale_target(scale_relation):
+    """
+    The application being scaled, its units and the private addresses of
+    their hosts, as read from the scalable charm relation.
+
+    :param scale_relation: Relation object for the charm that is autoscaled
+    :type scale_relation: JujuInfoClient
+    :returns: dict with the application, units and addresses
+    """
+    target = {"application": None, "units": [], "addresses": []}
+
+    if scale_relation is None:
+        return target
+
+    for relation_id in scale_relation.conversation().relation_ids:
+        target["application"] = hookenv.remote_service_name(relation_id)
+        for unit in sorted(hookenv.related_units(relation_id)):
+            target["units"].append(unit)
+            address = hookenv.relation_get("private-address", unit,
+                                           relation_id)
+            if address and address not in target["addresses"]:
+                target["addresses"].append(address)
+
+    return target
+
+
+def host_names(addresses):
+    """
+    The names which Telegraf and other agents tag a host's series with, by
+    default the hostname. Each address is resolved to its hostname, both
+    fully qualified and short, and is kept itself for agents which are set
+    up to tag with the address.
+
+    An address is only resolved the first time it is seen, the names are
+    kept in the unit's key-value store for as long as the address is given.
+
+    :param addresses: Host addresses
+    :type addresses: list
+    :returns: list of the hostnames and addresses
+    """
+    kv = unitdata.kv()
+    resolved = kv.get(HOST_NAMES_KEY, {})
+
+    names = []
+    for address in addresses:
+        if address not in resolved:
+            try:
+                hostname, aliases, _ = socket.gethostbyaddr(address)
+                resolved[address] = [hostname] + aliases
+            except (OSError, UnicodeError):
+                hookenv.log("Could not resolve the hostname of {}".format(
+                    address), level=hookenv.WARNING)
+                resolved[address] = []
+
+        for name in resolved[address]:
+            if name:
+                names.extend([name, name.split(".")[0]])
+        names.append(address)
+
+    kv.set(HOST_NAMES_KEY, {address: resolved[address]
+                            for address in addresses})
+
+    return sorted(set(names), key=names.index)
+
+
+def _influxql_string(value):
+    return "'{}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+
+
+def _influxql_identifier(value):
+    return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def _tag_in(tag, values):
+    """
+    InfluxQL condition which holds if the tag has any of the values.
+    """
+    tag = _influxql_identifier(tag)
+
+    if not values:
+        # A tag can't be both empty and non-empty, nothing is matched
+        return "{0} = '' AND {0} != ''".format(tag)
+
+    return " OR ".join("{} = {}".format(tag, _influxql_string(value))
+                       for value in values)
+
+
+def scope_filter(cfg, target):
+    """
+    Generates the InfluxQL condition which limits the metric queries to the
+    series of the application being scaled, see the metric_scope option.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param target: The application being scaled, see :func:`scale_target`
+    :type target: dict
+    :returns: InfluxQL condition, or None if the queries are not scoped
+    :raises: autoscaler.MetricValidationException
+    """
+    scope = cfg["metric_scope"]
+
+    if not scope:
+        return None
+    if scope == "application":
+        applications = [target["application"]] if target["application"] \
+            else []
+        return _tag_in(required(cfg, "metric_application_tag"), applications)
+    if scope == "units":
+        return _tag_in(required(cfg, "metric_unit_tag"), target["units"])
+    if scope == "hosts":
+        return _tag_in(required(cfg, "metric_host_tag"),
+                       host_names(target["addresses"]))
+
+    raise MetricValidationException(
+        "Invalid metric scope '{}', use application, units, hosts or leave "
+        "it empty".format(scope))
+
+
+def scope_metrics(cfg, metrics, target):
+    """
+    Combine the scope filter with the metrics' own where conditions.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param metrics: Metric definitions
+    :type metrics: list
+    :param target: The application being scaled, see :func:`scale_target`
+    :type target: dict
+    :returns: list of metric definitions with the where condition of their
+              queries
+    :raises: autoscaler.MetricValidationException
+    """
+    scope = scope_filter(cfg, target)
+
+    scoped = []
+    for metric in metrics:
+        conditions = [condition for condition in (scope, metric.get("where"))
+                      if condition]
+        if len(conditions) > 1:
+            where = " AND ".join("({})".format(condition)
+                                 for condition in conditions)
+        else:
+            where = conditions[0] if conditions else None
+        scoped.append(dict(metric, where=where))
+
+    return scoped
+
+
 def autoscaler_config(cfg, influxdb, metrics):
     """
     Generates the Autoscaler's config dict.
@@ -199,11 +1162,13 @@ def autoscaler_config(cfg, influxdb, metrics):
     :returns: dict with the Autoscaler's configuration
     """
     _validate_metrics(metrics)
+    metrics = limit_steps(cfg, metrics)
 
     return {
         "name": "{} Autoscaler".format(required(cfg, "name")),
         "alert": alerts_config(cfg),
-        "influxdb": influxdb_config(influxdb),
+        "metric_streamers": metric_streamers_config(cfg, influxdb, metrics),
+        "historian": historian_config(cfg, influxdb),
         "metrics": metrics,
         "metric": {
             "poll_interval": required(cfg, "metric_poll_interval")
@@ -214,6 +1179,6 @@ def autoscaler_config(cfg, influxdb, metrics):
             "interval": required(cfg, "scaling_interval")
         },
         "cloudpool": {
-            "url": required(cfg, "charmpool_url")
+            "url": cloudpool_url(cfg)
         }
     }
@@ -1,5 +1,6 @@
 from reactive.component import DockerComponent
 from reactive.config import required
+from reactive.logs import logging_config
 
 
 class Charmpool(DockerComponent):
@@ -14,14 +15,15 @@ class Charmpool(DockerComponent):
     def __init__(self, cfg, image, tag):
         super().__init__("charmpool", image=image, tag=tag)
 
-    def compose_up(self, cfg, application):
+    def compose_up(self, cfg, application, wait=True):
         """
         Generates and runs the Charmpool's Docker compose file.
 
         :raises: component.DockerComponentUnhealthy
         """
+        self.compose_base.extend(logging_config, cfg)
         self.compose_config.extend(compose_config, cfg, application)
-        super().compose_up()
+        super().compose_up(wait=wait)
 
 
 def compose_config(cfg, application):
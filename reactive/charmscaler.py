@@ -1,16 +1,37 @@
 import os
+from subprocess import CalledProcessError
 
 from requests.exceptions import HTTPError
 
 from charmhelpers.core import hookenv
-from charms.reactive import (all_states, hook, is_state, remove_state,
-                             set_state, when, when_all, when_not)
-
-from reactive.autoscaler import Autoscaler, MetricValidationException
+from charms.reactive import (RelationBase, all_states, hook, is_state,
+                             remove_state, set_state, when, when_all,
+                             when_not)
+from charms.reactive.helpers import data_changed
+
+from reactive.alertrelay import AlertRelay
+from reactive.autoscaler import (Autoscaler, MetricValidationException,
+                                 WebhookValidationException, proportional,
+                                 resolve_resizes, rule_warnings,
+                                 scale_target, scope_metrics)
 from reactive.charmpool import Charmpool
 from reactive.component import (DockerComponent, DockerComponentStarting,
                                 DockerComponentUnhealthy)
-from reactive.config import ConfigurationException
+from reactive.config import (ConfigurationException,
+                             ConfigurationRequiredException)
+from reactive.convergence import spawn_worker
+from reactive import debounce
+from reactive.docker_engine import DockerEngineError
+from reactive.juju_api import JujuAPI, JujuAPIError
+from reactive.lifecycle import (LifecycleGate, configure_lifecycle_trigger,
+                                lifecycle_enabled, remove_lifecycle_trigger,
+                                sync_lifecycle)
+from reactive.logs import LOG_DIR, configure_logrotate, remove_logrotate
+from reactive.querycache import QueryCache
+from reactive.replicas import check_replicas
+from reactive.supervisor import (CrashLoopException, Supervisor,
+                                 configure_supervisor, remove_supervisor)
+from reactive import warmpool
 
 cfg = hookenv.config()
 
@@ -18,10 +39,20 @@ AUTOSCALER_VERSION = cfg["autoscaler_version"]
 CHARMPOOL_VERSION = cfg["charmpool_version"]
 
 components = [
+    AlertRelay(cfg, image=cfg["alert_relay_image"],
+               tag=cfg["alert_relay_version"]),
     Charmpool(cfg, image=cfg["charmpool_image"], tag=CHARMPOOL_VERSION),
+    LifecycleGate(cfg, image=cfg["lifecycle_image"],
+                  tag=cfg["lifecycle_version"]),
+    QueryCache(cfg, image=cfg["query_cache_image"],
+               tag=cfg["query_cache_version"]),
     Autoscaler(cfg, image=cfg["autoscaler_image"], tag=AUTOSCALER_VERSION)
 ]
 
+# Leadership setting naming the unit which runs the started Autoscaler
+# instance. Setting it tells the previous leader to stand down.
+ACTIVE_UNIT = "active_unit"
+
 # All CharmScaler states, each state depends on the states before it
 states = [
     "charmscaler.installed",
@@ -49,7 +80,7 @@ def _execute(method, *args, classinfo=None, pre_healthcheck=True, **kwargs):
     :type method: str
     :param classinfo: Class from which the component needs to be an instance or
                       a subclass of for the method to be called on it.
-    :type classinfo: type
+    :type classinfo: type or tuple of types
     :param pre_healthcheck: If True, a Docker healthcheck will be executed on
                             the components before continuing with the normal
                             operation.
@@ -83,7 +114,9 @@ def _execute(method, *args, classinfo=None, pre_healthcheck=True, **kwargs):
         msg = "Error while configuring {}: {}".format(err.config.filename, err)
     except (DockerComponentUnhealthy, DockerComponentStarting) as err:
         msg = str(err)
-    except MetricValidationException as err:
+    except DockerEngineError as err:
+        msg = "Docker error while executing '{}': {}".format(method, err)
+    except (MetricValidationException, WebhookValidationException) as err:
         msg = str(err)
 
     hookenv.status_set("blocked", msg)
@@ -107,8 +140,8 @@ def _prepare_volume_directories():
     if not os.path.exists('/var/lib/elastisys'):
         os.makedirs('/var/lib/elastisys')
     # container log output
-    if not os.path.exists('/var/log/elastisys'):
-        os.makedirs('/var/log/elastisys')
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
 
 
 @when("docker.available")
@@ -133,27 +166,253 @@ def reinstall():
     Reinstall the CharmScaler on the upgrade-charm hook.
     """
     remove_state("charmscaler.installed")
+    remove_state("charmscaler.converging")
     remove_state("charmscaler.composed")
     remove_state("charmscaler.configured")
     remove_state("charmscaler.started")
     remove_state("charmscaler.available")
 
 
+@when("charmscaler.installed")
+@when_not("charmscaler.logrotate")
+def logrotate():
+    """
+    Set up compressed rotation of the bind-mounted log directory.
+    """
+    try:
+        configure_logrotate(cfg)
+        set_state("charmscaler.logrotate")
+    except ConfigurationRequiredException as err:
+        msg = "Config option '{}' cannot be empty".format(err)
+        hookenv.status_set("blocked", msg)
+        hookenv.log(msg, level=hookenv.ERROR)
+
+
+@when("charmscaler.installed")
+@when_not("charmscaler.supervisor")
+def supervisor():
+    """
+    Set up the cron job which runs the container supervisor every minute.
+    """
+    try:
+        configure_supervisor(cfg)
+        set_state("charmscaler.supervisor")
+    except ConfigurationRequiredException as err:
+        msg = "Config option '{}' cannot be empty".format(err)
+        hookenv.status_set("blocked", msg)
+        hookenv.log(msg, level=hookenv.ERROR)
+
+
+@when("charmscaler.installed")
+@when_not("charmscaler.lifecycle")
+def lifecycle():
+    """
+    Set up the systemd path unit which publishes the lifecycle gate's scaling
+    notices as soon as they are written.
+    """
+    try:
+        configure_lifecycle_trigger(cfg)
+        set_state("charmscaler.lifecycle")
+    except CalledProcessError as err:
+        msg = "Cannot set up the scaling lifecycle trigger: {}".format(err)
+        hookenv.status_set("blocked", msg)
+        hookenv.log(msg, level=hookenv.ERROR)
+
+
 @when("config.changed")
 def reconfigure():
+    """
+    Apply the changed config, also when the units being scaled or the healthy
+    read replicas have changed. Once the components are composed, changes are
+    first left to settle, see :func:`settle`.
+    """
+    if cfg["config_settle_window"] > 0 and is_state("charmscaler.composed"):
+        debounce.record_change()
+        set_state("charmscaler.settling")
+        return
+
+    _apply_config()
+
+
+@when("charmscaler.settling")
+def settle():
+    """
+    Apply the config changes once none have been made for a whole settle
+    window, a timer runs the update-status hook when it has passed.
+    """
+    delay = debounce.remaining(cfg["config_settle_window"])
+
+    if delay > 0:
+        debounce.ensure_timer(delay)
+        hookenv.status_set("maintenance", "Applying config changes in "
+                           "{:.0f}s".format(delay))
+        return
+
+    debounce.clear()
+    remove_state("charmscaler.settling")
+    _apply_config()
+
+
+def _apply_config():
+    remove_state("charmscaler.logrotate")
+    remove_state("charmscaler.supervisor")
+    remove_state("charmscaler.lifecycle")
+    remove_state("charmscaler.converging")
     remove_state("charmscaler.composed")
     remove_state("charmscaler.configured")
     remove_state("charmscaler.available")
 
 
+@hook("scalable-charm-relation-{joined,departed}")
+def scale_relation_changed():
+    """
+    Units were added to or removed from the application being scaled. Metric
+    queries which are scoped to its units or their hosts, and proportional
+    resizes, have to follow.
+    """
+    from reactive import charmscaler_metrics
+    if cfg["metric_scope"] in ("units", "hosts") or \
+            proportional(charmscaler_metrics.get_metrics()):
+        reconfigure()
+
+
+@hook("scaling-lifecycle-relation-{joined,changed,departed}")
+def lifecycle_relation_changed():
+    """
+    Publish the pending scaling notices to new units and pass the units' drain
+    acknowledgements on to the lifecycle gate.
+    """
+    if lifecycle_enabled(cfg):
+        sync_lifecycle()
+
+
 @hook("update-status")
 def update_status():
+    _step_down()
+
+    # Also run by the lifecycle trigger when the gate has new notices
+    if lifecycle_enabled(cfg):
+        sync_lifecycle(place=_place_on_spares
+                       if warmpool.warm_pool_enabled(cfg) else None)
+
+    if hookenv.is_leader():
+        _replenish_spares()
+
+    if is_state("charmscaler.composed") and cfg["supervisor_enabled"]:
+        if not _supervise():
+            return
+
+    # Move the metric streamers off unreachable read replicas
+    if cfg["metric_read_replicas"] and is_state("charmscaler.configured") \
+            and _replicas_changed():
+        reconfigure()
+
     # We only update the status if we're up and running
     if all_states(*states):
         _execute("healthcheck", classinfo=DockerComponent,
                  pre_healthcheck=False)
 
 
+def _place_on_spares(notice):
+    """
+    Place the units of a scale-out notice on the warm spare machines, see
+    :func:`warmpool.place`. Only the leader keeps spares.
+    """
+    if not hookenv.is_leader() or not warmpool.spares() or \
+            warmpool.stats()["notice"] == notice["id"]:
+        return
+
+    scale_relation = RelationBase.from_state("scalable-charm.available")
+    application = scale_target(scale_relation)["application"]
+    if not application:
+        return
+
+    try:
+        api = JujuAPI.connect(cfg)
+        try:
+            warmpool.place(api, application, notice)
+        finally:
+            api.close()
+    except JujuAPIError as err:
+        hookenv.log("Cannot place units on warm spare machines: {}".format(
+            err), level=hookenv.WARNING)
+
+
+def _replenish_spares():
+    """
+    Keep the warm spare machines provisioned, or destroy them once the warm
+    pool is disabled, see :func:`warmpool.replenish`.
+    """
+    if not warmpool.warm_pool_enabled(cfg) and not warmpool.spares():
+        return
+
+    try:
+        api = JujuAPI.connect(cfg)
+        try:
+            warmpool.replenish(cfg, api)
+        finally:
+            api.close()
+    except (JujuAPIError, ValueError) as err:
+        hookenv.log("Cannot replenish the warm spare machines: {}".format(
+            err), level=hookenv.WARNING)
+
+
+def _replicas_changed():
+    """
+    Ping the read replicas, see :func:`replicas.check_replicas`.
+
+    :returns: True if the healthy read replicas have changed since the last
+              check
+    """
+    influxdb = RelationBase.from_state("db-api.available")
+    if influxdb is None:
+        return False
+    try:
+        healthy = check_replicas(cfg, influxdb)
+    except ValueError:
+        # Blocked on configure with the invalid replica
+        return False
+    return data_changed("charmscaler.healthy_replicas", healthy)
+
+
+def _supervise():
+    """
+    Restart the components whose containers have stopped or are unhealthy. A
+    restarted Autoscaler has lost its instance, which is initialized,
+    configured and started again by the handlers.
+
+    :returns: False if a component is crash looping, else True
+    """
+    supervisor = Supervisor(cfg)
+    docker_components = [component for component in components
+                         if isinstance(component, DockerComponent)]
+
+    try:
+        for component in supervisor.unhealthy(docker_components):
+            if not supervisor.restart(component):
+                continue
+
+            remove_state("charmscaler.available")
+            if isinstance(component, Autoscaler):
+                component.config.reset()
+                remove_state("charmscaler.initialized")
+                remove_state("charmscaler.configured")
+                remove_state("charmscaler.started")
+    except CrashLoopException as err:
+        msg = str(err)
+        hookenv.status_set("blocked", msg)
+        hookenv.log(msg, level=hookenv.ERROR)
+        return False
+    except DockerEngineError as err:
+        # The container is gone, compose the components again
+        hookenv.log("Cannot restart container: {}".format(err),
+                    level=hookenv.WARNING)
+        remove_state("charmscaler.composed")
+        remove_state("charmscaler.available")
+
+    return True
+
+
 @when_all(*get_state_dependencies("charmscaler.composed"))
 @when_not("scalable-charm.available")
 def scalable_charm_wait():
@@ -176,12 +435,16 @@ def scalable_charm_lost():
 
 @when_all(*get_state_dependencies("charmscaler.composed"))
 @when_not("charmscaler.composed")
+@when_not("charmscaler.converging")
 @when("scalable-charm.available")
 def compose(scale_relation):
     """
     Start all of the Docker components. If the Compose manifest has changed the
     affected Docker containers will be recreated.
 
+    With asynchronous convergence the hook doesn't wait for the containers to
+    become healthy, see :func:`converge`.
+
     :param scale_relation: Relation object for the charm that is going to be
                            autoscaled.
     :type scale_relation: JujuInfoClient
@@ -203,9 +466,16 @@ def compose(scale_relation):
 
         application = hookenv.remote_service_name(scale_relation_ids[0])
 
-        if _execute("compose_up", cfg, application, classinfo=DockerComponent,
-                    pre_healthcheck=False):
-            set_state("charmscaler.composed")
+        wait = not cfg["async_convergence"]
+        if _execute("compose_up", cfg, application, wait=wait,
+                    classinfo=DockerComponent, pre_healthcheck=False):
+            if wait:
+                set_state("charmscaler.composed")
+            else:
+                set_state("charmscaler.converging")
+                spawn_worker([component.name for component in components
+                              if isinstance(component, DockerComponent) and
+                              component.enabled])
             return
     except ComposeException as err:
         msg = "Error while composing: {}".format(err)
@@ -214,13 +484,91 @@ def compose(scale_relation):
         hookenv.log(msg, level=hookenv.ERROR)
 
 
+@when("charmscaler.converging")
+def converge():
+    """
+    Advance to composed once all of the containers are healthy. Checked on
+    every hook, the worker started by :func:`compose` runs the update-status
+    hook when the containers have stopped starting up.
+    """
+    statuses = [(str(component), component.health_status())
+                for component in components
+                if isinstance(component, DockerComponent)]
+
+    unhealthy = [name for name, status in statuses if status == "unhealthy"]
+    starting = [name for name, status in statuses if status == "starting"]
+
+    if unhealthy:
+        msg = "Unhealthy components: {} - Check the Docker container " \
+              "logs".format(", ".join(unhealthy))
+        hookenv.status_set("blocked", msg)
+        hookenv.log(msg, level=hookenv.ERROR)
+    elif starting:
+        hookenv.status_set("maintenance", "Waiting for {} to start".format(
+            ", ".join(starting)))
+    else:
+        remove_state("charmscaler.converging")
+        set_state("charmscaler.composed")
+
+
+def _restore():
+    """
+    Warm restart from the Autoscaler instance state persisted on disk. If the
+    persisted instance matches the current blueprint and config there is no
+    need to initialize, configure and start it again.
+
+    :returns: True if the instance was restored, else False
+    """
+    # Only the active unit runs a started instance
+    if not _active():
+        return False
+
+    if not all_states("db-api.available", "charmscaler.metrics.available"):
+        return False
+
+    influxdb = RelationBase.from_state("db-api.available")
+
+    for component in components:
+        if isinstance(component, Autoscaler):
+            try:
+                metrics = _scoped_metrics()
+                if not component.restore(cfg, influxdb, metrics):
+                    return False
+            except (ConfigurationException, MetricValidationException,
+                    WebhookValidationException) as err:
+                hookenv.log("Cannot restore persisted instance: {}".format(
+                    err), level=hookenv.DEBUG)
+                return False
+
+    return True
+
+
+def _scoped_metrics():
+    """
+    :returns: list of the metric definitions, with their queries limited to
+              the application being scaled and their proportional resizes
+              resolved against its units
+    :raises: autoscaler.MetricValidationException
+    """
+    from reactive import charmscaler_metrics
+    scale_relation = RelationBase.from_state("scalable-charm.available")
+    target = scale_target(scale_relation)
+    metrics = resolve_resizes(charmscaler_metrics.get_metrics(),
+                              len(target["units"]))
+    return scope_metrics(cfg, metrics, target)
+
+
 @when_all(*get_state_dependencies("charmscaler.initialized"))
 @when_not("charmscaler.initialized")
 def initialize():
     """
-    Initialize the autoscaler.
+    Initialize the autoscaler, or restore it if a persisted instance is found.
     """
-    if _execute("initialize", classinfo=Autoscaler):
+    if _restore():
+        set_state("charmscaler.initialized")
+        set_state("charmscaler.configured")
+        set_state("charmscaler.started")
+    elif _execute("initialize", classinfo=Autoscaler):
         set_state("charmscaler.initialized")
 
 
@@ -241,10 +589,22 @@ def configure(influxdb):
     """
     Configure the autoscaler. This is done at every run, however, if the config
     is unchanged nothing happens.
+
+    If the autoscaler was initialized before the relations were available, a
+    persisted instance can still be restored rather than reconfigured.
     """
-    from reactive import charmscaler_metrics
-    metrics = charmscaler_metrics.get_metrics()
-    if _execute("configure", cfg, influxdb, metrics, classinfo=Autoscaler):
+    try:
+        metrics = _scoped_metrics()
+    except MetricValidationException as err:
+        hookenv.status_set("blocked", str(err))
+        hookenv.log(str(err), level=hookenv.ERROR)
+        return
+
+    if not is_state("charmscaler.started") and _restore():
+        set_state("charmscaler.configured")
+        set_state("charmscaler.started")
+    elif _execute("configure", cfg, influxdb, metrics,
+                  classinfo=(QueryCache, Autoscaler)):
         set_state("charmscaler.configured")
 
 
@@ -252,12 +612,80 @@ def configure(influxdb):
 @when_not("charmscaler.started")
 def start():
     """
-    Start the autoscaler.
+    Start the autoscaler on the active unit. The other units are hot
+    standbys.
     """
-    if _execute("start", classinfo=Autoscaler):
+    if not _active():
+        standby()
+    elif _execute("start", classinfo=Autoscaler):
+        remove_state("charmscaler.standby")
         set_state("charmscaler.started")
 
 
+def standby():
+    """
+    Keep the autoscaler initialized and configured, but stopped, so that it
+    only needs to be started if this unit is elected leader.
+    """
+    if not is_state("charmscaler.standby"):
+        if not _execute("stop", classinfo=Autoscaler):
+            return
+        set_state("charmscaler.standby")
+
+    hookenv.status_set("active", "Standby")
+
+
+@hook("leader-elected")
+def promote():
+    """
+    Take over from the previous leader by making this unit the active unit,
+    which fires leader-settings-changed on the other units. The start handler
+    starts the standby instance.
+    """
+    hookenv.log("Elected leader, starting the autoscaler")
+    hookenv.leader_set({ACTIVE_UNIT: hookenv.local_unit()})
+    remove_state("charmscaler.standby")
+
+
+@hook("leader-settings-changed")
+def leader_changed():
+    _step_down()
+
+
+def _active():
+    """
+    Check if this unit should run the started Autoscaler instance, which is
+    the case for the leader once it has been made the active unit.
+
+    :returns: True if this unit is the active unit
+    """
+    if not hookenv.is_leader():
+        return False
+
+    active_unit = hookenv.leader_get(ACTIVE_UNIT)
+    if not active_unit:
+        # Elected before the active unit was recorded
+        hookenv.leader_set({ACTIVE_UNIT: hookenv.local_unit()})
+        return True
+
+    return active_unit == hookenv.local_unit()
+
+
+def _step_down():
+    """
+    Stop the autoscaler if this unit is no longer the active unit, another
+    unit has taken over.
+    """
+    if _active() or not is_state("charmscaler.started"):
+        return
+
+    hookenv.log("No longer the leader, stopping the autoscaler")
+    if _execute("stop", classinfo=Autoscaler, pre_healthcheck=False):
+        set_state("charmscaler.standby")
+        remove_state("charmscaler.started")
+        remove_state("charmscaler.available")
+
+
 def stop():
     """
     Stop the autoscaler and stop all Docker containers.
@@ -270,9 +698,20 @@ def stop():
 @when_not("charmscaler.available")
 def available():
     """
-    We're good to go!
+    We're good to go! Persist the instance manifest so that the started
+    instance can be restored without being reconfigured.
+
+    Scaling rules which are likely to make the pool oscillate are pointed out
+    in the status.
     """
-    hookenv.status_set("active", "Available")
+    _execute("persist", classinfo=Autoscaler, pre_healthcheck=False)
+
+    msg = "Available"
+    warnings = rule_warnings()
+    if warnings:
+        msg = "Available, scaling rule warnings: {}".format(
+            "; ".join(warnings))
+    hookenv.status_set("active", msg)
     set_state("charmscaler.available")
 
 
@@ -282,4 +721,7 @@ def cleanup():
     Cleanup all components by removing Docker containers and images.
     """
     _execute("cleanup", pre_healthcheck=False, classinfo=DockerComponent)
+    remove_logrotate()
+    remove_supervisor()
+    remove_lifecycle_trigger()
     set_state("charmscaler.cleaned_up")
@@ -3,13 +3,14 @@ import os
 
 import backoff
 from requests import Session
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError, RequestException
 
 from charmhelpers.core import hookenv
-from charms.docker import Compose, Docker
 
 from reactive.config import Config
+from reactive.docker_engine import ComposeProject, get_engine
 from reactive.helpers import backoff_handler
+from reactive.logs import logging_config
 
 # Maximum number of seconds for a container to become healthy at startup.
 HEALTH_STARTUP_RETRY_LIMIT = 60
@@ -20,6 +21,13 @@ HEALTH_RUNTIME_RETRY_LIMIT = 10
 # Number of retries for a failed HTTP request.
 HTTP_RETRY_LIMIT = 5
 
+# Port which the components' REST APIs listen on inside of their containers.
+CONTAINER_HTTP_PORT = 80
+
+# How the charm reaches the REST APIs: through the port published on the host,
+# or straight at the container's address on the Docker network.
+HTTP_TRANSPORTS = ("published", "direct")
+
 
 class Component:
     """
@@ -64,9 +72,17 @@ class DockerComponent(Component):
                          under the folder path named after the component's
                          ':paramref:`name`' parameter.
     :vartype compose_config: :class:`Config`
+    :var compose_base: The Docker Compose base manifest, shared by all of the
+                       Docker components, which the services extend.
+    :vartype compose_base: :class:`Config`
+    :var enabled: Whether the component's container is supposed to run
+    :vartype enabled: bool
     """
     def __init__(self, name, *args, image=None, tag="latest"):
         super().__init__(name, *args)
+        self.enabled = True
+        self.compose_base = Config("docker-compose-base.yml", "common",
+                                   "docker-compose-base.yml")
         self.compose_config = Config("docker-compose.yml", name)
         self.compose_config.extend(lambda: {
             "image": image,
@@ -75,7 +91,7 @@ class DockerComponent(Component):
 
     @property
     def _compose(self):
-        return Compose(os.path.dirname(str(self.compose_config)))
+        return ComposeProject(os.path.dirname(str(self.compose_config)))
 
     @backoff.on_exception(backoff.constant, DockerComponentStarting,
                           max_tries=HEALTH_STARTUP_RETRY_LIMIT, jitter=None,
@@ -98,7 +114,7 @@ class DockerComponent(Component):
         """
         hookenv.log("Healthchecking {}".format(self.name), level=hookenv.DEBUG)
 
-        health = Docker().healthcheck(self.name, verbose=True)
+        health = get_engine().health(self.name)
 
         if not health:
             raise DockerComponentUnhealthy(self)
@@ -109,15 +125,28 @@ class DockerComponent(Component):
         if health["Status"] != "healthy":
             raise DockerComponentUnhealthy(self)
 
-    def compose_up(self):
+    def health_status(self):
+        """
+        The container's health right now, without waiting for it to settle.
+
+        :returns: "healthy", "starting" or "unhealthy"
+        """
+        if not self.enabled:
+            return "healthy"
+        return get_engine().health_status(self.name)
+
+    def compose_up(self, wait=True):
         """
         Generate, render and (re)start the component's Docker Compose services.
 
         If the content of the compose file is unchanged after it has been
         rendered nothing happens.
+
+        :param wait: If True, wait for the containers to become healthy
+        :type wait: bool
         """
-        # TODO Would be nice to have support for multiple compose files and/or
-        #      the project flag in charms.docker.
+        # The project name is read from the .env file, just like
+        # docker-compose does, to keep the container network name.
         #
         # Dotfiles are ignored when creating a charm archive to push to the
         # charmstore. We need to generate the .env files during runtime.
@@ -126,6 +155,7 @@ class DockerComponent(Component):
             compose_env.extend(lambda: {"name": "charmscaler"})
             compose_env.render()
 
+        self.compose_base.render()
         self.compose_config.render()
 
         # TODO This will show up even though a restart might not have occured.
@@ -137,7 +167,8 @@ class DockerComponent(Component):
 
         # Healthcheck Docker containers to make sure that they are working
         # as they should after they have been (re)started.
-        self.healthcheck()
+        if wait:
+            self.healthcheck()
 
     def compose_stop(self):
         self._compose.stop()
@@ -146,6 +177,88 @@ class DockerComponent(Component):
         self._compose.down(rmi=True)
 
 
+class ScriptComponent(DockerComponent):
+    """
+    An optional component which runs one of the charm's Python scripts in a
+    stock Python image. The script is rendered next to the compose file and
+    its digest is passed to the compose file, so that the container is
+    recreated when a charm upgrade changes the script. The container only
+    runs while the component is enabled and is removed otherwise.
+
+    Subclasses provide the rest of the compose config with
+    :meth:`compose_context` and may prepare the host in :meth:`prepare`.
+
+    :param name: Name of the component
+    :type name: str
+    :param script: Filename of the script template
+    :type script: str
+    :param enabled: Whether the component's container is supposed to run
+    :type enabled: bool
+    :param tag: Docker image tag
+    :type tag: str
+    :var script: The script's :class:`Config`
+    :vartype script: :class:`Config`
+    """
+    def __init__(self, name, script, enabled, image=None, tag="latest"):
+        super().__init__(name, image=image, tag=tag)
+        self.enabled = enabled
+        self.script = Config(script, name)
+
+    def prepare(self, cfg):
+        """
+        Called before the script is rendered and the container is started.
+
+        :param cfg: The charm configuration
+        :type cfg: dict
+        """
+        pass
+
+    def compose_context(self, cfg):
+        """
+        :param cfg: The charm configuration
+        :type cfg: dict
+        :returns: dict with the component's own Docker compose config
+        """
+        return {}
+
+    def compose_up(self, cfg, *args, wait=True, **kwargs):
+        """
+        Renders the script and runs the component's Docker compose file, or
+        removes the component's container if it is disabled.
+
+        :param cfg: The charm configuration
+        :type cfg: dict
+        :raises: component.DockerComponentUnhealthy
+        :raises: config.ConfigurationException
+        """
+        if not self.enabled:
+            get_engine().remove(self.name, force=True)
+            return
+
+        self.prepare(cfg)
+        self.script.render()
+
+        self.compose_base.extend(logging_config, cfg)
+        self.compose_config.extend(lambda: {
+            "script": str(self.script),
+            "script_digest": self.script.digest()
+        })
+        self.compose_config.extend(self.compose_context, cfg)
+        super().compose_up(wait=wait)
+
+    def healthcheck(self):
+        if self.enabled:
+            super().healthcheck()
+
+    def compose_stop(self):
+        if self.compose_config.exists():
+            super().compose_stop()
+
+    def cleanup(self):
+        if self.compose_config.exists():
+            super().cleanup()
+
+
 class HTTPComponent(Component):
     """
     Components with a HTTP REST API.
@@ -157,18 +270,34 @@ class HTTPComponent(Component):
     :param paths: The REST API URL paths. The paths are dependent on which
                   operations the component is capable of.
     :type paths: dict
+    :var transport: One of :data:`HTTP_TRANSPORTS`. The direct transport
+                    skips Docker's userland proxy, and falls back to the
+                    published port while the container has no address.
+    :vartype transport: str
     """
     def __init__(self, name, port, paths):
         super().__init__(name)
         self.port = port
         self.paths = paths
+        self.transport = "published"
 
         self._session = Session()
+        self._address = None
+
+    def _base_url(self):
+        if self.transport == "direct":
+            if self._address is None:
+                self._address = get_engine().address(self.name)
+            if self._address:
+                return "http://{}:{}".format(self._address,
+                                             CONTAINER_HTTP_PORT)
+
+        return "http://localhost:{}".format(self.port)
 
     def _get_url(self, path):
         try:
-            return "http://localhost:{port}/{path}".format(
-                port=self.port,
+            return "{base}/{path}".format(
+                base=self._base_url(),
                 path=self.paths[path]
             )
         except KeyError:
@@ -194,20 +323,28 @@ class HTTPComponent(Component):
         """
         url = self._get_url(path)
 
-        if method == "GET":
-            response = self._session.get(url, headers=headers)
-        elif method == "POST":
-            if data_type == "json":
-                response = self._session.post(url, headers=headers, json=data)
-            elif data_type == "file":
-                # Start from the beginning if this has already been read, for
-                # example during a retry
-                data.seek(0)
-                response = self._session.post(url, headers=headers, data=data)
+        try:
+            if method == "GET":
+                response = self._session.get(url, headers=headers)
+            elif method == "POST":
+                if data_type == "json":
+                    response = self._session.post(url, headers=headers,
+                                                  json=data)
+                elif data_type == "file":
+                    # Start from the beginning if this has already been read,
+                    # for example during a retry
+                    data.seek(0)
+                    response = self._session.post(url, headers=headers,
+                                                  data=data)
+                else:
+                    raise Exception("Unhandeled data type: {}".format(
+                        data_type))
             else:
-                raise Exception("Unhandeled data type: {}".format(data_type))
-        else:
-            raise Exception("Unhandeled REST API verb: {}".format(method))
+                raise Exception("Unhandeled REST API verb: {}".format(method))
+        except ConnectionError:
+            # The container might have been recreated with a new address
+            self._address = None
+            raise
 
         hookenv.log("Request URL: {}".format(url), level=hookenv.DEBUG)
         hookenv.log("Response status: {}".format(response.status_code),
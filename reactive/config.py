@@ -1,9 +1,10 @@
+import hashlib
 import os
 
 from charmhelpers.core.hookenv import charm_dir
 from charmhelpers.core.templating import render
 
-from reactive.helpers import data_changed, data_commit
+from reactive.helpers import data_changed, data_commit, data_reset
 
 CONFIG_PATH = "files"
 
@@ -106,6 +107,12 @@ class Config:
         with self.open() as config_file:
             data_commit(self.unitdata_key, config_file.read())
 
+    def reset(self):
+        """
+        Forget the committed config, e.g., when the component has lost it.
+        """
+        data_reset(self.unitdata_key)
+
     def render(self):
         """
         Render the configuration data to the configuration file located at
@@ -116,5 +123,14 @@ class Config:
     def open(self, mode='rb'):
         return open(self.target, mode)
 
+    def digest(self, hash_type="md5"):
+        """
+        Hash of the rendered config file, the same hash which is stored in the
+        unit data store on commit.
+        """
+        alg = getattr(hashlib, hash_type)
+        with self.open() as config_file:
+            return alg(config_file.read()).hexdigest()
+
     def exists(self):
         return os.path.isfile(self.target)
@@ -0,0 +1,97 @@
+"""
+Asynchronous health convergence. Rather than blocking the hook until the
+launched containers are healthy, a detached worker waits for them and then
+runs the update-status hook, which lets the handlers continue from
+`charmscaler.composed`.
+
+The worker is run as `python -m reactive.convergence <unit> <container>...`
+from the charm directory.
+"""
+import os
+import subprocess
+import sys
+import time
+
+from charmhelpers.core import hookenv
+
+from reactive.docker_engine import DockerEngine
+
+# Seconds the worker waits for the containers to leave the starting state.
+CONVERGENCE_TIMEOUT = 600
+
+# Seconds between the worker's health polls.
+CONVERGENCE_POLL_INTERVAL = 2
+
+
+def spawn_update_status(module, *args):
+    """
+    Start `python -m <module> <unit> <args>...` from the charm directory,
+    detached from the hook. The module runs the update-status hook with
+    :func:`run_update_status` when it is done waiting.
+
+    :param module: Name of the module to run
+    :type module: str
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    with open(os.devnull, "wb") as devnull:
+        subprocess.Popen([sys.executable, "-m", module, hookenv.local_unit()] +
+                         [str(arg) for arg in args],
+                         cwd=hookenv.charm_dir(), env=env,
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         start_new_session=True)
+
+
+def run_update_status(unit):
+    # Runs once the hook which spawned the process has released the lock
+    subprocess.call(["juju-run", unit, "hooks/update-status"])
+
+
+def spawn_worker(names):
+    """
+    Start a worker, detached from the hook, which triggers the update-status
+    hook once none of the containers are starting anymore.
+
+    :param names: Container names
+    :type names: list
+    """
+    spawn_update_status("reactive.convergence", *names)
+
+    hookenv.log("Waiting for {} to become healthy in the background".format(
+        ", ".join(names)))
+
+
+def settled(engine, names):
+    """
+    :returns: True if none of the containers are starting
+    """
+    return all(engine.health_status(name) != "starting" for name in names)
+
+
+def wait(engine, names, timeout=CONVERGENCE_TIMEOUT,
+         interval=CONVERGENCE_POLL_INTERVAL):
+    """
+    Wait until none of the containers are starting.
+
+    :returns: True if the containers settled within the timeout
+    """
+    deadline = time.time() + timeout
+    while not settled(engine, names):
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def main(unit, names):
+    engine = DockerEngine()
+    try:
+        wait(engine, names)
+    finally:
+        engine.close()
+
+    run_update_status(unit)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2:])
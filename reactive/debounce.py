@@ -0,0 +1,88 @@
+"""
+Debouncing of config changes. Options are often set one after the other, and
+each config-changed hook would otherwise recompose and reconfigure all of the
+components. Within the settle window the changes are only recorded, a
+detached timer runs the update-status hook once the window has passed and
+the changes are then applied in one go.
+
+The timer is run as `python -m reactive.debounce <unit> <seconds>` from the
+charm directory.
+"""
+import sys
+import time
+
+from charmhelpers.core import unitdata
+
+from reactive.convergence import run_update_status, spawn_update_status
+
+LAST_CHANGE_KEY = "charmscaler.settle.last_change"
+TIMER_DUE_KEY = "charmscaler.settle.timer_due"
+
+
+def spawn_timer(delay):
+    """
+    Start a timer, detached from the hook, which triggers the update-status
+    hook after the delay.
+
+    :param delay: Seconds to wait
+    :type delay: float
+    """
+    spawn_update_status("reactive.debounce", delay)
+    unitdata.kv().set(TIMER_DUE_KEY, time.time() + delay)
+
+
+def record_change(now=None):
+    """
+    Record a config change, the settle window starts over.
+    """
+    now = time.time() if now is None else now
+    unitdata.kv().set(LAST_CHANGE_KEY, now)
+
+
+def remaining(window, now=None):
+    """
+    :param window: The settle window in seconds
+    :type window: int
+    :returns: Seconds left until the config has settled, 0 if it has
+    """
+    now = time.time() if now is None else now
+    last_change = unitdata.kv().get(LAST_CHANGE_KEY, 0)
+    return max(0, last_change + window - now)
+
+
+def ensure_timer(delay, now=None):
+    """
+    Spawn a timer unless one is already due before the config has settled,
+    which will then spawn the next one. Bursts of changes are covered by a
+    few timers rather than one per change.
+
+    :param delay: Seconds until the config has settled
+    :type delay: float
+    """
+    now = time.time() if now is None else now
+    due = unitdata.kv().get(TIMER_DUE_KEY)
+
+    if due is None or due <= now:
+        spawn_timer(delay)
+
+
+def force():
+    """
+    End the settle window now, the changes are applied on the next hook.
+    """
+    unitdata.kv().set(LAST_CHANGE_KEY, 0)
+
+
+def clear():
+    kv = unitdata.kv()
+    kv.unset(LAST_CHANGE_KEY)
+    kv.unset(TIMER_DUE_KEY)
+
+
+def main(unit, delay):
+    time.sleep(delay)
+    run_update_status(unit)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], float(sys.argv[2]))
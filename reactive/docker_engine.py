@@ -0,0 +1,569 @@
+import hashlib
+import http.client
+import json
+import os
+import re
+import shlex
+import socket
+from urllib.parse import quote, urlencode
+
+import yaml
+
+from charmhelpers.core import hookenv
+
+# Unix socket of the local Docker Engine.
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+# Docker Engine API version, supported by Docker 1.13 and later.
+API_VERSION = "v1.25"
+
+# Seconds to wait for a container to stop before it is killed.
+STOP_TIMEOUT = 10
+
+# Container label holding the hash of the service definition which the
+# container was created from.
+CONFIG_HASH_LABEL = "com.elastisys.charmscaler.config-hash"
+
+_engine = None
+
+
+class DockerEngineError(Exception):
+    """
+    Error response from the Docker Engine API.
+
+    :param status: HTTP status code
+    :type status: int
+    :param message: Error message returned by the Docker daemon
+    :type message: str
+    """
+    def __init__(self, status, message):
+        self.status = status
+        msg = "Docker Engine API error ({}): {}".format(status, message)
+        super().__init__(msg)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a unix socket.
+
+    :param path: Path to the unix socket
+    :type path: str
+    """
+    def __init__(self, path, timeout=STOP_TIMEOUT + 50):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngine:
+    """
+    In-process Docker Engine API client. All requests are sent over one
+    persistent connection to the Docker daemon's unix socket, rather than
+    spawning a docker or docker-compose process for every operation.
+
+    :param socket_path: Path to the Docker daemon's unix socket
+    :type socket_path: str
+    """
+    def __init__(self, socket_path=DOCKER_SOCKET):
+        self.socket_path = socket_path
+        self._connection = UnixHTTPConnection(socket_path)
+
+    def close(self):
+        self._connection.close()
+
+    def request(self, method, path, params=None, body=None):
+        """
+        Send a request to the Docker Engine API.
+
+        :param method: Request method
+        :param path: API path, without the version prefix
+        :param params: Query parameters
+        :param body: Request data which is sent as JSON
+        :returns: The decoded JSON response or None if the response is empty
+        :raises DockerEngineError: The Docker daemon returned an error
+        """
+        content_type, content = self._request(method, path, params, body)
+
+        if content and content_type.startswith("application/json"):
+            return json.loads(content.decode("utf-8"))
+
+        return None
+
+    def _request(self, method, path, params=None, body=None):
+        url = "/{}{}".format(API_VERSION, path)
+        if params:
+            url = "{}?{}".format(url, urlencode(params))
+
+        headers = {}
+        data = None
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            data = json.dumps(body).encode("utf-8")
+
+        try:
+            response = self._send(method, url, data, headers)
+        except (http.client.HTTPException, ConnectionError):
+            # The daemon might have closed the idle connection, reconnect once
+            self._connection.close()
+            response = self._send(method, url, data, headers)
+
+        status, content_type, content = response
+
+        if status >= 400:
+            try:
+                message = json.loads(content.decode("utf-8"))["message"]
+            except (ValueError, KeyError, TypeError):
+                message = content.decode("utf-8", "replace").strip()
+            raise DockerEngineError(status, message)
+
+        return content_type, content
+
+    def _send(self, method, url, data, headers):
+        self._connection.request(method, url, body=data, headers=headers)
+        response = self._connection.getresponse()
+        # The response has to be read in full before the connection is reused
+        content = response.read()
+        return response.status, response.getheader("Content-Type", ""), content
+
+    def inspect(self, name):
+        """
+        :returns: The container details or None if it doesn't exist
+        """
+        try:
+            return self.request("GET", "/containers/{}/json".format(
+                quote(name)))
+        except DockerEngineError as err:
+            if err.status == 404:
+                return None
+            raise
+
+    def address(self, name):
+        """
+        :returns: The container's IP address in its first network, or None if
+                  the container doesn't exist or isn't connected
+        """
+        container = self.inspect(name)
+        if container is None:
+            return None
+
+        networks = container["NetworkSettings"].get("Networks") or {}
+        for _, network in sorted(networks.items()):
+            if network.get("IPAddress"):
+                return network["IPAddress"]
+        return None
+
+    def image_exists(self, image):
+        try:
+            self.request("GET", "/images/{}/json".format(quote(image)))
+        except DockerEngineError as err:
+            if err.status == 404:
+                return False
+            raise
+        return True
+
+    def pull(self, image):
+        """
+        Pull an image from its registry. The progress is streamed back until
+        the pull is done, errors are reported within the stream.
+
+        :param image: Image name, with or without a tag
+        :type image: str
+        :raises DockerEngineError: The image could not be pulled
+        """
+        repository, tag = image, "latest"
+        if ":" in image.rsplit("/", 1)[-1]:
+            repository, tag = image.rsplit(":", 1)
+
+        _, content = self._request("POST", "/images/create", params={
+            "fromImage": repository,
+            "tag": tag
+        })
+
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            progress = json.loads(line)
+            if "error" in progress:
+                raise DockerEngineError(500, progress["error"])
+
+    def health(self, name):
+        """
+        :returns: False if the container isn't running, None if it has no
+                  healthcheck, else the container's health details
+        """
+        container = self.inspect(name)
+
+        if not container or not container["State"]["Running"]:
+            return False
+
+        return container["State"].get("Health")
+
+    def health_status(self, name):
+        """
+        :returns: "healthy", "starting" or "unhealthy", a running container
+                  without a healthcheck is healthy
+        """
+        health = self.health(name)
+
+        if health is None:
+            return "healthy"
+        if not health:
+            return "unhealthy"
+        if health["Status"] in ("healthy", "starting"):
+            return health["Status"]
+        return "unhealthy"
+
+    def stats(self, name):
+        """
+        Stream resource usage statistics of a container, the Docker daemon
+        sends a new sample every second.
+
+        The stream never ends by itself so it is read over a connection of
+        its own, which is closed when the generator is.
+
+        :returns: Generator of stats samples
+        """
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            connection.request("GET", "/{}/containers/{}/stats".format(
+                API_VERSION, quote(name)))
+            response = connection.getresponse()
+
+            if response.status >= 400:
+                content = response.read().decode("utf-8", "replace")
+                raise DockerEngineError(response.status, content.strip())
+
+            for line in response:
+                if line.strip():
+                    yield json.loads(line.decode("utf-8"))
+        finally:
+            connection.close()
+
+    def create(self, name, spec):
+        return self.request("POST", "/containers/create", params={
+            "name": name
+        }, body=spec)
+
+    def start(self, name):
+        self.request("POST", "/containers/{}/start".format(quote(name)))
+
+    def stop(self, name, timeout=STOP_TIMEOUT):
+        self.request("POST", "/containers/{}/stop".format(quote(name)),
+                     params={"t": timeout})
+
+    def pause(self, name):
+        self.request("POST", "/containers/{}/pause".format(quote(name)))
+
+    def unpause(self, name):
+        self.request("POST", "/containers/{}/unpause".format(quote(name)))
+
+    def restart(self, name, timeout=STOP_TIMEOUT):
+        self.request("POST", "/containers/{}/restart".format(quote(name)),
+                     params={"t": timeout})
+
+    def logs(self, name, tail=100):
+        """
+        The last lines written by a container to stdout and stderr.
+
+        :param name: Container name
+        :type name: str
+        :param tail: Number of lines
+        :type tail: int
+        :returns: list of lines, prefixed with their timestamps
+        """
+        container = self.inspect(name)
+        if container is None:
+            return []
+
+        _, content = self._request("GET", "/containers/{}/logs".format(
+            quote(name)), params={
+                "stdout": 1,
+                "stderr": 1,
+                "timestamps": 1,
+                "tail": tail
+            })
+
+        if not container["Config"].get("Tty"):
+            content = _demultiplex(content)
+
+        return content.decode("utf-8", "replace").splitlines()
+
+    def remove(self, name, force=False):
+        try:
+            self.request("DELETE", "/containers/{}".format(quote(name)),
+                         params={"force": int(force)})
+        except DockerEngineError as err:
+            if err.status != 404:
+                raise
+
+    def remove_image(self, image):
+        try:
+            self.request("DELETE", "/images/{}".format(quote(image)))
+        except DockerEngineError as err:
+            # Missing, or still in use by other containers
+            if err.status not in (404, 409):
+                raise
+
+    def ensure_network(self, name, project):
+        try:
+            self.request("GET", "/networks/{}".format(quote(name)))
+        except DockerEngineError as err:
+            if err.status != 404:
+                raise
+            self.request("POST", "/networks/create", body={
+                "Name": name,
+                "CheckDuplicate": True,
+                "Labels": {"com.docker.compose.project": project}
+            })
+
+    def remove_network(self, name):
+        try:
+            self.request("DELETE", "/networks/{}".format(quote(name)))
+        except DockerEngineError as err:
+            # Missing, or still used by the containers of other components
+            if err.status not in (403, 404, 409):
+                raise
+
+
+def _demultiplex(content):
+    """
+    Join the frames of a multiplexed stdout and stderr stream. Every frame has
+    an 8 byte header: the stream type, three bytes of padding and the frame
+    size as a big-endian integer.
+    """
+    frames = []
+    offset = 0
+    while offset + 8 <= len(content):
+        size = int.from_bytes(content[offset + 4:offset + 8], "big")
+        frames.append(content[offset + 8:offset + 8 + size])
+        offset += 8 + size
+    return b"".join(frames)
+
+
+def get_engine():
+    """
+    Returns the shared :class:`DockerEngine` client.
+    """
+    global _engine
+    if _engine is None:
+        _engine = DockerEngine()
+    return _engine
+
+
+def _load_services(path):
+    with open(path) as compose_file:
+        services = yaml.safe_load(compose_file)["services"]
+
+    for name, service in services.items():
+        extends = service.pop("extends", None)
+        if extends:
+            base_path = os.path.join(os.path.dirname(path), extends["file"])
+            base = _load_services(base_path)[extends["service"]]
+            services[name] = dict(base, **service)
+
+    return services
+
+
+def _port_bindings(ports):
+    exposed = {}
+    bindings = {}
+
+    for port in ports:
+        parts = str(port).split(":")
+        container_port = parts[-1]
+        if "/" not in container_port:
+            container_port = "{}/tcp".format(container_port)
+
+        exposed[container_port] = {}
+        bindings.setdefault(container_port, []).append({
+            "HostIp": parts[-3] if len(parts) > 2 else "",
+            "HostPort": parts[-2] if len(parts) > 1 else ""
+        })
+
+    return exposed, bindings
+
+
+def _duration(value):
+    """
+    Nanoseconds from a Compose duration, e.g., 1m30s.
+    """
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 1e-3, "us": 1e-6}
+    parts = re.findall(r"([0-9.]+)(h|ms|us|m|s)", str(value))
+    if not parts:
+        raise ValueError("Invalid duration: {}".format(value))
+    return int(sum(float(number) * units[unit] for number, unit in parts) *
+               1e9)
+
+
+def _healthcheck(healthcheck):
+    test = healthcheck["test"]
+    if isinstance(test, str):
+        test = ["CMD-SHELL", test]
+
+    config = {"Test": test}
+    for key, field in (("interval", "Interval"), ("timeout", "Timeout")):
+        if key in healthcheck:
+            config[field] = _duration(healthcheck[key])
+    if "retries" in healthcheck:
+        config["Retries"] = int(healthcheck["retries"])
+    return config
+
+
+def container_spec(project, name, service):
+    """
+    Translate a Docker Compose service definition to a Docker Engine API
+    container create request.
+
+    Only the Compose keys which are used by the charm's manifests are
+    supported.
+
+    :param project: Compose project name
+    :type project: str
+    :param name: Service name
+    :type name: str
+    :param service: Service definition
+    :type service: dict
+    :returns: dict with the container create request
+    """
+    environment = service.get("environment", [])
+    if isinstance(environment, dict):
+        environment = ["{}={}".format(key, value)
+                       for key, value in sorted(environment.items())]
+
+    exposed, bindings = _port_bindings(service.get("ports", []))
+
+    logging = service.get("logging", {})
+    network = "{}_default".format(project)
+
+    spec = {
+        "Image": service["image"],
+        "Env": environment,
+        "ExposedPorts": exposed,
+        "Labels": {
+            "com.docker.compose.project": project,
+            "com.docker.compose.service": name
+        },
+        "HostConfig": {
+            "Binds": service.get("volumes", []),
+            "PortBindings": bindings,
+            "LogConfig": {
+                "Type": logging.get("driver", "json-file"),
+                "Config": {key: str(value) for key, value in
+                           (logging.get("options") or {}).items()}
+            },
+            "NetworkMode": network
+        },
+        "NetworkingConfig": {
+            "EndpointsConfig": {
+                network: {"Aliases": [name]}
+            }
+        }
+    }
+
+    if "command" in service:
+        command = service["command"]
+        spec["Cmd"] = shlex.split(command) if isinstance(command, str) \
+            else command
+
+    if "healthcheck" in service:
+        spec["Healthcheck"] = _healthcheck(service["healthcheck"])
+
+    digest = hashlib.md5(json.dumps(spec, sort_keys=True).encode("utf-8"))
+    spec["Labels"][CONFIG_HASH_LABEL] = digest.hexdigest()
+
+    return spec
+
+
+class ComposeProject:
+    """
+    Reconciles the services declared in a rendered Docker Compose manifest
+    with the containers of the Docker daemon, through the Docker Engine API.
+
+    :param workspace: Directory of the docker-compose.yml and .env files
+    :type workspace: str
+    :param engine: Docker Engine API client, defaults to the shared client
+    :type engine: :class:`DockerEngine`
+    """
+    def __init__(self, workspace, engine=None):
+        self.workspace = workspace
+        self.engine = engine or get_engine()
+
+    @property
+    def project(self):
+        try:
+            with open(os.path.join(self.workspace, ".env")) as env_file:
+                for line in env_file:
+                    key, _, value = line.strip().partition("=")
+                    if key == "COMPOSE_PROJECT_NAME":
+                        return value
+        except OSError:
+            pass
+        return os.path.basename(os.path.normpath(self.workspace))
+
+    @property
+    def network(self):
+        return "{}_default".format(self.project)
+
+    def _containers(self):
+        project = self.project
+        services = _load_services(os.path.join(self.workspace,
+                                               "docker-compose.yml"))
+        for name, service in sorted(services.items()):
+            container_name = service.get("container_name",
+                                         "{}_{}_1".format(project, name))
+            yield container_name, name, service
+
+    def pull(self):
+        """
+        Pull the images of the services which aren't available locally.
+        """
+        for _, _, service in self._containers():
+            if not self.engine.image_exists(service["image"]):
+                hookenv.log("Pulling image {}".format(service["image"]))
+                self.engine.pull(service["image"])
+
+    def up(self):
+        """
+        Create, recreate or start the containers so that they match their
+        service definitions. Containers which are running with an unchanged
+        definition are left untouched.
+        """
+        project = self.project
+        self.engine.ensure_network(self.network, project)
+        self.pull()
+
+        for container_name, name, service in self._containers():
+            spec = container_spec(project, name, service)
+            container = self.engine.inspect(container_name)
+
+            if container is not None:
+                labels = container["Config"].get("Labels") or {}
+                if labels.get(CONFIG_HASH_LABEL) != \
+                        spec["Labels"][CONFIG_HASH_LABEL]:
+                    hookenv.log("Recreating container {}".format(
+                        container_name))
+                    self.engine.remove(container_name, force=True)
+                    container = None
+
+            if container is None:
+                self.engine.create(container_name, spec)
+
+            if container is None or not container["State"]["Running"]:
+                self.engine.start(container_name)
+
+    def stop(self):
+        for container_name, _, _ in self._containers():
+            if self.engine.inspect(container_name) is not None:
+                self.engine.stop(container_name)
+
+    def down(self, rmi=False):
+        for container_name, _, service in self._containers():
+            self.engine.remove(container_name, force=True)
+            if rmi:
+                self.engine.remove_image(service["image"])
+        self.engine.remove_network(self.network)
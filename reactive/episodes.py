@@ -0,0 +1,263 @@
+"""
+Reconstruction of scaling episodes from the recorded metric values and the
+pool sizes written to the system historian.
+
+A scale-out episode starts with a threshold breach, the first metric value
+for which a scale-out rule's condition holds. It is followed by the decision,
+the first increase of the desired pool size, and ends when the number of
+active units has reached the new desired size.
+
+All series are lists of (epoch seconds, value) tuples in time order.
+"""
+import math
+import operator
+
+from reactive.autoscaler import resize_direction
+
+CONDITIONS = {
+    "ABOVE": operator.gt,
+    "ABOVE_OR_EQUAL": operator.ge,
+    "BELOW": operator.lt,
+    "BELOW_OR_EQUAL": operator.le
+}
+
+
+def _holds(rules, value):
+    return any(CONDITIONS[rule["condition"]](value, float(rule["threshold"]))
+               for rule in rules)
+
+
+def scale_rules(metric, direction):
+    """
+    :param metric: Metric definition
+    :type metric: dict
+    :param direction: 1 for the scale-out rules, -1 for the scale-in rules
+    :type direction: int
+    :returns: list of the metric's rules which resize in the direction
+    """
+    return [rule for rule in metric["rules"].values()
+            if resize_direction(rule) == direction]
+
+
+def breaches(points, rules):
+    """
+    :returns: list of times at which the condition of any of the rules
+              starts to hold
+    """
+    times = []
+    holding = False
+    for time, value in points:
+        holds = _holds(rules, value)
+        if holds and not holding:
+            times.append(time)
+        holding = holds
+    return times
+
+
+def _value_at(points, time, default=None):
+    value = default
+    for point_time, point_value in points:
+        if point_time > time:
+            break
+        value = point_value
+    return value
+
+
+def _first(points, since, predicate):
+    for time, value in points:
+        if time >= since and predicate(value):
+            return time, value
+    return None, None
+
+
+def _next_change(points, since):
+    """
+    :returns: time of the first value after `since` which differs from the
+              value at `since`, or None
+    """
+    value = _value_at(points, since)
+    for time, point_value in points:
+        if time > since and point_value != value:
+            return time
+    return None
+
+
+def episodes(breach_times, desired, active):
+    """
+    Follow each breach to the decision and to the point in time when the new
+    units were active. Breaches during an ongoing episode are part of it.
+
+    An episode whose units never became active, because the desired size was
+    changed again before they were, e.g., by a scale-in, ends with that
+    change. An episode without a decision ends at the next breach.
+
+    :param breach_times: Times of the threshold breaches
+    :type breach_times: list
+    :param desired: Desired pool size series
+    :type desired: list
+    :param active: Active units series
+    :type active: list
+    :returns: list of episode dicts, decision and active are None if they
+              never happened
+    """
+    result = []
+    ongoing_until = -math.inf
+
+    for breach in breach_times:
+        if breach < ongoing_until:
+            continue
+
+        size = _value_at(desired, breach, default=0)
+        decision, target = _first(desired, breach,
+                                  lambda value: value > size)
+        episode = {
+            "breach": breach,
+            "decision": decision,
+            "active": None,
+            "from": size,
+            "to": target
+        }
+
+        ongoing_until = breach
+        if decision is not None:
+            ended = _next_change(desired, decision)
+            if _value_at(active, decision, default=0) >= target:
+                answer = decision
+            else:
+                answer, _ = _first(active, decision,
+                                   lambda value: value >= target)
+            if answer is not None and (ended is None or answer < ended):
+                episode["active"] = answer
+                ongoing_until = answer
+            else:
+                ongoing_until = math.inf if ended is None else ended
+
+        result.append(episode)
+
+    return result
+
+
+def percentiles(values, ranks=(50, 95, 99)):
+    """
+    :returns: dict with the nearest rank percentiles and the max of the
+              values, or None if there are no values
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    result = {"p{}".format(rank): ordered[
+        max(int(math.ceil(rank / 100.0 * len(ordered))) - 1, 0)]
+        for rank in ranks}
+    result["max"] = ordered[-1]
+    return result
+
+
+def latencies(scaling_episodes):
+    """
+    :returns: dict with the percentiles of the time from breach to decision,
+              from decision to active units and from breach to active units
+    """
+    def _latency(start, end):
+        return [episode[end] - episode[start] for episode in scaling_episodes
+                if episode[start] is not None and episode[end] is not None]
+
+    return {
+        "decision": percentiles(_latency("breach", "decision")),
+        "provisioning": percentiles(_latency("decision", "active")),
+        "total": percentiles(_latency("breach", "active"))
+    }
+
+
+def provisioning(points, active, end, interval, scale_out, scale_in,
+                 unit_capacity=None):
+    """
+    Time spent over- and under-provisioned. Each metric value covers one
+    downsample interval.
+
+    With a unit capacity, the number of units needed for a metric value is
+    the value divided by the capacity, rounded up. Otherwise the pool counts
+    as under-provisioned while a scale-out rule's condition holds and as
+    over-provisioned while a scale-in rule's condition holds.
+
+    :param points: Metric series, downsampled
+    :type points: list
+    :param active: Active units series
+    :type active: list
+    :param end: End of the reported time range
+    :param interval: Seconds between the downsampled metric values
+    :param unit_capacity: Metric value one unit can handle
+    :type unit_capacity: float
+    :returns: dict with seconds and, with a capacity, unit-hours
+    """
+    result = {"over_seconds": 0.0, "under_seconds": 0.0}
+    if unit_capacity:
+        result.update(over_unit_hours=0.0, under_unit_hours=0.0)
+
+    units = 0
+    changes = iter(active)
+    change = next(changes, None)
+
+    for i, (time, value) in enumerate(points):
+        # Both series are in time order, follow the active units along
+        while change is not None and change[0] <= time:
+            units = change[1]
+            change = next(changes, None)
+
+        next_time = points[i + 1][0] if i + 1 < len(points) else end
+        seconds = max(min(next_time, time + interval, end) - time, 0)
+
+        if not unit_capacity:
+            if _holds(scale_out, value):
+                result["under_seconds"] += seconds
+            elif _holds(scale_in, value):
+                result["over_seconds"] += seconds
+            continue
+
+        needed = int(math.ceil(value / unit_capacity))
+        if units > needed:
+            result["over_seconds"] += seconds
+            result["over_unit_hours"] += (units - needed) * seconds / 3600.0
+        elif units < needed:
+            result["under_seconds"] += seconds
+            result["under_unit_hours"] += (needed - units) * seconds / 3600.0
+
+    return result
+
+
+def report(metric, points, desired, active, end, unit_capacity=None):
+    """
+    Reconstruct the scale-out episodes of a metric and summarize them.
+
+    :param metric: Metric definition
+    :type metric: dict
+    :param points: The metric's values, downsampled like the Autoscaler does
+    :type points: list
+    :param desired: Desired pool size series
+    :type desired: list
+    :param active: Active units series
+    :type active: list
+    :param end: End of the reported time range, epoch seconds
+    :param unit_capacity: Metric value one unit can handle
+    :type unit_capacity: float
+    :returns: dict with the episodes, latencies, scale-out steps and
+              provisioning times
+    """
+    scale_out = scale_rules(metric, 1)
+    scale_in = scale_rules(metric, -1)
+
+    scaling_episodes = episodes(breaches(points, scale_out), desired, active)
+
+    return {
+        "episodes": scaling_episodes,
+        "unanswered": sum(1 for episode in scaling_episodes
+                          if episode["active"] is None),
+        "latency": latencies(scaling_episodes),
+        # Units added per decision, bounded by the scale-out step limit
+        "step": percentiles([episode["to"] - episode["from"]
+                             for episode in scaling_episodes
+                             if episode["decision"] is not None]),
+        "provisioning": provisioning(points, active, end,
+                                     int(metric["downsample"]), scale_out,
+                                     scale_in, unit_capacity)
+    }
@@ -30,6 +30,14 @@ def data_commit(data_id, data, hash_type="md5"):
     unitdata.kv().set(key, new_hash)
 
 
+def data_reset(data_id):
+    """
+    Forget the committed data, data_changed() is True until it is committed
+    again.
+    """
+    unitdata.kv().unset("reactive.data_changed.{}".format(data_id))
+
+
 def backoff_handler(details, level=hookenv.DEBUG):
     """
     Slightly modified version of the default backoff handler to log using
@@ -0,0 +1,255 @@
+import base64
+import hashlib
+import json
+import os
+import socket
+import ssl
+import struct
+from urllib.parse import quote
+
+# Seconds to wait for the controller to answer a request.
+API_TIMEOUT = 60
+
+# Version which the client reports on login.
+CLIENT_VERSION = "2.9.0"
+
+# Magic string of the WebSocket handshake, see RFC 6455.
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class JujuAPIError(Exception):
+    """
+    Error response from the Juju controller, or a failed connection to it.
+
+    :param message: Error message
+    :type message: str
+    :param code: Juju error code, if any
+    :type code: str
+    """
+    def __init__(self, message, code=None):
+        self.code = code
+        super().__init__("Juju API error: {}".format(message))
+
+
+class WebSocket:
+    """
+    Minimal client side WebSocket connection which sends and receives text
+    messages, see RFC 6455.
+
+    :param host: Host to connect to
+    :type host: str
+    :param port: Port to connect to
+    :type port: int
+    :param path: Request path of the handshake
+    :type path: str
+    :param context: SSL context, or None to connect without TLS
+    :type context: :class:`ssl.SSLContext`
+    """
+    def __init__(self, host, port, path, context=None, timeout=API_TIMEOUT):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if context is not None:
+            sock = context.wrap_socket(sock, server_hostname=host)
+        self.sock = sock
+        self._buffer = b""
+        self._handshake(host, port, path)
+
+    def close(self):
+        try:
+            self._send_frame(OPCODE_CLOSE, b"")
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _read(self, size):
+        while len(self._buffer) < size:
+            data = self.sock.recv(65536)
+            if not data:
+                raise JujuAPIError("Connection closed by the controller")
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _handshake(self, host, port, path):
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        request = ("GET {} HTTP/1.1\r\n"
+                   "Host: {}:{}\r\n"
+                   "Upgrade: websocket\r\n"
+                   "Connection: Upgrade\r\n"
+                   "Sec-WebSocket-Key: {}\r\n"
+                   "Sec-WebSocket-Version: 13\r\n\r\n").format(
+                       path, host, port, key)
+        self.sock.sendall(request.encode("ascii"))
+
+        while b"\r\n\r\n" not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise JujuAPIError("Connection closed during the handshake")
+            self._buffer += data
+        head, self._buffer = self._buffer.split(b"\r\n\r\n", 1)
+
+        lines = head.decode("iso-8859-1").split("\r\n")
+        if len(lines[0].split()) < 2 or lines[0].split()[1] != "101":
+            raise JujuAPIError("WebSocket handshake refused: {}".format(
+                lines[0]))
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1(
+            (key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        if headers.get("sec-websocket-accept") != accept:
+            raise JujuAPIError("Invalid WebSocket handshake response")
+
+    def _send_frame(self, opcode, payload):
+        # Frames sent by a client are always masked
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 1 << 16:
+            header.append(0x80 | 126)
+            header.extend(struct.pack("!H", length))
+        else:
+            header.append(0x80 | 127)
+            header.extend(struct.pack("!Q", length))
+
+        mask = os.urandom(4)
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.sock.sendall(bytes(header) + mask + masked)
+
+    def send(self, message):
+        self._send_frame(OPCODE_TEXT, message.encode("utf-8"))
+
+    def receive(self):
+        """
+        :returns: The next text message
+        :raises JujuAPIError: The controller closed the connection
+        """
+        fragments = []
+        while True:
+            first, second = self._read(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self._read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self._read(8))[0]
+            mask = self._read(4) if second & 0x80 else None
+            payload = self._read(length)
+            if mask:
+                payload = bytes(byte ^ mask[i % 4]
+                                for i, byte in enumerate(payload))
+
+            if opcode == OPCODE_CLOSE:
+                raise JujuAPIError("Connection closed by the controller")
+            if opcode == OPCODE_PING:
+                self._send_frame(OPCODE_PONG, payload)
+                continue
+            if opcode not in (OPCODE_TEXT, OPCODE_CONTINUATION):
+                continue
+
+            fragments.append(payload)
+            if first & 0x80:
+                return b"".join(fragments).decode("utf-8")
+
+
+class JujuAPI:
+    """
+    Client of a Juju model's API, over which the charm manages machines and
+    units itself. Requests are JSON RPC calls on the model's WebSocket
+    endpoint, each facade is called at the highest version the controller
+    offers on login.
+
+    :param connection: Open connection to the model's API endpoint
+    :type connection: :class:`WebSocket`
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.facades = {}
+        self._request_id = 0
+
+    @classmethod
+    def connect(cls, cfg):
+        """
+        Connect and log in with the Juju options of the charm config.
+
+        :param cfg: The charm configuration
+        :type cfg: dict
+        :returns: Logged in :class:`JujuAPI`
+        :raises JujuAPIError: Cannot connect or log in
+        """
+        host, _, port = cfg["juju_api_endpoint"].rpartition(":")
+
+        try:
+            context = ssl.create_default_context(cadata=base64.b64decode(
+                cfg["juju_ca_cert"]).decode("ascii"))
+            # Controller certificates are issued for "juju-apiserver" rather
+            # than the address they are reached on
+            context.check_hostname = False
+
+            connection = WebSocket(host, int(port), "/model/{}/api".format(
+                quote(cfg["juju_model_uuid"])), context)
+        except (OSError, TypeError, ValueError) as err:
+            raise JujuAPIError("Cannot connect to {}: {}".format(
+                cfg["juju_api_endpoint"], err))
+
+        api = cls(connection)
+        try:
+            api.login(cfg["juju_username"], cfg["juju_password"])
+        except Exception:
+            api.close()
+            raise
+        return api
+
+    def close(self):
+        self.connection.close()
+
+    def rpc(self, facade, version, request, params=None):
+        """
+        :returns: The response of the call
+        :raises JujuAPIError: The controller returned an error
+        """
+        self._request_id += 1
+
+        try:
+            self.connection.send(json.dumps({
+                "request-id": self._request_id, "type": facade,
+                "version": version, "request": request,
+                "params": params or {}
+            }))
+            while True:
+                message = json.loads(self.connection.receive())
+                if message.get("request-id") == self._request_id:
+                    break
+        except (OSError, ValueError) as err:
+            raise JujuAPIError("{}.{}: {}".format(facade, request, err))
+
+        if message.get("error"):
+            raise JujuAPIError(message["error"], message.get("error-code"))
+        return message.get("response") or {}
+
+    def login(self, username, password):
+        response = self.rpc("Admin", 3, "Login", {
+            "auth-tag": "user-{}".format(username), "credentials": password,
+            "client-version": CLIENT_VERSION})
+        self.facades = {facade["name"]: max(facade["versions"])
+                        for facade in response.get("facades", [])}
+
+    def call(self, facade, request, params=None):
+        """
+        Call a facade at the highest version the controller offers.
+
+        :raises JujuAPIError: The controller doesn't offer the facade or
+                              returned an error
+        """
+        if facade not in self.facades:
+            raise JujuAPIError("The controller has no {} facade".format(
+                facade))
+        return self.rpc(facade, self.facades[facade], request, params)
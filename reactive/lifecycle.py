@@ -0,0 +1,199 @@
+"""
+Scaling lifecycle coordination with the application being scaled, over the
+optional scaling-lifecycle relation.
+
+The lifecycle gate sits between the Autoscaler and the Charmpool. Before a
+scale-out it publishes a notice, so that the application can pre-warm, and
+before a scale-in it asks the units to be removed to drain. The gate and the
+charm share a state directory: the gate writes its requests there, a systemd
+path unit runs the update-status hook whenever they change, and the hook
+publishes them on the relation. The units acknowledge a drain by setting
+"drained" to the drain's id, which the charm writes back for the gate. With
+the warm pool, the charm also tells the gate once it has placed a scale-out's
+units on spare machines, see :mod:`warmpool`.
+
+Published to every unit of the application:
+
+* ``scale-out``: ``{"id", "units", "size", "at"}``, or empty
+* ``drain``: ``{"id", "units", "deadline"}``, or empty
+"""
+import json
+import os
+import subprocess
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.templating import render
+
+from reactive.component import ScriptComponent
+from reactive.config import required
+
+# Hostname and port of the gate in the CharmScaler's Docker network.
+GATE_HOST = "lifecyclegate"
+GATE_PORT = 80
+
+RELATION_NAME = "scaling-lifecycle"
+
+# Host directory which is shared with the gate.
+STATE_DIR = "/var/lib/elastisys/lifecycle"
+REQUESTS_FILE = "requests.json"
+ACKS_FILE = "acks.json"
+
+TRIGGER_NAME = "charmscaler-lifecycle"
+TRIGGER_DIR = "/etc/systemd/system"
+
+
+def lifecycle_enabled(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: True if pool size changes go through the lifecycle gate
+    """
+    return bool(cfg["lifecycle_enabled"])
+
+
+class LifecycleGate(ScriptComponent):
+    """
+    Gate between the Autoscaler and the Charmpool which coordinates scale-outs
+    and scale-ins with the application being scaled. The container only runs
+    if the scaling lifecycle is enabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param tag: Docker image tag
+    :type tag: str
+    """
+    def __init__(self, cfg, image, tag):
+        super().__init__("lifecyclegate", "gate.py", lifecycle_enabled(cfg),
+                         image=image, tag=tag)
+
+    def prepare(self, cfg):
+        if not os.path.exists(STATE_DIR):
+            os.makedirs(STATE_DIR)
+
+    def compose_context(self, cfg):
+        return compose_config(cfg)
+
+
+def compose_config(cfg):
+    """
+    Generates the gate's config dict.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: dict with the gate's Docker compose config
+    """
+    return {
+        "state_dir": STATE_DIR,
+        "port": GATE_PORT,
+        "upstream_url": required(cfg, "charmpool_url"),
+        "scale_out_lead": int(cfg["lifecycle_scale_out_lead"]),
+        "drain_timeout": required(cfg, "lifecycle_drain_timeout"),
+        "max_inflight": int(cfg["scaling_max_inflight"]),
+        "warm_spares": int(cfg["warm_spare_machines"])
+    }
+
+
+def _systemctl(*args):
+    subprocess.check_call(["systemctl"] + list(args))
+
+
+def configure_lifecycle_trigger(cfg):
+    """
+    Install the systemd path unit which runs the update-status hook when the
+    gate has written new requests, or remove it if the scaling lifecycle is
+    disabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    """
+    if not lifecycle_enabled(cfg):
+        remove_lifecycle_trigger()
+        return
+
+    context = {
+        "requests_file": os.path.join(STATE_DIR, REQUESTS_FILE),
+        "unit": hookenv.local_unit()
+    }
+    for suffix in ("path", "service"):
+        render(os.path.join("common", "lifecycle.{}".format(suffix)),
+               os.path.join(TRIGGER_DIR, "{}.{}".format(TRIGGER_NAME,
+                                                        suffix)),
+               context, perms=0o644)
+
+    _systemctl("daemon-reload")
+    _systemctl("enable", "--now", "{}.path".format(TRIGGER_NAME))
+    hookenv.log("Scaling lifecycle trigger configured")
+
+
+def remove_lifecycle_trigger():
+    path_unit = os.path.join(TRIGGER_DIR, "{}.path".format(TRIGGER_NAME))
+    if not os.path.exists(path_unit):
+        return
+
+    _systemctl("disable", "--now", "{}.path".format(TRIGGER_NAME))
+    for suffix in ("path", "service"):
+        os.remove(os.path.join(TRIGGER_DIR, "{}.{}".format(TRIGGER_NAME,
+                                                           suffix)))
+    _systemctl("daemon-reload")
+    hookenv.log("Scaling lifecycle trigger removed")
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def sync_lifecycle(state_dir=None, place=None):
+    """
+    Publish the gate's pending requests on the scaling-lifecycle relation and
+    hand the drain acknowledgements of the units back to the gate.
+
+    :param state_dir: Directory shared with the gate, defaults to
+                      :data:`STATE_DIR`
+    :type state_dir: str
+    :param place: Called with a pending scale-out notice before the gate is
+                  told that its units have been placed
+    :type place: callable
+    :returns: dict with the published requests
+    """
+    state_dir = state_dir or STATE_DIR
+    requests = _read_json(os.path.join(state_dir, REQUESTS_FILE))
+    scale_out = requests.get("scale_out")
+    drain = requests.get("drain")
+
+    if scale_out and place is not None:
+        place(scale_out)
+
+    settings = {
+        "scale-out": json.dumps(scale_out, sort_keys=True)
+        if scale_out else "",
+        "drain": json.dumps(drain, sort_keys=True) if drain else ""
+    }
+
+    subscribers = 0
+    drained = []
+    for relation_id in hookenv.relation_ids(RELATION_NAME):
+        hookenv.relation_set(relation_id, settings)
+        for unit in hookenv.related_units(relation_id):
+            subscribers += 1
+            if drain and hookenv.relation_get("drained", unit,
+                                              relation_id) == drain["id"]:
+                drained.append(unit)
+
+    if os.path.isdir(state_dir):
+        acks = {
+            "subscribers": subscribers,
+            "drain": drain["id"] if drain else None,
+            "drained": drained,
+            "placed": scale_out["id"] if scale_out and place else None
+        }
+        # The gate never reads a partially written file
+        path = os.path.join(state_dir, ACKS_FILE)
+        with open("{}.tmp".format(path), "w") as acks_file:
+            json.dump(acks, acks_file)
+        os.rename("{}.tmp".format(path), path)
+
+    return {"scale_out": scale_out, "drain": drain}
@@ -0,0 +1,128 @@
+import os
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.templating import render
+
+from reactive.config import required
+
+# Host directory which the components write their log files to.
+LOG_DIR = "/var/log/elastisys"
+
+LOGROTATE_CONFIG = "/etc/logrotate.d/charmscaler"
+LOGROTATE_CRON = "/etc/cron.d/charmscaler-logrotate"
+LOGROTATE_STATE = "/var/lib/logrotate/charmscaler.status"
+
+# Docker logging drivers which support size capped and compressed log files.
+ROTATING_LOG_DRIVERS = ("json-file", "local")
+
+# Every log driver which stores logs locally keeps them in the container's
+# directory under this one.
+CONTAINERS_DIR = "/var/lib/docker/containers"
+
+
+def logging_config(cfg):
+    """
+    Generates the Docker Compose logging config dict, shared by all of the
+    Docker components.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: dict with Docker logging configuration options
+    """
+    driver = required(cfg, "log_driver")
+    options = {}
+
+    if driver in ROTATING_LOG_DRIVERS:
+        options = {
+            "max-size": required(cfg, "log_max_size"),
+            "max-file": required(cfg, "log_max_file")
+        }
+        # The drivers compress by different defaults, which are kept unless
+        # compression is set explicitly
+        compress = str(cfg["log_compress"]).lower()
+        if compress:
+            options["compress"] = compress
+
+    return {
+        "logging": {
+            "driver": driver,
+            "options": options
+        }
+    }
+
+
+def _logrotate_size(size):
+    # Docker sizes use the k, m and g units while logrotate expects k, M or G
+    unit = size[-1:].lower()
+    if unit in ("m", "g"):
+        return size[:-1] + unit.upper()
+    return size
+
+
+def logrotate_config(cfg):
+    """
+    Generates the logrotate config dict for the bind-mounted log directory.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: dict with logrotate configuration options
+    """
+    return {
+        "log_dir": LOG_DIR,
+        "max_size": _logrotate_size(required(cfg, "log_max_size")),
+        "max_file": required(cfg, "log_max_file"),
+        "max_age": required(cfg, "log_max_age"),
+        "schedule": required(cfg, "log_rotate_schedule"),
+        "state": LOGROTATE_STATE,
+        "config": LOGROTATE_CONFIG
+    }
+
+
+def configure_logrotate(cfg):
+    """
+    Render the logrotate config for the bind-mounted log directory together
+    with a cron job that runs it on the configured schedule.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :raises: config.ConfigurationRequiredException
+    """
+    context = logrotate_config(cfg)
+
+    render(os.path.join("common", "logrotate"), LOGROTATE_CONFIG, context,
+           perms=0o644)
+    render(os.path.join("common", "logrotate.cron"), LOGROTATE_CRON, context,
+           perms=0o644)
+
+    hookenv.log("Log rotation configured for {}".format(LOG_DIR))
+
+
+def remove_logrotate():
+    for path in (LOGROTATE_CONFIG, LOGROTATE_CRON):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def disk_usage(path):
+    """
+    :param path: File or directory
+    :type path: str
+    :returns: Size in bytes of the files under the path
+    :raises OSError: The path doesn't exist
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for root, _, files in os.walk(path, onerror=_raise):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                # Rotated away while walking
+                pass
+    return size
+
+
+def _raise(err):
+    raise err
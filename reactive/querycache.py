@@ -0,0 +1,119 @@
+import os
+
+from reactive.component import ScriptComponent
+from reactive.config import Config, ConfigurationException, required
+from reactive.replicas import healthy_replicas
+
+# Hostname and port of the cache in the CharmScaler's Docker network.
+CACHE_HOST = "querycache"
+CACHE_PORT = 8086
+
+
+def cache_enabled(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: True if the metric queries go through the cache
+    """
+    return bool(cfg["query_cache_enabled"])
+
+
+class QueryCache(ScriptComponent):
+    """
+    Caching proxy between the Autoscaler's metric streams and InfluxDB.
+    Identical queries are merged while in flight and their results are
+    cached for the metric poll interval. The container only runs if the
+    cache is enabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param tag: Docker image tag
+    :type tag: str
+    """
+    def __init__(self, cfg, image, tag):
+        super().__init__("querycache", "cache.py", cache_enabled(cfg),
+                         image=image, tag=tag)
+        self.upstream = Config("upstream.json", self.name)
+
+    def prepare(self, cfg):
+        # The upstream is known once the InfluxDB relation is, until then the
+        # cache answers with errors
+        if not self.upstream.exists():
+            self.upstream.extend(lambda: {"influxdb": None})
+            self.upstream.render()
+
+    def compose_context(self, cfg):
+        return compose_config(cfg, self.script)
+
+    def configure(self, cfg, influxdb, metrics):
+        """
+        Point the cache at the InfluxDB of the relation, or at the first
+        healthy read replica, the cache picks up the change without being
+        restarted.
+
+        :param influxdb: InfluxDB relation data object
+        :type influxdb: InfluxdbClient
+        :raises: config.ConfigurationException
+        """
+        if not self.enabled:
+            return
+
+        try:
+            host, port = healthy_replicas(cfg, influxdb)[0]
+        except ValueError as err:
+            raise ConfigurationException(
+                self.upstream, "Invalid InfluxDB read replica: {}".format(err))
+        self.upstream.extend(lambda: {"influxdb": {
+            "host": host,
+            "port": port
+        }})
+        self.upstream.render()
+
+
+def compose_config(cfg, cache_script):
+    """
+    Generates the cache's config dict.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param cache_script: The rendered cache script
+    :type cache_script: :class:`Config`
+    :returns: dict with the cache's Docker compose config
+    """
+    poll_interval = required(cfg, "metric_poll_interval")
+
+    return {
+        # The script and the upstream file are mounted along with the
+        # directory, a re-rendered upstream file is seen by the cache
+        "workspace": os.path.dirname(str(cache_script)),
+        "port": CACHE_PORT,
+        "published_port": int(cfg["query_cache_port"]),
+        # Results are fresh until the metric streams poll again
+        "ttl": cfg["query_cache_ttl"] or poll_interval,
+        # Queries sent during the same poll interval share a cache entry
+        "quantum": poll_interval,
+        "size": required(cfg, "query_cache_size")
+    }
+
+
+def cache_address(cfg):
+    """
+    The query cache which the metric streams query InfluxDB through. That is
+    the cache of another CharmScaler if query_cache_address is set, else this
+    CharmScaler's own cache if it is enabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: tuple of the cache's host and port, None without a cache
+    :raises: ValueError
+    """
+    address = cfg["query_cache_address"]
+    if address:
+        host, _, port = address.strip().rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError("Expected host:port, got {}".format(address))
+        return host, int(port)
+
+    if cache_enabled(cfg):
+        return CACHE_HOST, CACHE_PORT
+    return None
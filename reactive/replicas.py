@@ -0,0 +1,123 @@
+"""
+InfluxDB read replicas for the metric queries. Besides the InfluxDB of the
+db-api relation, the metric streams can read from the replicas listed in the
+metric_read_replicas option.
+
+The replicas are pinged by the update-status hook, see :func:`check_replicas`.
+A replica which hasn't answered metric_replica_failover_pings pings in a row is
+left out until it answers again. Rendering the config only reads the outcome
+back from the unit's key-value store, without pinging.
+"""
+import requests
+from requests.exceptions import RequestException
+
+from charmhelpers.core import hookenv, unitdata
+
+# Seconds to wait for a replica to answer a ping.
+PING_TIMEOUT = 2
+
+DEFAULT_PORT = 8086
+
+# Number of pings in a row each replica has failed, by "host:port".
+FAILED_PINGS_KEY = "charmscaler.replica_failed_pings"
+
+
+def read_replicas(cfg, influxdb):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :returns: list of (host, port) tuples, the InfluxDB of the relation first
+    :raises ValueError: A replica's port is not a number
+    """
+    replicas = [(influxdb.hostname(), int(influxdb.port()))]
+
+    for replica in (cfg["metric_read_replicas"] or "").replace(",",
+                                                               " ").split():
+        host, _, port = replica.rpartition(":")
+        if not host:
+            host, port = port, DEFAULT_PORT
+        replica = (host, int(port))
+        if replica not in replicas:
+            replicas.append(replica)
+
+    return replicas
+
+
+def ping(host, port, timeout=PING_TIMEOUT):
+    """
+    :returns: True if the InfluxDB answers its ping endpoint
+    """
+    try:
+        response = requests.get("http://{}:{}/ping".format(host, port),
+                                timeout=timeout)
+        return response.status_code == 204
+    except RequestException:
+        return False
+
+
+def _failed_over(cfg, replicas, failed_pings):
+    return [replica for replica in replicas
+            if failed_pings.get("{}:{}".format(*replica), 0) >=
+            cfg["metric_replica_failover_pings"]]
+
+
+def check_replicas(cfg, influxdb):
+    """
+    Ping the replicas and count the pings each has failed in a row, a
+    replica which answers starts over. A single replica is not pinged since
+    there is nothing to fail over to.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :returns: list of the healthy replicas, see :func:`healthy_replicas`
+    :raises ValueError: A replica's port is not a number
+    """
+    replicas = read_replicas(cfg, influxdb)
+    kv = unitdata.kv()
+    previous = kv.get(FAILED_PINGS_KEY, {})
+
+    failed_pings = {}
+    if len(replicas) > 1:
+        for host, port in replicas:
+            name = "{}:{}".format(host, port)
+            failed_pings[name] = 0 if ping(host, port) else \
+                previous.get(name, 0) + 1
+
+    was_failed_over = _failed_over(cfg, replicas, previous)
+    failed_over = _failed_over(cfg, replicas, failed_pings)
+    for host, port in failed_over:
+        if (host, port) not in was_failed_over:
+            hookenv.log("InfluxDB replica {}:{} is unreachable, failing over"
+                        .format(host, port), level=hookenv.WARNING)
+    for host, port in was_failed_over:
+        if (host, port) not in failed_over:
+            hookenv.log("InfluxDB replica {}:{} is reachable again".format(
+                host, port))
+
+    kv.set(FAILED_PINGS_KEY, failed_pings)
+    return healthy_replicas(cfg, influxdb)
+
+
+def healthy_replicas(cfg, influxdb):
+    """
+    The replicas which haven't been failed over by :func:`check_replicas`.
+    If all of them have, they are all kept so that the metric streams retry
+    them.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param influxdb: InfluxDB relation data object
+    :type influxdb: InfluxdbClient
+    :returns: list of (host, port) tuples
+    :raises ValueError: A replica's port is not a number
+    """
+    replicas = read_replicas(cfg, influxdb)
+    failed_over = _failed_over(cfg, replicas,
+                               unitdata.kv().get(FAILED_PINGS_KEY, {}))
+
+    return [replica for replica in replicas
+            if replica not in failed_over] or replicas
@@ -0,0 +1,183 @@
+from datetime import datetime
+import math
+import re
+
+# Resource fields reported for every container. The JVM heap itself is not
+# exposed by the Docker daemon, the anonymous memory (rss) is what the heap
+# and the rest of the JVM's own allocations add up to, unlike the page cache.
+FIELDS = (
+    "cpu-percent",
+    "memory-usage",
+    "memory-rss",
+    "memory-percent",
+    "network-rx-rate",
+    "network-tx-rate",
+    "block-read-rate",
+    "block-write-rate"
+)
+
+# Groups of fields which can be selected by name.
+FIELD_GROUPS = {
+    "cpu": ("cpu-percent",),
+    "memory": ("memory-usage", "memory-rss", "memory-percent"),
+    "network": ("network-rx-rate", "network-tx-rate"),
+    "block": ("block-read-rate", "block-write-rate")
+}
+
+
+def _timestamp(sample):
+    # Nanosecond precision is more than datetime can parse
+    read = re.sub(r"(\.\d{6})\d*", r"\1", sample["read"])
+    read = re.sub(r"Z$|[+-]\d\d:\d\d$", "", read)
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in read else "%Y-%m-%dT%H:%M:%S"
+    return datetime.strptime(read, fmt)
+
+
+def _cpu_percent(sample):
+    cpu = sample["cpu_stats"]
+    precpu = sample.get("precpu_stats") or {}
+
+    cpu_delta = (cpu["cpu_usage"]["total_usage"] -
+                 precpu.get("cpu_usage", {}).get("total_usage", 0))
+    system_delta = (cpu.get("system_cpu_usage", 0) -
+                    precpu.get("system_cpu_usage", 0))
+
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+
+    online_cpus = (cpu.get("online_cpus") or
+                   len(cpu["cpu_usage"].get("percpu_usage") or [1]))
+
+    return cpu_delta / system_delta * online_cpus * 100.0
+
+
+def _network_bytes(sample):
+    rx = tx = 0
+    for interface in (sample.get("networks") or {}).values():
+        rx += interface["rx_bytes"]
+        tx += interface["tx_bytes"]
+    return rx, tx
+
+
+def _block_bytes(sample):
+    read = write = 0
+    blkio = sample.get("blkio_stats") or {}
+    for entry in blkio.get("io_service_bytes_recursive") or []:
+        if entry["op"] == "Read":
+            read += entry["value"]
+        elif entry["op"] == "Write":
+            write += entry["value"]
+    return read, write
+
+
+def resource_usage(samples):
+    """
+    Turn a series of Docker stats samples into a series of resource values per
+    field. Counters, like the network and block I/O, are turned into rates
+    between consecutive samples.
+
+    :param samples: Docker stats samples in the order they were read
+    :type samples: list
+    :returns: dict with a list of values for each of the :data:`FIELDS`
+    """
+    usage = {field: [] for field in FIELDS}
+
+    previous = None
+    for sample in samples:
+        memory = sample.get("memory_stats") or {}
+        if "usage" not in memory:
+            # The container isn't running
+            previous = None
+            continue
+
+        memory_stats = memory.get("stats") or {}
+        used = memory["usage"] - memory_stats.get("cache", 0)
+
+        usage["cpu-percent"].append(_cpu_percent(sample))
+        usage["memory-usage"].append(used)
+        usage["memory-rss"].append(memory_stats.get("rss", used))
+        usage["memory-percent"].append(
+            used / memory["limit"] * 100.0 if memory.get("limit") else 0.0)
+
+        current = (_timestamp(sample), _network_bytes(sample),
+                   _block_bytes(sample))
+
+        if previous is not None:
+            seconds = (current[0] - previous[0]).total_seconds()
+            if seconds > 0:
+                for field, now, before in (
+                        ("network-rx-rate", current[1][0], previous[1][0]),
+                        ("network-tx-rate", current[1][1], previous[1][1]),
+                        ("block-read-rate", current[2][0], previous[2][0]),
+                        ("block-write-rate", current[2][1], previous[2][1])):
+                    usage[field].append(max(now - before, 0) / seconds)
+
+        previous = current
+
+    return usage
+
+
+def summarize(values):
+    """
+    :param values: A series of values
+    :type values: list
+    :returns: dict with the min, mean and 95th percentile (nearest rank) of
+              the values, or None if there are no values
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(math.ceil(0.95 * len(ordered))) - 1
+
+    return {
+        "min": ordered[0],
+        "mean": sum(ordered) / len(ordered),
+        "p95": ordered[rank]
+    }
+
+
+def project_fields(fields):
+    """
+    Resolve a space separated list of field and group names to the fields
+    that should be reported.
+
+    :param fields: Field and group names, all fields if empty
+    :type fields: str
+    :returns: tuple of field names
+    :raises ValueError: An unknown field was requested
+    """
+    if not fields or not fields.strip():
+        return FIELDS
+
+    selected = []
+    for name in fields.split():
+        if name in FIELD_GROUPS:
+            selected.extend(FIELD_GROUPS[name])
+        elif name in FIELDS:
+            selected.append(name)
+        else:
+            raise ValueError("Unknown stats field: {}".format(name))
+
+    return tuple(field for field in FIELDS if field in selected)
+
+
+def stats_summary(samples, fields=FIELDS):
+    """
+    Summarize a series of Docker stats samples.
+
+    :param samples: Docker stats samples in the order they were read
+    :type samples: list
+    :param fields: The fields to include
+    :type fields: tuple
+    :returns: dict with a summary for each field which has values
+    """
+    usage = resource_usage(samples)
+
+    summary = {}
+    for field in fields:
+        field_summary = summarize(usage[field])
+        if field_summary is not None:
+            summary[field] = field_summary
+
+    return summary
@@ -0,0 +1,185 @@
+"""
+Supervision of the Docker components. Unhealthy containers are restarted with
+an exponential backoff, and a component which keeps failing is reported as
+crash looping rather than being restarted over and over again.
+
+The supervisor runs on the update-status hook, which a cron job also triggers
+every minute so that a failed component is noticed without waiting for the
+model's update-status interval.
+"""
+import os
+import time
+
+from charmhelpers.core import hookenv, unitdata
+from charmhelpers.core.templating import render
+
+from reactive.config import required
+from reactive.docker_engine import get_engine
+from reactive.logs import LOG_DIR
+
+SUPERVISOR_CRON = "/etc/cron.d/charmscaler-supervisor"
+
+# Directory of the container log lines captured before each restart.
+CRASH_LOG_DIR = os.path.join(LOG_DIR, "supervisor")
+
+# Upper bound of the delay between two restarts of a component, in seconds.
+BACKOFF_MAX = 300
+
+
+class CrashLoopException(Exception):
+    """
+    Raised when a component has been restarted too many times within the
+    restart window.
+
+    :param component: The crash looping component
+    :type component: :class:`reactive.component.DockerComponent`
+    :param restarts: Number of restarts within the window
+    :type restarts: int
+    :param window: Restart window in seconds
+    :type window: int
+    """
+    def __init__(self, component, restarts, window):
+        self.component = component
+        super().__init__(
+            "Crash loop: {} was restarted {} times in {} seconds - Check the "
+            "Docker container logs".format(component, restarts, window))
+
+
+def supervisor_config(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: dict with the supervisor's configuration
+    """
+    return {
+        "enabled": cfg["supervisor_enabled"],
+        "max_restarts": required(cfg, "supervisor_max_restarts"),
+        "window": required(cfg, "supervisor_restart_window"),
+        "backoff": required(cfg, "supervisor_backoff"),
+        "log_lines": required(cfg, "supervisor_log_lines"),
+        "unit": hookenv.local_unit()
+    }
+
+
+def configure_supervisor(cfg):
+    """
+    Render the cron job which runs the supervisor every minute, or remove it
+    if the supervisor is disabled.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :raises: config.ConfigurationRequiredException
+    """
+    context = supervisor_config(cfg)
+
+    if not context["enabled"]:
+        remove_supervisor()
+        return
+
+    render(os.path.join("common", "supervisor.cron"), SUPERVISOR_CRON,
+           context, perms=0o644)
+    hookenv.log("Container supervisor configured")
+
+
+def remove_supervisor():
+    if os.path.exists(SUPERVISOR_CRON):
+        os.remove(SUPERVISOR_CRON)
+        hookenv.log("Container supervisor removed")
+
+
+class Supervisor:
+    """
+    Restarts unhealthy components. The restart times are kept in the unit
+    data store, so that the backoff and the crash loop detection span hooks.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    """
+    def __init__(self, cfg):
+        self.config = supervisor_config(cfg)
+
+    def _key(self, component):
+        return "charmscaler.supervisor.{}".format(component.name)
+
+    def restarts(self, component, now=None):
+        """
+        :returns: list of the component's restart times within the window
+        """
+        now = time.time() if now is None else now
+        restarts = unitdata.kv().get(self._key(component), [])
+        return [restart for restart in restarts
+                if restart > now - self.config["window"]]
+
+    def delay(self, restarts):
+        """
+        :returns: Seconds to wait after the last restart before the next one
+        """
+        if not restarts:
+            return 0
+        return min(self.config["backoff"] * 2 ** (len(restarts) - 1),
+                   BACKOFF_MAX)
+
+    def unhealthy(self, components):
+        """
+        :returns: list of the components whose containers are not running or
+                  are unhealthy
+        """
+        return [component for component in components
+                if component.health_status() == "unhealthy"]
+
+    def capture_logs(self, component):
+        """
+        Append the last lines of the component's container log to its crash
+        log, which is rotated along with the other CharmScaler logs.
+
+        :returns: Path to the crash log
+        """
+        lines = get_engine().logs(component.name,
+                                  tail=self.config["log_lines"])
+
+        if not os.path.exists(CRASH_LOG_DIR):
+            os.makedirs(CRASH_LOG_DIR)
+
+        path = os.path.join(CRASH_LOG_DIR, "{}.log".format(component.name))
+        with open(path, "a") as crash_log:
+            crash_log.write("=== {} restarted at {} ===\n".format(
+                component, time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                         time.gmtime())))
+            for line in lines:
+                crash_log.write(line + "\n")
+
+        return path
+
+    def restart(self, component, now=None):
+        """
+        Restart the component's container unless it is backing off.
+
+        :param component: The unhealthy component
+        :type component: :class:`reactive.component.DockerComponent`
+        :returns: True if the component was restarted, False if it is backing
+                  off
+        :raises CrashLoopException: Too many restarts within the window
+        :raises DockerEngineError: The container could not be restarted
+        """
+        now = time.time() if now is None else now
+        restarts = self.restarts(component, now)
+
+        if len(restarts) >= self.config["max_restarts"]:
+            raise CrashLoopException(component, len(restarts),
+                                     self.config["window"])
+
+        next_restart = restarts[-1] + self.delay(restarts) if restarts else now
+        if now < next_restart:
+            hookenv.log("Backing off restart of {} for {:.0f}s".format(
+                component, next_restart - now), level=hookenv.DEBUG)
+            return False
+
+        path = self.capture_logs(component)
+        hookenv.log("Restarting unhealthy component {}, last container log "
+                    "lines in {}".format(component, path),
+                    level=hookenv.WARNING)
+
+        get_engine().restart(component.name)
+
+        unitdata.kv().set(self._key(component), restarts + [now])
+        return True
@@ -0,0 +1,211 @@
+"""
+Warm pool of empty, pre-provisioned machines, which a scale-out places its
+new units on rather than waiting for Juju to provision new machines.
+
+The leader keeps warm_spare_machines spares in the model through the Juju
+API. The spares are replenished by the update-status hook, and a spare which
+has been given a unit, or has disappeared, is replaced. Placement needs the
+scaling lifecycle: when the lifecycle gate publishes a scale-out notice, the
+leader adds as many of the new units as it can to spares, and the gate only
+raises the Charmpool's pool size once it has done so. The Charmpool then
+finds the units already there and only provisions machines for the rest.
+
+The spares and the hit and miss counters are kept in the leader settings, so
+that a new leader takes over the warm pool.
+"""
+import json
+
+from charmhelpers.core import hookenv
+
+from reactive.juju_api import JujuAPIError
+from reactive.lifecycle import lifecycle_enabled
+
+# Leader settings holding the spare machine ids and the warm pool counters.
+SPARES_KEY = "warm_spares"
+STATS_KEY = "warm_pool_stats"
+
+# Constraints which take a size, in megabytes unless a suffix is given.
+SIZE_CONSTRAINTS = ("mem", "root-disk")
+SIZE_SUFFIXES = {"M": 1, "G": 1024, "T": 1024 ** 2, "P": 1024 ** 3}
+
+INT_CONSTRAINTS = ("cores", "cpu-cores", "cpu-power")
+LIST_CONSTRAINTS = ("tags", "spaces", "zones")
+BOOL_CONSTRAINTS = ("allocate-public-ip",)
+
+
+def warm_pool_enabled(cfg):
+    """
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :returns: True if spare machines are kept and placed on
+    """
+    return cfg["warm_spare_machines"] > 0 and lifecycle_enabled(cfg)
+
+
+def parse_constraints(constraints):
+    """
+    Convert constraints in the Juju CLI's format, e.g. "mem=4G cores=2", to
+    the Juju API's constraints value.
+
+    :param constraints: Space separated key=value constraints
+    :type constraints: str
+    :returns: dict with the constraints
+    :raises ValueError: A constraint is malformed
+    """
+    parsed = {}
+    for constraint in (constraints or "").split():
+        key, separator, value = constraint.partition("=")
+        if not separator or not key:
+            raise ValueError("Invalid constraint '{}'".format(constraint))
+
+        if key in SIZE_CONSTRAINTS:
+            multiplier = SIZE_SUFFIXES.get(value[-1:].upper())
+            if multiplier is not None:
+                value = value[:-1]
+            parsed[key] = int(float(value) * (multiplier or 1))
+        elif key in INT_CONSTRAINTS:
+            parsed["cores" if key == "cpu-cores" else key] = int(value)
+        elif key in LIST_CONSTRAINTS:
+            parsed[key] = [item for item in value.split(",") if item]
+        elif key in BOOL_CONSTRAINTS:
+            parsed[key] = value.lower() == "true"
+        else:
+            parsed[key] = value
+
+    return parsed
+
+
+def spares():
+    """
+    :returns: list of the spare machine ids
+    """
+    return json.loads(hookenv.leader_get(SPARES_KEY) or "[]")
+
+
+def stats():
+    """
+    :returns: dict with the "hits", units placed on a spare, the "misses",
+              units which had to wait for a new machine, and the id of the
+              last scale-out "notice" that was placed
+    """
+    counters = {"hits": 0, "misses": 0, "notice": None}
+    counters.update(json.loads(hookenv.leader_get(STATS_KEY) or "{}"))
+    return counters
+
+
+def _used_machines(status):
+    used = set()
+    for application in (status.get("applications") or {}).values():
+        for unit in (application.get("units") or {}).values():
+            if unit.get("machine"):
+                used.add(unit["machine"])
+    return used
+
+
+def replenish(cfg, api):
+    """
+    Keep warm_spare_machines spares provisioned, only run on the leader.
+    Spares which have been given a unit or have been removed are dropped
+    and new ones are added, surplus spares are destroyed.
+
+    :param cfg: The charm configuration
+    :type cfg: dict
+    :param api: Logged in Juju API client
+    :type api: :class:`juju_api.JujuAPI`
+    :returns: list of the spare machine ids
+    :raises juju_api.JujuAPIError: A Juju API call failed
+    :raises ValueError: The warm_spare_constraints are malformed
+    """
+    wanted = cfg["warm_spare_machines"] if warm_pool_enabled(cfg) else 0
+    current = spares()
+    if not wanted and not current:
+        return current
+
+    status = api.call("Client", "FullStatus", {"patterns": []})
+    machines = status.get("machines") or {}
+    used = _used_machines(status)
+    kept = [machine for machine in current
+            if machine in machines and machine not in used]
+
+    if len(kept) < wanted:
+        constraints = parse_constraints(cfg["warm_spare_constraints"])
+        response = api.call("MachineManager", "AddMachines", {"params": [
+            {"jobs": ["JobHostUnits"], "constraints": constraints}
+            for _ in range(wanted - len(kept))]})
+        for result in response.get("machines") or []:
+            if result.get("error"):
+                hookenv.log("Cannot add a warm spare machine: {}".format(
+                    result["error"].get("message")), level=hookenv.WARNING)
+            else:
+                kept.append(result["machine"])
+        hookenv.log("Warm pool replenished, {} spare machines".format(
+            len(kept)))
+    elif len(kept) > wanted:
+        surplus, kept = kept[wanted:], kept[:wanted]
+        api.call("MachineManager", "DestroyMachineWithParams", {
+            "machine-tags": ["machine-{}".format(machine)
+                             for machine in surplus]})
+        hookenv.log("Destroyed surplus warm spare machines {}".format(
+            ", ".join(surplus)))
+
+    if kept != current:
+        hookenv.leader_set({SPARES_KEY: json.dumps(kept)})
+    return kept
+
+
+def place(api, application, notice):
+    """
+    Add the units of a scale-out notice to spare machines, as many as there
+    are spares for, only run on the leader. A notice is only placed once.
+
+    :param api: Logged in Juju API client
+    :type api: :class:`juju_api.JujuAPI`
+    :param application: Name of the application being scaled
+    :type application: str
+    :param notice: The lifecycle gate's scale-out notice
+    :type notice: dict
+    :returns: Number of units placed on a spare
+    """
+    counters = stats()
+    if counters["notice"] == notice["id"]:
+        return 0
+
+    available = spares()
+    placed = 0
+    while available and placed < notice["units"]:
+        machine = available.pop(0)
+        try:
+            api.call("Application", "AddUnits", {
+                "application": application, "num-units": 1,
+                "placement": [{"scope": "#", "directive": machine}]})
+            placed += 1
+        except JujuAPIError as err:
+            hookenv.log("Cannot place a unit on spare machine {}: {}".format(
+                machine, err), level=hookenv.WARNING)
+
+    counters["hits"] += placed
+    counters["misses"] += notice["units"] - placed
+    counters["notice"] = notice["id"]
+    hookenv.leader_set({SPARES_KEY: json.dumps(available),
+                        STATS_KEY: json.dumps(counters, sort_keys=True)})
+    hookenv.log("Placed {} of {} new units on warm spare machines".format(
+        placed, notice["units"]))
+    return placed
+
+
+def report():
+    """
+    Summarize the warm pool and how often scale-outs were placed on it.
+
+    :returns: dict with the number of spares, hits, misses and the hit ratio
+    """
+    counters = stats()
+    placements = counters["hits"] + counters["misses"]
+
+    return {
+        "spares": len(spares()),
+        "hits": counters["hits"],
+        "misses": counters["misses"],
+        "hit-ratio": "{:.2f}".format(counters["hits"] / placements)
+        if placements else "n/a"
+    }
@@ -0,0 +1,411 @@
+"""
+Alert relay between the Autoscaler and the upstream SMTP server.
+
+Alert mails are queued per recipient and sent upstream as digests, at most
+once every DIGEST_INTERVAL seconds and at most RATE_LIMIT mails per recipient
+and hour. Alerts which arrive while a recipient is rate limited are included
+in the next digest. The digests are sent in parallel over a pool of at most
+UPSTREAM_CONNECTIONS connections to the upstream SMTP server, which are kept
+open between digests.
+
+Only the Python standard library is used so that the relay runs in a stock
+Python image. The relay speaks the small subset of SMTP which the Autoscaler
+uses to send its alerts.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+import logging
+import os
+import smtplib
+import socketserver
+import sys
+import threading
+import time
+
+LISTEN_PORT = int(os.environ.get("LISTEN_PORT", 25))
+
+UPSTREAM_HOST = os.environ.get("UPSTREAM_HOST")
+UPSTREAM_PORT = int(os.environ.get("UPSTREAM_PORT", 25))
+UPSTREAM_SSL = os.environ.get("UPSTREAM_SSL", "false").lower() == "true"
+UPSTREAM_USERNAME = os.environ.get("UPSTREAM_USERNAME")
+UPSTREAM_PASSWORD = os.environ.get("UPSTREAM_PASSWORD")
+UPSTREAM_CONNECTIONS = int(os.environ.get("UPSTREAM_CONNECTIONS", 4))
+
+DIGEST_INTERVAL = int(os.environ.get("DIGEST_INTERVAL", 300))
+RATE_LIMIT = int(os.environ.get("RATE_LIMIT", 0))
+
+# Alerts kept per recipient while waiting for the next digest, the oldest are
+# dropped first.
+QUEUE_LIMIT = int(os.environ.get("QUEUE_LIMIT", 1000))
+
+# Largest accepted alert mail and command line, in bytes.
+MAX_MESSAGE_SIZE = 1024 * 1024
+MAX_LINE_LENGTH = 1000
+
+log = logging.getLogger("alertrelay")
+
+
+class RateLimiter:
+    """
+    Token bucket which allows a number of mails per hour, zero for no limit.
+    """
+    def __init__(self, per_hour):
+        self.per_hour = per_hour
+        self.tokens = float(per_hour)
+        self.updated = time.monotonic()
+
+    def allow(self):
+        if not self.per_hour:
+            return True
+
+        now = time.monotonic()
+        self.tokens = min(self.per_hour, self.tokens +
+                          (now - self.updated) * self.per_hour / 3600.0)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def _connect():
+    smtp = smtplib.SMTP_SSL if UPSTREAM_SSL else smtplib.SMTP
+    connection = smtp(UPSTREAM_HOST, UPSTREAM_PORT, timeout=30)
+    if UPSTREAM_USERNAME or UPSTREAM_PASSWORD:
+        connection.login(UPSTREAM_USERNAME, UPSTREAM_PASSWORD)
+    return connection
+
+
+def _alive(connection):
+    try:
+        return connection.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def _quit(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+class UpstreamPool:
+    """
+    Pool of at most `size` connections to the upstream SMTP server.
+    Connections are opened when no idle one is left, returned to the pool
+    after every mail and dropped once they fail or the server closes them.
+    """
+    def __init__(self, size, connect=_connect):
+        self.size = size
+        self.connect = connect
+        self.idle = []
+        self.opened = 0
+        self.lock = threading.Condition()
+
+    def acquire(self):
+        """
+        Returns a live connection, waiting for one to be released if all of
+        them are in use.
+        """
+        while True:
+            with self.lock:
+                self.lock.wait_for(
+                    lambda: self.idle or self.opened < self.size)
+                if self.idle:
+                    connection = self.idle.pop()
+                else:
+                    self.opened += 1
+                    connection = None
+
+            if connection is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+
+            if _alive(connection):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        with self.lock:
+            self.idle.append(connection)
+            self.lock.notify()
+
+    def discard(self, connection):
+        if connection is not None:
+            _quit(connection)
+        with self.lock:
+            self.opened -= 1
+            self.lock.notify()
+
+    def send(self, message):
+        connection = self.acquire()
+        try:
+            connection.send_message(message)
+        except (smtplib.SMTPException, OSError):
+            self.discard(connection)
+            raise
+        self.release(connection)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            self.discard(connection)
+
+
+class Relay:
+    def __init__(self, upstream=None):
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.limiters = {}
+        self.senders = {}
+        self.dropped = 0
+        self.upstream = upstream or UpstreamPool(UPSTREAM_CONNECTIONS)
+        self.executor = ThreadPoolExecutor(max_workers=self.upstream.size)
+
+    def receive(self, mailfrom, rcpttos, data):
+        message = message_from_bytes(data)
+
+        with self.lock:
+            for recipient in rcpttos:
+                queue = self.queues.setdefault(recipient,
+                                               deque(maxlen=QUEUE_LIMIT))
+                if len(queue) == QUEUE_LIMIT:
+                    self.dropped += 1
+                queue.append(message)
+                self.senders[recipient] = mailfrom
+
+    def _digest(self, sender, recipient, alerts):
+        if len(alerts) == 1:
+            message = alerts[0]
+            del message["To"]
+            message["To"] = recipient
+            return message
+
+        digest = EmailMessage()
+        digest["Subject"] = "{} ({} alerts)".format(
+            alerts[-1].get("Subject", "Alerts"), len(alerts))
+        digest["From"] = sender
+        digest["To"] = recipient
+        digest["Date"] = formatdate(localtime=True)
+        digest["Message-ID"] = make_msgid()
+
+        parts = []
+        for alert in alerts:
+            body = alert.get_payload(decode=True) or b""
+            parts.append("{}\n{}\n\n{}".format(
+                alert.get("Date", ""), alert.get("Subject", ""),
+                body.decode("utf-8", "replace")))
+        digest.set_content(("\n\n" + "-" * 72 + "\n\n").join(parts))
+        return digest
+
+    def _send(self, recipient, queue, alerts):
+        try:
+            self.upstream.send(self._digest(self.senders[recipient],
+                                            recipient, alerts))
+        except (smtplib.SMTPException, OSError) as err:
+            log.error("Could not send to %s: %s", recipient, err)
+            with self.lock:
+                queue.extendleft(reversed(alerts))
+            return
+
+        log.info("Sent %d alerts to %s", len(alerts), recipient)
+
+    def flush(self):
+        """
+        Send a digest to every recipient with queued alerts, unless the
+        recipient is rate limited. The digests are sent in parallel over the
+        upstream connection pool.
+        """
+        with self.lock:
+            pending = {recipient: queue for recipient, queue
+                       in self.queues.items() if queue}
+
+        sending = []
+        for recipient, queue in pending.items():
+            limiter = self.limiters.setdefault(recipient,
+                                               RateLimiter(RATE_LIMIT))
+            if not limiter.allow():
+                log.info("Rate limited %s, %d alerts queued", recipient,
+                         len(queue))
+                continue
+
+            with self.lock:
+                alerts = list(queue)
+                queue.clear()
+
+            sending.append(self.executor.submit(self._send, recipient, queue,
+                                                alerts))
+
+        for future in sending:
+            future.result()
+
+        if self.dropped:
+            log.warning("Dropped %d alerts", self.dropped)
+            self.dropped = 0
+
+
+def _address(argument, prefix):
+    """
+    Returns the address of a MAIL FROM or RCPT TO argument, None if the
+    argument is malformed. Parameters after the address are ignored.
+    """
+    if not argument.upper().startswith(prefix):
+        return None
+    address = argument[len(prefix):].strip().split(" ", 1)[0]
+    if address.startswith("<") and address.endswith(">"):
+        address = address[1:-1]
+    return address
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    One SMTP session, every accepted mail is handed to the relay.
+    """
+    def reply(self, code, *lines):
+        for line in lines[:-1]:
+            self.wfile.write("{}-{}\r\n".format(code, line).encode())
+        self.wfile.write("{} {}\r\n".format(code, lines[-1]).encode())
+
+    def read_data(self):
+        """
+        Reads the mail after DATA up to the terminating dot, None if it is
+        larger than MAX_MESSAGE_SIZE or the client hung up.
+        """
+        data = []
+        size = 0
+        while True:
+            line = self.rfile.readline(MAX_MESSAGE_SIZE)
+            if not line:
+                return None
+            if line in (b".\r\n", b".\n"):
+                break
+            if line.startswith(b"."):
+                line = line[1:]
+            size += len(line)
+            if size > MAX_MESSAGE_SIZE:
+                return None
+            data.append(line)
+        return b"".join(data)
+
+    def handle(self):
+        mailfrom = None
+        rcpttos = []
+
+        self.reply(220, "alertrelay ESMTP")
+        while True:
+            line = self.rfile.readline(MAX_LINE_LENGTH + 1)
+            if not line:
+                return
+            if len(line) > MAX_LINE_LENGTH:
+                self.reply(500, "Line too long")
+                return
+
+            command, _, argument = line.decode("utf-8", "replace") \
+                .strip().partition(" ")
+            command = command.upper()
+
+            if command == "HELO":
+                self.reply(250, "alertrelay")
+            elif command == "EHLO":
+                self.reply(250, "alertrelay", "8BITMIME",
+                           "SIZE {}".format(MAX_MESSAGE_SIZE))
+            elif command == "MAIL":
+                mailfrom = _address(argument, "FROM:")
+                rcpttos = []
+                if mailfrom is None:
+                    self.reply(501, "Syntax: MAIL FROM:<address>")
+                else:
+                    self.reply(250, "OK")
+            elif command == "RCPT":
+                recipient = _address(argument, "TO:")
+                if mailfrom is None:
+                    self.reply(503, "Need MAIL command")
+                elif not recipient:
+                    self.reply(501, "Syntax: RCPT TO:<address>")
+                else:
+                    rcpttos.append(recipient)
+                    self.reply(250, "OK")
+            elif command == "DATA":
+                if not rcpttos:
+                    self.reply(503, "Need RCPT command")
+                    continue
+                self.reply(354, "End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                if data is None:
+                    self.reply(552, "Message too large")
+                    return
+                self.server.relay.receive(mailfrom, rcpttos, data)
+                mailfrom = None
+                rcpttos = []
+                self.reply(250, "OK")
+            elif command == "RSET":
+                mailfrom = None
+                rcpttos = []
+                self.reply(250, "OK")
+            elif command == "NOOP":
+                self.reply(250, "OK")
+            elif command == "QUIT":
+                self.reply(221, "Bye")
+                return
+            else:
+                self.reply(502, "Command not implemented")
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, relay):
+        super().__init__(address, SMTPHandler)
+        self.relay = relay
+
+
+def _flush_periodically(relay):
+    while True:
+        time.sleep(DIGEST_INTERVAL)
+        try:
+            relay.flush()
+        except Exception:
+            log.exception("Flush failed")
+
+
+def check():
+    """
+    Healthcheck, the relay accepts SMTP connections.
+    """
+    connection = smtplib.SMTP("127.0.0.1", LISTEN_PORT, timeout=5)
+    connection.noop()
+    connection.quit()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    relay = Relay()
+    server = Server(("0.0.0.0", LISTEN_PORT), relay)
+
+    flusher = threading.Thread(target=_flush_periodically, args=(relay,))
+    flusher.daemon = True
+    flusher.start()
+
+    log.info("Relaying alerts to %s:%d over at most %d connections, digests "
+             "every %d seconds", UPSTREAM_HOST, UPSTREAM_PORT,
+             UPSTREAM_CONNECTIONS, DIGEST_INTERVAL)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["check"]:
+        check()
+    else:
+        main()
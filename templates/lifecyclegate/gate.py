@@ -0,0 +1,485 @@
+"""
+Scaling lifecycle gate between the Autoscaler and the Charmpool.
+
+The Autoscaler's desired pool size (POST /pool/size) is not passed straight
+on to the Charmpool. The gate first tells the application being scaled what
+is about to happen, through the requests file in STATE_DIR, which the charm
+publishes on the scaling-lifecycle relation:
+
+* Scale-out: a notice with the number of units to come is published
+  SCALE_OUT_LEAD seconds before the pool size is raised, so that the
+  application can pre-warm. With MAX_INFLIGHT, the pool size is raised in
+  steps so that at most that many machines are being provisioned at a time,
+  the rest is held back until the pending machines are up. With WARM_SPARES,
+  the pool size is only raised once the charm has placed what units it can
+  on its warm spare machines and acknowledged the notice in the acks file,
+  or after PLACEMENT_TIMEOUT seconds.
+* Scale-in: the machines to remove are picked, newest first, and the Juju
+  units on them, which the Charmpool lists in the machines' metadata, are
+  asked to drain. The machines are terminated once every one of the units
+  has acknowledged the drain in the acks file, or after DRAIN_TIMEOUT
+  seconds.
+
+One scaling operation runs at a time. While one is in progress, later
+desired sizes replace each other and only the latest is applied next. All
+other requests are passed through to the Charmpool untouched.
+
+Only the Python standard library is used so that the gate runs in a stock
+Python image.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import http.client
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+LISTEN_PORT = int(os.environ.get("LISTEN_PORT", 80))
+
+UPSTREAM_URL = os.environ.get("UPSTREAM_URL", "http://charmpool:80")
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 30))
+
+STATE_DIR = os.environ.get("STATE_DIR", "/lifecycle/state")
+REQUESTS_FILE = "requests.json"
+ACKS_FILE = "acks.json"
+
+SCALE_OUT_LEAD = float(os.environ.get("SCALE_OUT_LEAD", 0))
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 300))
+
+# Machines provisioned concurrently during a scale-out, 0 means no limit.
+MAX_INFLIGHT = int(os.environ.get("MAX_INFLIGHT", 0))
+
+# Warm spare machines kept by the charm, 0 if there is no warm pool.
+WARM_SPARES = int(os.environ.get("WARM_SPARES", 0))
+PLACEMENT_TIMEOUT = float(os.environ.get("PLACEMENT_TIMEOUT", 60))
+
+# Seconds between two reads of the acks file while draining, and of the
+# machines while a scale-out is held back.
+ACK_POLL_INTERVAL = float(os.environ.get("ACK_POLL_INTERVAL", 1))
+
+# Machine states of the machines which can be picked for removal.
+ALIVE_STATES = ("REQUESTED", "PENDING", "RUNNING")
+
+# Machine states of the machines which are being provisioned.
+INFLIGHT_STATES = ("REQUESTED", "PENDING")
+
+# Headers which are not forwarded, they describe the connection rather than
+# the response.
+HOP_BY_HOP = ("connection", "keep-alive", "transfer-encoding",
+              "content-length")
+
+log = logging.getLogger("lifecyclegate")
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class Pool:
+    """
+    Client of the Charmpool's REST API.
+    """
+    def __init__(self, url):
+        url = urlparse(url)
+        self.address = (url.hostname, url.port or 80)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        :returns: (status, headers, content) of the Charmpool's response
+        :raises OSError: The Charmpool is unavailable
+        """
+        connection = http.client.HTTPConnection(*self.address,
+                                                timeout=UPSTREAM_TIMEOUT)
+        try:
+            connection.request(method, path, body=body,
+                               headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            connection.close()
+
+    def _json(self, method, path, data=None):
+        body = None if data is None else json.dumps(data).encode("utf-8")
+        status, _, content = self.request(
+            method, path, body, {"Content-Type": "application/json"})
+        if status != 200:
+            raise UpstreamError("{} {} failed with status {}: {}".format(
+                method, path, status, content.decode("utf-8", "replace")))
+        return json.loads(content.decode("utf-8")) if content else None
+
+    def size(self):
+        return self._json("GET", "/pool/size")
+
+    def machines(self):
+        return self._json("GET", "/pool")["machines"]
+
+    def set_size(self, size):
+        self._json("POST", "/pool/size", {"desiredSize": size})
+
+    def terminate(self, machine):
+        self._json("POST", "/pool/{}/terminate".format(machine),
+                   {"decrementDesiredSize": True})
+
+
+def _write_json(path, data):
+    # Readers never see a partially written file
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as tmp_file:
+        json.dump(data, tmp_file)
+    os.rename(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def pick_victims(machines, count):
+    """
+    :returns: list of the newest machines which are alive
+    """
+    alive = [machine for machine in machines
+             if machine.get("machineState") in ALIVE_STATES]
+    alive.sort(key=lambda machine: (machine.get("launchTime") or "",
+                                    machine["id"]), reverse=True)
+    return alive[:count]
+
+
+def machine_units(machine):
+    """
+    The Charmpool's machine ids are not the names of the Juju units, the units
+    deployed to a machine are listed in its metadata.
+
+    :returns: list of the names of the units on the machine
+    """
+    units = (machine.get("metadata") or {}).get("units") or []
+    if isinstance(units, str):
+        units = [units]
+    return list(units)
+
+
+class Coordinator:
+    """
+    Applies the desired pool sizes one scaling operation at a time.
+    """
+    def __init__(self, pool, state_dir=STATE_DIR, lead=SCALE_OUT_LEAD,
+                 drain_timeout=DRAIN_TIMEOUT, max_inflight=MAX_INFLIGHT,
+                 warm_spares=WARM_SPARES):
+        self.pool = pool
+        self.state_dir = state_dir
+        self.lead = lead
+        self.drain_timeout = drain_timeout
+        self.max_inflight = max_inflight
+        self.warm_spares = warm_spares
+        self.counters = {"scale_outs": 0, "drains": 0, "drained": 0,
+                         "drain_timeouts": 0, "held_back": 0,
+                         "placement_timeouts": 0, "errors": 0}
+
+        self._cond = threading.Condition()
+        self._desired = None
+        self._target = None
+        self._requests = {"scale_out": None, "drain": None}
+        self._sequence = 0
+
+    @property
+    def target(self):
+        """
+        The latest desired size, until it has been applied.
+        """
+        with self._cond:
+            return self._desired if self._desired is not None \
+                else self._target
+
+    def request(self, size):
+        with self._cond:
+            self._desired = size
+            self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            return dict(self.counters, target=self.target,
+                        requests=dict(self._requests))
+
+    def _publish(self, **requests):
+        with self._cond:
+            self._requests.update(requests)
+            _write_json(os.path.join(self.state_dir, REQUESTS_FILE),
+                        self._requests)
+
+    def _acks(self):
+        return _read_json(os.path.join(self.state_dir, ACKS_FILE))
+
+    def _next_id(self):
+        self._sequence += 1
+        return "{}-{}".format(int(time.time()), self._sequence)
+
+    def scale_out(self, current, size):
+        notice = {"id": self._next_id(), "units": size - current,
+                  "size": size, "at": time.time() + self.lead}
+        log.info("Scale-out notice: %d more units in %.0fs",
+                 notice["units"], self.lead)
+        self._publish(scale_out=notice)
+        time.sleep(self.lead)
+        if self.warm_spares:
+            self.wait_for_placement(notice)
+
+        held_back = False
+        while current < size:
+            step = self._inflight_room(current, size - current)
+            if step == 0:
+                if not held_back:
+                    held_back = True
+                    self.counters["held_back"] += 1
+                    log.info("Holding back %d units, %d machines are being "
+                             "provisioned", size - current,
+                             self.max_inflight)
+                # A newer desired size replaces this one
+                with self._cond:
+                    if self._desired is not None:
+                        break
+                time.sleep(ACK_POLL_INTERVAL)
+                continue
+
+            current += step
+            self.pool.set_size(current)
+
+        self.counters["scale_outs"] += 1
+        self._publish(scale_out=None)
+
+    def wait_for_placement(self, notice):
+        """
+        Wait for the charm to place the notice's units on warm spares, so
+        that the Charmpool doesn't provision machines for them as well.
+
+        :returns: True if the charm has acknowledged the placement in time
+        """
+        deadline = time.time() + PLACEMENT_TIMEOUT
+        while self._acks().get("placed") != notice["id"]:
+            if time.time() >= deadline:
+                self.counters["placement_timeouts"] += 1
+                log.warning("No warm spare placement for the scale-out, "
+                            "raising the pool size anyway")
+                return False
+            time.sleep(ACK_POLL_INTERVAL)
+        return True
+
+    def _inflight_room(self, current, units):
+        """
+        :param current: The pool's desired size
+        :param units: Units to add
+        :returns: how many of the units can be requested without exceeding
+                  the number of machines provisioned concurrently
+        """
+        if not self.max_inflight:
+            return units
+
+        machines = self.pool.machines()
+        alive = [machine for machine in machines
+                 if machine.get("machineState") in ALIVE_STATES]
+        # Units requested from the Charmpool which it hasn't listed yet are
+        # on their way as well
+        inflight = sum(1 for machine in alive
+                       if machine["machineState"] in INFLIGHT_STATES) + \
+            max(current - len(alive), 0)
+        return max(min(units, self.max_inflight - inflight), 0)
+
+    def drain(self, victims):
+        """
+        Ask the units to drain and wait for their acknowledgements.
+
+        :returns: True if all of the units have drained in time
+        """
+        request = {"id": self._next_id(), "units": victims,
+                   "deadline": time.time() + self.drain_timeout}
+        log.info("Draining %s for at most %.0fs", ", ".join(victims),
+                 self.drain_timeout)
+        self._publish(drain=request)
+        self.counters["drains"] += 1
+
+        while True:
+            acks = self._acks()
+            if acks.get("subscribers") == 0:
+                # Nothing is listening on the relation
+                return True
+            if acks.get("drain") == request["id"] and \
+                    set(victims) <= set(acks.get("drained", [])):
+                self.counters["drained"] += 1
+                return True
+            if time.time() >= request["deadline"]:
+                self.counters["drain_timeouts"] += 1
+                log.warning("Drain timed out, terminating %s anyway",
+                            ", ".join(victims))
+                return False
+            time.sleep(ACK_POLL_INTERVAL)
+
+    def scale_in(self, current, size):
+        victims = pick_victims(self.pool.machines(), current - size)
+
+        units = []
+        for victim in victims:
+            if not machine_units(victim):
+                log.warning("No units known on machine %s, it is "
+                            "terminated without draining", victim["id"])
+            units.extend(machine_units(victim))
+
+        if units:
+            self.drain(units)
+        for victim in victims:
+            self.pool.terminate(victim["id"])
+        if units:
+            self._publish(drain=None)
+
+        # Machines which couldn't be picked are left to the Charmpool
+        if len(victims) < current - size:
+            self.pool.set_size(size)
+
+    def apply(self, size):
+        current = self.pool.size()["desiredSize"]
+        if size > current:
+            self.scale_out(current, size)
+        elif size < current:
+            self.scale_in(current, size)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._desired is None:
+                    self._cond.wait()
+                size, self._desired = self._desired, None
+                self._target = size
+
+            try:
+                self.apply(size)
+            except Exception as err:
+                self.counters["errors"] += 1
+                log.error("Cannot apply pool size %d: %s", size, err)
+                self._publish(scale_out=None, drain=None)
+                # Try again unless a newer size has been requested
+                with self._cond:
+                    if self._desired is None:
+                        self._desired = size
+                time.sleep(ACK_POLL_INTERVAL)
+            finally:
+                with self._cond:
+                    self._target = None
+
+    def start(self):
+        self._publish()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+class GateHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers, content):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _json(self, status, data):
+        self._reply(status, [("Content-Type", "application/json")],
+                    json.dumps(data).encode("utf-8"))
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else None
+
+    def _forward(self, method, body=None):
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in HOP_BY_HOP + ("host",)}
+        try:
+            return self.server.pool.request(method, self.path, body, headers)
+        except OSError as err:
+            return 502, [("Content-Type", "application/json")], \
+                json.dumps({"message": str(err)}).encode("utf-8")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        coordinator = self.server.coordinator
+
+        if path == "/gate/status":
+            return self._json(200, coordinator.status())
+        if path == "/gate/health":
+            return self._json(200, {"status": "ok"})
+
+        status, headers, content = self._forward("GET")
+
+        # Report the size the pool is on its way to
+        target = coordinator.target
+        if path == "/pool/size" and status == 200 and target is not None:
+            size = json.loads(content.decode("utf-8"))
+            size["desiredSize"] = target
+            return self._json(200, size)
+
+        self._reply(status, headers, content)
+
+    def do_POST(self):
+        body = self._body()
+
+        if urlparse(self.path).path == "/pool/size":
+            try:
+                size = int(json.loads(body.decode("utf-8"))["desiredSize"])
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return self._json(400, {"message": "Invalid desired size"})
+            if size < 0:
+                return self._json(400, {"message": "Invalid desired size"})
+            self.server.coordinator.request(size)
+            return self._reply(200, [], b"")
+
+        self._reply(*self._forward("POST", body))
+
+
+class GateServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool, coordinator):
+        self.pool = pool
+        self.coordinator = coordinator
+        super().__init__(address, GateHandler)
+
+
+def check():
+    """
+    Healthcheck, the gate answers HTTP requests.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", LISTEN_PORT,
+                                            timeout=5)
+    connection.request("GET", "/gate/health")
+    if connection.getresponse().status != 200:
+        sys.exit(1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    pool = Pool(UPSTREAM_URL)
+    coordinator = Coordinator(pool).start()
+    server = GateServer(("0.0.0.0", LISTEN_PORT), pool, coordinator)
+
+    log.info("Gating pool size changes to %s", UPSTREAM_URL)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["check"]:
+        check()
+    else:
+        main()
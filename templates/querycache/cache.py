@@ -0,0 +1,600 @@
+"""
+Caching proxy between the Autoscaler's metric streams and InfluxDB.
+
+Read queries (GET /query) are cached for CACHE_TTL seconds, keyed by their
+query parameters. Identical queries which arrive while the same query is
+already on its way to InfluxDB wait for its result rather than being sent
+again. Everything else is passed through to InfluxDB untouched.
+
+The metric streams ask for a time window which moves with every poll, so
+their queries hardly ever repeat as sent. The window of a query is therefore
+widened to whole multiples of CACHE_QUANTUM seconds, the poll interval,
+before it is looked up and sent to InfluxDB. Each client is served the points
+within its own window, so queries sent during the same poll interval share one
+cache entry.
+
+The results stay the same as InfluxDB's for the query as sent. A query which
+is grouped by time is widened to multiples of both the quantum and its
+interval, and only the buckets which lie wholly inside the original window
+are served from the shared entry. The partial buckets at the edges of the
+window are queried as they are and added to the result.
+
+The upstream InfluxDB is read from UPSTREAM_FILE, a JSON document with the
+host and port, which is reloaded whenever it changes. Hit, miss and latency
+counters are served on GET /cache/stats.
+
+Only the Python standard library is used so that the proxy runs in a stock
+Python image.
+"""
+import calendar
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import http.client
+import json
+import logging
+import math
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+LISTEN_PORT = int(os.environ.get("LISTEN_PORT", 8086))
+
+UPSTREAM_FILE = os.environ.get("UPSTREAM_FILE", "/querycache/upstream.json")
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 30))
+
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 10))
+
+# Cached query results, the least recently used are evicted first.
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", 1000))
+
+# Grid in seconds which the time windows of the queries are widened to, 0
+# leaves the queries as they are.
+CACHE_QUANTUM = float(os.environ.get("CACHE_QUANTUM", 0))
+
+# Latency samples kept for the percentiles.
+LATENCY_SAMPLES = 1000
+
+# Headers which are not forwarded, they describe the connection rather than
+# the response.
+HOP_BY_HOP = ("connection", "keep-alive", "transfer-encoding",
+              "content-length")
+
+# Nanoseconds per InfluxQL epoch unit, also used for the epoch parameter.
+EPOCH_UNITS = {"ns": 1, "u": 10 ** 3, "\u00b5": 10 ** 3, "ms": 10 ** 6,
+               "s": 10 ** 9, "m": 60 * 10 ** 9, "h": 3600 * 10 ** 9,
+               "d": 86400 * 10 ** 9, "w": 604800 * 10 ** 9}
+
+_UNIT = r"(ns|u|\u00b5|ms|s|m|h|d|w)"
+_TIME_BOUND = re.compile(r"\btime\s*(>=|>|<=|<)\s*('[^']*'|\d+" + _UNIT +
+                         r"?)(?![\w.])", re.IGNORECASE)
+_GROUP_BY_TIME = re.compile(r"\bgroup\s+by\b.*?\btime\(\s*(\d+)" + _UNIT,
+                            re.IGNORECASE)
+_RFC3339 = re.compile(r"^(\d+-\d\d-\d\d)T(\d\d:\d\d:\d\d)(?:\.(\d+))?Z$")
+
+log = logging.getLogger("querycache")
+
+
+class Upstream:
+    """
+    The InfluxDB queries are forwarded to. One connection per thread is kept
+    open between requests.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.address = None
+        self._mtime = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.path) as upstream_file:
+                upstream = json.load(upstream_file)
+            self._mtime = mtime
+            if "host" not in upstream:
+                return
+            self.address = (upstream["host"], int(upstream["port"]))
+        log.info("Upstream InfluxDB: %s:%d", *self.address)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or \
+                (connection.host, connection.port) != self.address:
+            if connection is not None:
+                connection.close()
+            connection = http.client.HTTPConnection(
+                *self.address, timeout=UPSTREAM_TIMEOUT)
+            self._local.connection = connection
+        return connection
+
+    def request(self, method, path, body, headers):
+        """
+        :returns: (status, headers, content) of the upstream response
+        :raises OSError: InfluxDB is unavailable
+        """
+        self._reload()
+        if self.address is None:
+            raise OSError("No upstream InfluxDB configured")
+
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+                return response.status, response.getheaders(), content
+            except (http.client.HTTPException, OSError):
+                # The idle connection might have been closed, reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def _rank(rank):
+        return ordered[min(int(rank / 100.0 * len(ordered)),
+                           len(ordered) - 1)]
+
+    return {"p50": _rank(50), "p95": _rank(95), "p99": _rank(99),
+            "max": ordered[-1]}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "merged": 0, "passed": 0,
+                         "errors": 0, "normalised": 0, "edges": 0}
+        self.upstream = deque(maxlen=LATENCY_SAMPLES)
+        self.served = deque(maxlen=LATENCY_SAMPLES)
+
+    def count(self, counter, served=None, upstream=None):
+        with self.lock:
+            self.counters[counter] += 1
+            if served is not None:
+                self.served.append(served)
+            if upstream is not None:
+                self.upstream.append(upstream)
+
+    def summary(self, entries):
+        with self.lock:
+            summary = dict(self.counters, entries=entries)
+            queries = summary["hits"] + summary["misses"] + summary["merged"]
+            summary["hit_ratio"] = (summary["hits"] + summary["merged"]) / \
+                float(queries) if queries else None
+            summary["latency"] = {
+                "served": _percentiles(list(self.served)),
+                "upstream": _percentiles(list(self.upstream))
+            }
+            return summary
+
+
+class Flight:
+    """
+    A query on its way to InfluxDB, which identical queries wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class QueryCache:
+    def __init__(self, upstream, ttl=CACHE_TTL, size=CACHE_SIZE,
+                 quantum=CACHE_QUANTUM):
+        self.upstream = upstream
+        self.ttl = ttl
+        self.size = size
+        self.quantum = quantum
+        self.stats = Stats()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+    def _cached(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, response = entry
+        if expires <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def query(self, key, method, path, headers):
+        """
+        :returns: (status, headers, content), served from the cache, from an
+                  identical query in flight or from InfluxDB
+        """
+        start = time.monotonic()
+
+        with self._lock:
+            response = self._cached(key, start)
+            flight = self._flights.get(key) if response is None else None
+            leader = response is None and flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if response is not None:
+            self.stats.count("hits", served=time.monotonic() - start)
+            return response
+
+        if not leader:
+            flight.done.wait(UPSTREAM_TIMEOUT)
+            if flight.error is not None or flight.response is None:
+                raise flight.error or OSError("Merged query timed out")
+            self.stats.count("merged", served=time.monotonic() - start)
+            return flight.response
+
+        sent = time.monotonic()
+        try:
+            flight.response = self.upstream.request(method, path, None,
+                                                    headers)
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.response is not None and \
+                        flight.response[0] == 200:
+                    self._entries[key] = (time.monotonic() + self.ttl,
+                                          flight.response)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+
+        now = time.monotonic()
+        self.stats.count("misses", served=now - start, upstream=now - sent)
+        return flight.response
+
+    def stats_summary(self):
+        with self._lock:
+            entries = len(self._entries)
+        return self.stats.summary(entries)
+
+
+def _cache_key(url, authorization):
+    # Parameter order doesn't change the query, the credentials do
+    return (url.path, urlencode(sorted(parse_qsl(url.query,
+                                                 keep_blank_values=True))),
+            authorization)
+
+
+def _nanoseconds(value, unit="ns"):
+    """
+    :returns: The nanoseconds since the epoch of an InfluxQL time literal or
+              of a time in a query result, None if it can't be read
+    """
+    if isinstance(value, (int, float)):
+        return int(value * EPOCH_UNITS.get(unit, 1))
+
+    value = value.strip("'")
+    match = _RFC3339.match(value)
+    if match:
+        date, clock, fraction = match.groups()
+        seconds = calendar.timegm(time.strptime(
+            "{}T{}".format(date, clock), "%Y-%m-%dT%H:%M:%S"))
+        return seconds * 10 ** 9 + int((fraction or "0")[:9].ljust(9, "0"))
+
+    match = re.match(r"^(\d+)" + _UNIT + "?$", value)
+    if match:
+        return int(match.group(1)) * EPOCH_UNITS[match.group(2) or "ns"]
+    return None
+
+
+def _with_window(query, bounds, lower, upper):
+    """
+    :returns: The query with its time bounds replaced by the half-open window
+              from `lower` to `upper` nanoseconds, no upper bound if None
+    """
+    has_upper = any(bound.group(1).startswith("<") for bound in bounds)
+    parts = []
+    position = 0
+    for bound in bounds:
+        if bound.group(1).startswith(">"):
+            replaced = "time >= {}".format(lower)
+            if upper is not None and not has_upper:
+                replaced = "({} AND time < {})".format(replaced, upper)
+        else:
+            replaced = "time < {}".format(upper)
+        parts.extend([query[position:bound.start()], replaced])
+        position = bound.end()
+    parts.append(query[position:])
+    return "".join(parts)
+
+
+def normalise(query, quantum):
+    """
+    Widen the time window of a query to whole multiples of `quantum`
+    nanoseconds, so that queries which are sent within the same multiple
+    are the same query. A query grouped by time is widened to multiples of
+    its interval as well, the buckets of the widened query which lie wholly
+    inside the original window then hold the same points as InfluxDB's
+    buckets for the original query.
+
+    Only a single statement with one lower and at most one upper time bound
+    is normalised, anything else is left as it is. So is a query grouped by
+    time whose window doesn't hold a whole bucket.
+
+    :returns: tuple of the normalised query and the window to serve from its
+              result, a dict with the "lower" and "upper" bounds as
+              (nanoseconds, inclusive) tuples and the "edges", a list of
+              queries for the partial buckets at the edges of the original
+              window. The window is None if the query was left as it is.
+    """
+    bounds = list(_TIME_BOUND.finditer(query))
+    lower_bounds = [bound for bound in bounds
+                    if bound.group(1).startswith(">")]
+    if not quantum or ";" in query.strip().rstrip(";") or \
+            len(lower_bounds) != 1 or len(bounds) - len(lower_bounds) > 1:
+        return query, None
+
+    # The original window, from lower up to but not including upper
+    lower = upper = None
+    for bound in bounds:
+        nanoseconds = _nanoseconds(bound.group(2))
+        if nanoseconds is None:
+            return query, None
+        exclusive = bound.group(1) in (">", "<=")
+        if bound.group(1).startswith(">"):
+            lower = nanoseconds + exclusive
+        else:
+            upper = nanoseconds + exclusive
+
+    window = {"lower": (lower, True), "edges": []}
+    if upper is not None:
+        window["upper"] = (upper, False)
+
+    grid = quantum
+    group_by = _GROUP_BY_TIME.search(query)
+    if group_by:
+        interval = int(group_by.group(1)) * EPOCH_UNITS[group_by.group(2)]
+        grid = quantum * interval // math.gcd(quantum, interval)
+
+        # The whole buckets inside the window
+        first = -(-lower // interval) * interval
+        last = None if upper is None else upper // interval * interval
+        if last is not None and first >= last:
+            return query, None
+
+        if first != lower:
+            window["edges"].append(_with_window(query, bounds, lower, first))
+            window["lower"] = (first, True)
+        if last is not None and last != upper:
+            window["edges"].append(_with_window(query, bounds, last, upper))
+            window["upper"] = (last, False)
+
+    widened = _with_window(query, bounds, lower // grid * grid,
+                           None if upper is None else -(-upper // grid) * grid)
+    return widened, window
+
+
+def trim(content, window, epoch=None):
+    """
+    Drop the points of a normalised query's result which are outside of the
+    query's original window.
+
+    :returns: The trimmed result, as JSON encoded bytes
+    """
+    try:
+        result = json.loads(content.decode("utf-8"))
+    except ValueError:
+        return content
+
+    def _inside(value):
+        nanoseconds = _nanoseconds(value, epoch or "ns")
+        if nanoseconds is None:
+            return True
+        for name, sign in (("lower", 1), ("upper", -1)):
+            if name not in window:
+                continue
+            bound, inclusive = window[name]
+            if (nanoseconds - bound) * sign < 0 or \
+                    (nanoseconds == bound and not inclusive):
+                return False
+        return True
+
+    for statement in result.get("results", []):
+        for series in statement.get("series", []):
+            series["values"] = [row for row in series.get("values", [])
+                                if _inside(row[0])]
+
+    return json.dumps(result).encode("utf-8")
+
+
+def merge(content, edges, epoch=None):
+    """
+    Add the points of the edge queries' results to the series of a trimmed
+    result, in time order.
+
+    :param edges: The results of the edge queries, as JSON encoded bytes
+    :returns: The merged result, as JSON encoded bytes
+    """
+    try:
+        result = json.loads(content.decode("utf-8"))
+        edge_results = [json.loads(edge.decode("utf-8")) for edge in edges]
+    except ValueError:
+        return content
+
+    def _key(series):
+        return series.get("name"), json.dumps(series.get("tags"),
+                                              sort_keys=True)
+
+    def _time(row):
+        return _nanoseconds(row[0], epoch or "ns") or 0
+
+    for position, statement in enumerate(result.get("results", [])):
+        merged = OrderedDict((_key(series), series)
+                             for series in statement.get("series", []))
+        for edge_result in edge_results:
+            edge_statements = edge_result.get("results", [])
+            if position >= len(edge_statements):
+                continue
+            for series in edge_statements[position].get("series", []):
+                if _key(series) in merged:
+                    merged[_key(series)]["values"].extend(
+                        series.get("values", []))
+                else:
+                    merged[_key(series)] = series
+
+        for series in merged.values():
+            series["values"] = sorted(series.get("values", []), key=_time)
+        if merged:
+            statement["series"] = list(merged.values())
+
+    return json.dumps(result).encode("utf-8")
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers, content):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _json(self, status, data):
+        self._reply(status, [("Content-Type", "application/json")],
+                    json.dumps(data).encode("utf-8"))
+
+    def _headers(self):
+        return {name: value for name, value in self.headers.items()
+                if name.lower() not in HOP_BY_HOP + ("host",)}
+
+    def _forward(self, method):
+        cache = self.server.cache
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else None
+
+        try:
+            response = cache.upstream.request(method, self.path, body,
+                                              self._headers())
+        except Exception as err:
+            cache.stats.count("errors")
+            return self._json(502, {"error": str(err)})
+
+        cache.stats.count("passed")
+        self._reply(*response)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        cache = self.server.cache
+
+        if url.path == "/cache/stats":
+            return self._json(200, cache.stats_summary())
+        if url.path == "/cache/health":
+            return self._json(200, {"status": "ok"})
+        if url.path != "/query":
+            return self._forward("GET")
+
+        params = parse_qsl(url.query, keep_blank_values=True)
+        query = dict(params).get("q", "")
+        window = None
+        if "chunked" not in dict(params):
+            query, window = normalise(query, int(cache.quantum * 10 ** 9))
+        if window is not None:
+            params = [(name, query if name == "q" else value)
+                      for name, value in params]
+            url = url._replace(query=urlencode(params))
+            cache.stats.count("normalised")
+
+        try:
+            response = cache.query(
+                _cache_key(url, self.headers.get("Authorization")), "GET",
+                url.geturl(), self._headers())
+        except Exception as err:
+            cache.stats.count("errors")
+            return self._json(502, {"error": str(err)})
+
+        status, headers, content = response
+        if window is not None and status == 200:
+            epoch = dict(params).get("epoch")
+            content = trim(content, window, epoch)
+
+            edges = []
+            for edge in window["edges"]:
+                edge_url = url._replace(query=urlencode([
+                    (name, edge if name == "q" else value)
+                    for name, value in params]))
+                try:
+                    edge_status, edge_headers, edge_content = cache.query(
+                        _cache_key(edge_url,
+                                   self.headers.get("Authorization")),
+                        "GET", edge_url.geturl(), self._headers())
+                except Exception as err:
+                    cache.stats.count("errors")
+                    return self._json(502, {"error": str(err)})
+                if edge_status != 200:
+                    return self._reply(edge_status, edge_headers,
+                                       edge_content)
+                cache.stats.count("edges")
+                edges.append(edge_content)
+            content = merge(content, edges, epoch)
+        self._reply(status, headers, content)
+
+    def do_POST(self):
+        self._forward("POST")
+
+    def do_HEAD(self):
+        self._forward("HEAD")
+
+
+class ProxyServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        self.cache = cache
+        super().__init__(address, ProxyHandler)
+
+
+def check():
+    """
+    Healthcheck, the proxy answers HTTP requests.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", LISTEN_PORT,
+                                            timeout=5)
+    connection.request("GET", "/cache/health")
+    if connection.getresponse().status != 200:
+        sys.exit(1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    cache = QueryCache(Upstream(UPSTREAM_FILE))
+    server = ProxyServer(("0.0.0.0", LISTEN_PORT), cache)
+
+    log.info("Caching InfluxDB queries for %.0f seconds, time windows "
+             "widened to %.0f seconds", CACHE_TTL, CACHE_QUANTUM)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["check"]:
+        check()
+    else:
+        main()
@@ -0,0 +1,533 @@
+"""
+Offline replay of the CharmScaler's scaling rules over recorded metric series.
+
+The metric definitions are rendered with the charm's own Autoscaler templates
+and the rendered metric streams and predictors are evaluated against the
+recorded data: every metric stream is downsampled with its aggregate function,
+and every rule-based predictor is evaluated at each scaling interval. The
+resulting unit counts are simulated with a provisioning delay for new units.
+Proportional resizes are resolved against the desired number of units at each
+decision, like the charm resolves them again whenever the units change.
+
+The series can be read from InfluxDB JSON query results, line protocol files
+or CSV files (InfluxDB CLI exports or plain time,value rows).
+
+Usage::
+
+    python -m tools.replay metrics.json --series cpu=telegraf.lp \\
+        --provisioning-delay 300 --unit-capacity 60
+"""
+import argparse
+import csv
+from datetime import datetime
+import json
+import math
+import os
+import re
+
+from jinja2 import Environment, FileSystemLoader
+import numpy as np
+
+from reactive.autoscaler import (_validate_metrics, limit_step, limit_steps,
+                                 resize_direction, resize_step)
+
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                         os.pardir, "templates"))
+
+CONDITIONS = {
+    "ABOVE": np.greater,
+    "ABOVE_OR_EQUAL": np.greater_equal,
+    "BELOW": np.less,
+    "BELOW_OR_EQUAL": np.less_equal
+}
+
+AGGREGATES = ("mean", "max", "min", "sum", "count")
+
+_SELECT = re.compile(r"^(\w+)\((\w+)\)$")
+_GROUP_BY = re.compile(r"^time\((\d+)s\)")
+
+
+def render_metrics(metrics):
+    """
+    Render the metric streams and predictors of the Autoscaler config, just
+    like the charm does.
+
+    :param metrics: Metric definitions
+    :type metrics: list
+    :returns: tuple with the list of metric streams and list of predictors
+    :raises: autoscaler.MetricValidationException
+    """
+    _validate_metrics(metrics)
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES))
+
+    def _render(template):
+        content = env.get_template(template).render(metrics=metrics)
+        return json.loads("[{}]".format(content))
+
+    return (_render("autoscaler/config-metric-streams.json"),
+            _render("autoscaler/config-predictors.json"))
+
+
+def _parse_time(value):
+    """
+    Epoch seconds from an RFC3339 timestamp or an epoch timestamp in seconds,
+    milliseconds or nanoseconds.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        value = re.sub(r"(\.\d{6})\d*", r"\1", value.replace("Z", "+00:00"))
+        fmt = "%Y-%m-%dT%H:%M:%S.%f%z" if "." in value \
+            else "%Y-%m-%dT%H:%M:%S%z"
+        value = re.sub(r"([+-]\d\d):(\d\d)$", r"\1\2", value)
+        return datetime.strptime(value, fmt).timestamp()
+
+    for scale in (1e9, 1e6, 1e3):
+        if number > 1e11 * scale / 1e3:
+            return number / scale
+    return number
+
+
+def _read_json(path, measurement, field):
+    with open(path) as series_file:
+        data = json.load(series_file)
+
+    times, values = [], []
+    for result in data.get("results", []):
+        for series in result.get("series", []):
+            if measurement and series.get("name") not in (None, measurement):
+                continue
+            columns = series["columns"]
+            column = columns.index(field) if field in columns else \
+                len(columns) - 1
+            for row in series["values"]:
+                if row[column] is not None:
+                    times.append(_parse_time(str(row[0])))
+                    values.append(float(row[column]))
+    return times, values
+
+
+def _split(text, separator, maxsplit=-1):
+    """
+    Split a line protocol element on the separator, except where it is
+    escaped with a backslash or within a double quoted string field value.
+    """
+    parts, current = [], []
+    quoted = escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted and \
+                (maxsplit < 0 or len(parts) < maxsplit):
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _unescape(text):
+    return re.sub(r"\\(.)", r"\1", text)
+
+
+def _read_line_protocol(path, measurement, field):
+    times, values = [], []
+    with open(path) as series_file:
+        for number, line in enumerate(series_file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            elements = _split(line, " ")
+            if len(elements) != 3:
+                raise ValueError("Line {}: expected a measurement, fields and "
+                                 "a timestamp".format(number))
+            key, fields, timestamp = elements
+            if _unescape(_split(key, ",")[0]) != measurement:
+                continue
+            for pair in _split(fields, ","):
+                name, value = (_split(pair, "=", 1) + [""])[:2]
+                if _unescape(name) != field:
+                    continue
+                if value.startswith('"'):
+                    raise ValueError("Line {}: field {} is not a "
+                                     "number".format(number, field))
+                times.append(int(timestamp) / 1e9)
+                values.append(float(value.rstrip("iu")))
+    return times, values
+
+
+def _read_csv(path, measurement, field):
+    times, values = [], []
+    with open(path) as series_file:
+        rows = csv.reader(series_file)
+        header = next(rows)
+        if "time" in header:
+            time_column = header.index("time")
+            value_column = header.index(field) if field in header else \
+                len(header) - 1
+            name_column = header.index("name") if "name" in header else None
+        else:
+            # No header, plain time,value rows
+            time_column, value_column, name_column = 0, 1, None
+            rows = [header] + list(rows)
+
+        for row in rows:
+            if name_column is not None and measurement and \
+                    row[name_column] != measurement:
+                continue
+            if row[value_column] != "":
+                times.append(_parse_time(row[time_column]))
+                values.append(float(row[value_column]))
+    return times, values
+
+
+def load_series(path, measurement=None, field=None):
+    """
+    Read a recorded metric series. The format is picked by file extension:
+    .json for InfluxDB query results, .lp or .txt for line protocol and
+    anything else is read as CSV.
+
+    :param path: Path to the series file
+    :type path: str
+    :param measurement: Measurement to read, the metric's "from" part
+    :type measurement: str
+    :param field: Field to read
+    :type field: str
+    :returns: tuple with arrays of epoch seconds and values
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".json":
+        reader = _read_json
+    elif extension in (".lp", ".txt"):
+        reader = _read_line_protocol
+    else:
+        reader = _read_csv
+
+    times, values = reader(path, measurement, field)
+    return np.asarray(times, dtype=np.float64), \
+        np.asarray(values, dtype=np.float64)
+
+
+def downsample(times, values, interval, function):
+    """
+    Aggregate a series into time buckets like an InfluxDB
+    GROUP BY time(interval) fill(none) query.
+
+    :returns: tuple with arrays of bucket start times and aggregated values
+    """
+    if function not in AGGREGATES:
+        raise ValueError("Unsupported aggregate function: {}".format(
+            function))
+
+    if len(times) == 0:
+        return np.empty(0), np.empty(0)
+
+    order = np.argsort(times, kind="mergesort")
+    times = times[order]
+    values = values[order]
+
+    buckets = np.floor(times / interval) * interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+
+    if function == "max":
+        aggregated = np.maximum.reduceat(values, starts)
+    elif function == "min":
+        aggregated = np.minimum.reduceat(values, starts)
+    elif function == "count":
+        aggregated = counts.astype(np.float64)
+    else:
+        aggregated = np.add.reduceat(values, starts)
+        if function == "mean":
+            aggregated = aggregated / counts
+
+    return buckets[starts], aggregated
+
+
+def _rule_fires(bucket_times, aggregated, rule, evaluations, settling,
+                downsample_interval):
+    """
+    For each evaluation time, check if the rule's condition held for every
+    settled data point during the rule's period. The period needs to be
+    covered by data, a single point after a gap is not enough.
+    """
+    period = rule["period"]["time"]
+    holds = CONDITIONS[rule["condition"]](aggregated, rule["threshold"])
+    violations = np.r_[0, np.cumsum(~holds)]
+
+    end = evaluations - settling
+    hi = np.searchsorted(bucket_times, end, side="right")
+    lo = np.searchsorted(bucket_times, end - period, side="left")
+
+    first = bucket_times[np.minimum(lo, len(bucket_times) - 1)] \
+        if len(bucket_times) else np.full(len(evaluations), np.inf)
+    covered = first <= end - period + downsample_interval
+
+    return (hi > lo) & covered & (violations[hi] - violations[lo] == 0)
+
+
+def replay(metrics, series, units_min=1, units_max=10, scaling_interval=10,
+           provisioning_delay=0, initial_units=None, unit_capacity=None,
+           load_metric=None, max_step_out=0, max_step_in=0):
+    """
+    Replay the scaling rules over recorded series.
+
+    Predictions are aggregated like the Autoscaler does by default, the
+    largest prediction wins. A predictor which is in cooldown, or whose rules
+    don't fire, predicts the current capacity.
+
+    :param metrics: Metric definitions, as used by the charm
+    :type metrics: list
+    :param series: tuple of (times, values) arrays for each metric name
+    :type series: dict
+    :param provisioning_delay: Seconds before a new unit is active
+    :param unit_capacity: Metric value one unit can handle. Used together
+                          with the load metric to calculate the number of
+                          units needed at each point in time.
+    :param load_metric: Metric used as load, defaults to the first metric
+    :param max_step_out: Largest scale-out step, as scaling_max_step_out
+    :param max_step_in: Largest scale-in step, as scaling_max_step_in
+    :returns: dict with the replay report
+    """
+    # The rules are limited like the charm limits them
+    limits = {"scaling_max_step_out": max_step_out,
+              "scaling_max_step_in": max_step_in}
+    metrics = limit_steps(limits, metrics)
+
+    streams, predictors = render_metrics(metrics)
+    streams = {stream["id"]: stream for stream in streams}
+    # The predictors' rules are rendered in the order of the definitions
+    definitions = {metric["name"]: list(metric["rules"].values())
+                   for metric in metrics}
+
+    downsampled = {}
+    for name, stream in streams.items():
+        function, _ = _SELECT.match(stream["query"]["select"]).groups()
+        interval = int(_GROUP_BY.match(stream["query"]["groupBy"]).group(1))
+        times, values = series[name]
+        downsampled[name] = (interval, downsample(times, values, interval,
+                                                  function))
+
+    starts = [data[0][0] for _, data in downsampled.values() if len(data[0])]
+    ends = [data[0][-1] for _, data in downsampled.values() if len(data[0])]
+    if not starts:
+        raise ValueError("No data points to replay")
+    evaluations = np.arange(min(starts), max(ends) + scaling_interval,
+                            scaling_interval)
+
+    # Index of the firing rule per predictor and evaluation time, NaN where
+    # no rule fires
+    fired = []
+    rules = []
+    cooldowns = []
+    breaches = []
+    for predictor in predictors:
+        stream = streams[predictor["metricStream"]]
+        interval, (bucket_times, aggregated) = \
+            downsampled[predictor["metricStream"]]
+        settling = stream["dataSettlingTime"]["time"]
+        parameters = predictor["parameters"]
+
+        rule_index = np.full(len(evaluations), np.nan)
+        rules.append(definitions[predictor["metricStream"]])
+        # The first matching rule is applied
+        for r, rule in reversed(list(enumerate(
+                parameters["scalingRules"]))):
+            fires = _rule_fires(bucket_times, aggregated, rule, evaluations,
+                                settling, interval)
+            rule_index[fires] = r
+
+            if resize_direction(rules[-1][r]) > 0:
+                holds = CONDITIONS[rule["condition"]](aggregated,
+                                                      rule["threshold"])
+                rising = holds & ~np.r_[False, holds[:-1]]
+                breaches.append(bucket_times[rising])
+
+        fired.append(rule_index)
+        cooldowns.append(parameters["cooldownPeriod"]["time"])
+
+    fired = np.vstack(fired)
+
+    # Unit counts are sequential, only evaluation times where any rule fires
+    # need to be visited.
+    desired = min(max(units_min if initial_units is None else initial_units,
+                      units_min), units_max)
+    last_decision = np.full(len(predictors), -np.inf)
+    pending = []
+    changes = [(evaluations[0], desired)]
+    decisions = 0
+
+    for i in np.flatnonzero(~np.all(np.isnan(fired), axis=0)):
+        t = evaluations[i]
+
+        # Units which have become active are not pending anymore
+        changes.extend(entry for entry in pending if entry[0] <= t)
+        pending = [entry for entry in pending if entry[0] > t]
+
+        predictions = []
+        for p in range(len(predictors)):
+            if np.isnan(fired[p, i]) or \
+                    t - last_decision[p] < cooldowns[p]:
+                continue
+            last_decision[p] = t
+            rule = rules[p][int(fired[p, i])]
+            predictions.append(desired + limit_step(
+                limits, resize_step(rule, desired)))
+
+        if not predictions:
+            continue
+
+        # Predictors which didn't make a decision predict the current size
+        if len(predictions) < len(predictors):
+            predictions.append(desired)
+        new = min(max(max(predictions), units_min), units_max)
+        if new == desired:
+            continue
+
+        decisions += 1
+        if new > desired:
+            pending.append((t + provisioning_delay, new - desired))
+        else:
+            # Cancel units which are still being provisioned first
+            remove = desired - new
+            while remove and pending:
+                arrival, count = pending.pop()
+                cancelled = min(count, remove)
+                remove -= cancelled
+                if count > cancelled:
+                    pending.append((arrival, count - cancelled))
+            if remove:
+                changes.append((t, -remove))
+        desired = new
+
+    changes.extend(pending)
+
+    change_times = np.array([change[0] for change in changes])
+    change_deltas = np.array([change[1] for change in changes])
+    order = np.argsort(change_times, kind="mergesort")
+    change_times = change_times[order]
+    levels = np.cumsum(change_deltas[order])
+    # The initial unit count isn't an activation, even if it is 0
+    activations = np.diff(np.r_[0, levels]) > 0
+    activations[order == 0] = False
+    index = np.searchsorted(change_times, evaluations, side="right") - 1
+    active_units = levels[np.maximum(index, 0)]
+
+    report = {
+        "evaluations": len(evaluations),
+        "decisions": decisions,
+        "units": {
+            "min": int(active_units.min()),
+            "max": int(active_units.max()),
+            "mean": float(active_units.mean())
+        },
+        "reaction_latency": _reaction_latency(
+            np.sort(np.concatenate(breaches)) if breaches else np.empty(0),
+            change_times[activations])
+    }
+
+    if unit_capacity:
+        load_metric = load_metric or metrics[0]["name"]
+        _, (bucket_times, aggregated) = downsampled[load_metric]
+        index = np.searchsorted(bucket_times, evaluations, side="right") - 1
+        load = aggregated[np.maximum(index, 0)]
+        needed = np.ceil(load / unit_capacity)
+
+        hours = scaling_interval / 3600.0
+        violations = active_units < needed
+        report["provisioning"] = {
+            "over_provisioned_unit_hours": float(
+                np.maximum(active_units - needed, 0).sum() * hours),
+            "under_provisioned_unit_hours": float(
+                np.maximum(needed - active_units, 0).sum() * hours),
+            "slo_violating_intervals": int(violations.sum()),
+            "slo_violating_seconds": int(violations.sum() * scaling_interval)
+        }
+
+    return report
+
+
+def _reaction_latency(breaches, activations):
+    """
+    Seconds from the start of each scale-out threshold breach until the next
+    unit became active.
+    """
+    if len(breaches) == 0:
+        return None
+
+    index = np.searchsorted(activations, breaches, side="left")
+    answered = index < len(activations)
+    latencies = activations[index[answered]] - breaches[answered]
+
+    if len(latencies) == 0:
+        return {"breaches": len(breaches), "unanswered": len(breaches)}
+
+    # Nearest rank percentile
+    latencies = np.sort(latencies)
+    p95 = latencies[int(math.ceil(0.95 * len(latencies))) - 1]
+
+    return {
+        "breaches": len(breaches),
+        "unanswered": int((~answered).sum()),
+        "mean": float(latencies.mean()),
+        "p95": float(p95),
+        "max": float(latencies[-1])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.replay",
+        description="Replay CharmScaler scaling rules over recorded metric "
+                    "series.")
+    parser.add_argument("metrics", help="JSON file with metric definitions")
+    parser.add_argument("--series", action="append", default=[],
+                        metavar="METRIC=PATH", required=True,
+                        help="Recorded series for a metric, repeatable")
+    parser.add_argument("--units-min", type=int, default=1)
+    parser.add_argument("--units-max", type=int, default=10)
+    parser.add_argument("--initial-units", type=int)
+    parser.add_argument("--scaling-interval", type=int, default=10)
+    parser.add_argument("--provisioning-delay", type=int, default=0,
+                        help="Seconds before a new unit is active")
+    parser.add_argument("--unit-capacity", type=float,
+                        help="Load metric value one unit can handle")
+    parser.add_argument("--load-metric",
+                        help="Metric to use as load, defaults to the first")
+    parser.add_argument("--max-step-out", type=int, default=0,
+                        help="Largest scale-out step, 0 for no limit")
+    parser.add_argument("--max-step-in", type=int, default=0,
+                        help="Largest scale-in step, 0 for no limit")
+    args = parser.parse_args()
+
+    with open(args.metrics) as metrics_file:
+        metrics = json.load(metrics_file)
+    definitions = {metric["name"]: metric for metric in metrics}
+
+    series = {}
+    for argument in args.series:
+        name, _, path = argument.partition("=")
+        metric = definitions[name]
+        series[name] = load_series(path, metric["tag"], metric["field"])
+
+    report = replay(metrics, series, units_min=args.units_min,
+                    units_max=args.units_max,
+                    scaling_interval=args.scaling_interval,
+                    provisioning_delay=args.provisioning_delay,
+                    initial_units=args.initial_units,
+                    unit_capacity=args.unit_capacity,
+                    load_metric=args.load_metric,
+                    max_step_out=args.max_step_out,
+                    max_step_in=args.max_step_in)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+from email.message import Message
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+
+ALERTBOX = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                        "actions", "alertbox.py")
+
+
+def _load_alertbox():
+    spec = importlib.util.spec_from_file_location("alertbox", ALERTBOX)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+alertbox = _load_alertbox()
+
+
+def _mail(severity="ERROR", sender="autoscaler@charmscaler",
+          subject="Alert"):
+    message = Message()
+    message["From"] = "Autoscaler <{}>".format(sender)
+    message["Subject"] = subject
+    message.set_payload(json.dumps({"severity": severity}))
+    return message
+
+
+class TestMailbox(unittest.TestCase):
+    def test_query(self):
+        mailbox = alertbox.Mailbox(100)
+        for i, severity in enumerate(["INFO", "ERROR", "ERROR", "WARN"]):
+            mailbox.add(_mail(severity, sender="s{}@c".format(i % 2)),
+                        now=1000 + i)
+
+        def _ids(**filters):
+            return [record["id"] for record in mailbox.query(**filters)]
+
+        self.assertEqual(_ids(), [1, 2, 3, 4])
+        self.assertEqual(_ids(severity="ERROR"), [2, 3])
+        self.assertEqual(_ids(severity="ERROR", sender="s0@c"), [3])
+        self.assertEqual(_ids(since=1001, until=1003), [2, 3])
+        self.assertEqual(_ids(severity="ERROR", since=1002), [3])
+        self.assertEqual(_ids(limit=2), [3, 4])
+        self.assertEqual(_ids(severity="FATAL"), [])
+        self.assertEqual(mailbox.count(severity="ERROR", since=None), 2)
+        self.assertEqual(mailbox.count(), 4)
+
+    def test_severity(self):
+        mailbox = alertbox.Mailbox(10)
+        message = Message()
+        message["Subject"] = "[WARN] Autoscaler alert"
+        message.set_payload("not json")
+        mailbox.add(message)
+        mailbox.add(Message())
+
+        self.assertEqual(mailbox.stats()["severity"],
+                         {"WARN": 1, "UNKNOWN": 1})
+
+    def test_capacity(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = os.path.join(tmpdir, "spool.jsonl")
+            mailbox = alertbox.Mailbox(3, spool)
+            for i in range(10):
+                mailbox.add(_mail("ERROR" if i % 2 else "INFO"), now=i)
+            mailbox.close()
+
+            stats = mailbox.stats()
+            self.assertEqual((stats["received"], stats["stored"],
+                              stats["dropped"]), (10, 3, 7))
+            self.assertEqual(stats["severity"], {"ERROR": 2, "INFO": 1})
+            self.assertEqual([record["id"] for record in mailbox.query(
+                severity="ERROR")], [8, 10])
+            # Dropped mail is gone from memory but kept in the spool
+            self.assertEqual(mailbox.query(until=7), [])
+            # Cut back to the capacity at twice the capacity
+            with open(spool) as spool_file:
+                records = [json.loads(line) for line in spool_file]
+            self.assertEqual([record["id"] for record in records],
+                             [7, 8, 9, 10])
+
+            # Spooled mail of an earlier run counts towards the cut
+            mailbox = alertbox.Mailbox(2, spool)
+            self.assertEqual(mailbox.spooled, 2)
+            mailbox.close()
+
+    def test_record_log(self):
+        log = alertbox.RecordLog()
+        for i in range(10):
+            log.append(i)
+        for i in range(7):
+            self.assertEqual(log.popleft(), i)
+
+        self.assertEqual(len(log), 3)
+        self.assertEqual([log[i] for i in range(len(log))], [7, 8, 9])
+        # Compacted once most of the backing list was unused
+        self.assertLess(len(log._records), 10)
+
+    def test_wait(self):
+        mailbox = alertbox.Mailbox(100)
+        mailbox.add(_mail("INFO"))
+
+        # Already there
+        self.assertEqual(mailbox.wait(1, 5, severity="INFO"), 1)
+
+        # Times out without matching mail
+        start = time.time()
+        self.assertEqual(mailbox.wait(1, 0.1, severity="ERROR"), 0)
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+        # Woken up by the mail arriving from another thread
+        timer = threading.Timer(0.05, lambda: [
+            mailbox.add(_mail("ERROR")) for _ in range(2)])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(mailbox.wait(count=2, severity="ERROR", timeout=5),
+                         2)
+
+        # Only mail received since the given time counts
+        self.assertEqual(mailbox.wait(1, 0, since=time.time() + 60), 0)
+
+        # Closing the mailbox ends the wait
+        timer = threading.Timer(0.05, mailbox.close)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.time()
+        self.assertEqual(mailbox.wait(1, 1e6, severity="FATAL"), 0)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wait_timeout_cap(self):
+        mailbox = alertbox.Mailbox(10)
+        with mock.patch.object(mailbox.lock, "wait_for") as mock_wait:
+            mailbox.wait(1, 1e6)
+        self.assertEqual(mock_wait.call_args[0][1],
+                         alertbox.MAX_WAIT_TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+from email.message import EmailMessage
+import importlib.util
+import os
+import smtplib
+import threading
+import unittest
+import unittest.mock as mock
+
+from reactive.alertrelay import AlertRelay, compose_config
+from reactive.autoscaler import alerts_config
+from reactive.config import ConfigurationRequiredException
+from reactive.logs import logging_config
+
+RELAY_SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                            "templates", "alertrelay", "relay.py")
+
+CFG = {
+    "alert_enabled": True,
+    "alert_relay_enabled": True,
+    "alert_receivers": "foo@charmscaler bar@charmscaler",
+    "alert_levels": "WARN ERROR",
+    "alert_sender": "charmscaler@charmscaler",
+    "alert_duplicate_suppression": 120,
+    "alert_smtp_host": "smtp.example.com",
+    "alert_smtp_port": 587,
+    "alert_smtp_ssl": True,
+    "alert_smtp_username": "",
+    "alert_smtp_password": "",
+    "alert_digest_interval": 300,
+    "alert_rate_limit": 0,
+    "alert_webhooks": ""
+}
+
+
+def _load_relay():
+    spec = importlib.util.spec_from_file_location("alertrelay_script",
+                                                  RELAY_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestAlertRelay(unittest.TestCase):
+    def test_alerts_config(self):
+        # The Autoscaler sends its alerts to the relay
+        smtp = alerts_config(CFG)["smtp"]
+        self.assertEqual((smtp["host"], smtp["port"], smtp["ssl"]),
+                         ("alertrelay", 25, False))
+
+        # Straight to the SMTP server, which requires the credentials
+        cfg = dict(CFG, alert_relay_enabled=False)
+        self.assertRaises(ConfigurationRequiredException, alerts_config, cfg)
+        cfg.update(alert_smtp_username="foo", alert_smtp_password="bar")
+        self.assertEqual(alerts_config(cfg)["smtp"]["host"],
+                         "smtp.example.com")
+
+    def test_compose_config(self):
+        config = compose_config(CFG)
+        self.assertEqual(config["smtp"]["host"], "smtp.example.com")
+        self.assertEqual(config["rate_limit"], 0)
+
+    @mock.patch("reactive.component.get_engine")
+    @mock.patch("reactive.component.ComposeProject")
+    @mock.patch("reactive.component.Config")
+    def test_compose_up(self, mock_config, mock_compose, mock_engine):
+        relay = AlertRelay(CFG, "python", "3.12-alpine")
+        relay.script.__str__.return_value = "/charm/files/alertrelay/relay.py"
+        relay.script.digest.return_value = "script-hash"
+        relay.healthcheck = mock.MagicMock()
+        relay.compose_up(CFG)
+
+        self.assertTrue(relay.script.render.called)
+        self.assertTrue(mock_compose.return_value.up.called)
+        # The script, base and compose configs share the same mock
+        context = {}
+        for call in relay.compose_config.extend.call_args_list:
+            if call[0][0] is not logging_config:
+                context.update(call[0][0](*call[0][1:]))
+        self.assertEqual(context["script"],
+                         "/charm/files/alertrelay/relay.py")
+        self.assertEqual(context["script_digest"], "script-hash")
+        self.assertEqual(context["smtp"]["port"], 587)
+
+    @mock.patch("reactive.component.get_engine")
+    @mock.patch("reactive.component.ComposeProject")
+    @mock.patch("reactive.component.Config")
+    def test_disabled(self, mock_config, mock_compose, mock_engine):
+        relay = AlertRelay(dict(CFG, alert_relay_enabled=False),
+                           "python", "3.12-alpine")
+        relay.compose_up(CFG)
+        relay.healthcheck()
+
+        mock_engine.return_value.remove.assert_called_once_with(
+            "alertrelay", force=True)
+        self.assertFalse(mock_compose.return_value.up.called)
+        self.assertFalse(relay.script.render.called)
+        self.assertFalse(mock_engine.return_value.health.called)
+
+
+class TestRelayScript(unittest.TestCase):
+    def setUp(self):
+        self.script = _load_relay()
+        self.upstream = mock.MagicMock()
+        self.upstream.size = 2
+        self.relay = self.script.Relay(self.upstream)
+        self.addCleanup(self.relay.executor.shutdown)
+
+    def _serve(self):
+        server = self.script.Server(("127.0.0.1", 0), self.relay)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def _alert(self, subject):
+        message = EmailMessage()
+        message["From"] = "charmscaler@charmscaler"
+        message["Subject"] = subject
+        message.set_content(".leading dot\n")
+        return message
+
+    def test_relay(self):
+        port = self._serve()
+        connection = smtplib.SMTP("127.0.0.1", port, timeout=5)
+        connection.send_message(self._alert("First"),
+                                to_addrs=["foo@charmscaler",
+                                          "bar@charmscaler"])
+        connection.send_message(self._alert("Second"),
+                                to_addrs=["foo@charmscaler"])
+        self.assertEqual(connection.rcpt("bar@charmscaler")[0], 503)
+        connection.quit()
+
+        self.assertEqual({recipient: len(queue) for recipient, queue
+                          in self.relay.queues.items()},
+                         {"foo@charmscaler": 2, "bar@charmscaler": 1})
+
+        self.relay.flush()
+        digests = {call[0][0]["To"]: call[0][0]
+                   for call in self.upstream.send.call_args_list}
+        self.assertEqual(digests["foo@charmscaler"]["Subject"],
+                         "Second (2 alerts)")
+        self.assertIn(".leading dot",
+                      digests["foo@charmscaler"].get_content())
+        self.assertEqual(digests["bar@charmscaler"]["Subject"], "First")
+        self.assertFalse(any(self.relay.queues.values()))
+
+    def test_send_error(self):
+        self.upstream.send.side_effect = smtplib.SMTPServerDisconnected
+        self.relay.receive("charmscaler@charmscaler", ["foo@charmscaler"],
+                           self._alert("First").as_bytes())
+        self.relay.flush()
+
+        # Kept for the next digest
+        self.assertEqual(len(self.relay.queues["foo@charmscaler"]), 1)
+
+    def test_pool(self):
+        connections = []
+
+        def _connect():
+            connection = mock.MagicMock()
+            connection.noop.return_value = (250, b"OK")
+            connections.append(connection)
+            return connection
+
+        pool = self.script.UpstreamPool(2, connect=_connect)
+        first, second = pool.acquire(), pool.acquire()
+        self.assertEqual(len(connections), 2)
+
+        # All connections are in use until one is released
+        waiter = threading.Thread(target=lambda: pool.release(
+            pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+        pool.release(first)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+
+        # Idle connections are reused, closed ones replaced
+        first.noop.side_effect = smtplib.SMTPServerDisconnected
+        pool.release(second)
+        self.assertIs(pool.acquire(), second)
+        third = pool.acquire()
+        self.assertEqual(len(connections), 3)
+        self.assertIs(third, connections[-1])
+
+        # Failed connections are dropped from the pool
+        second.send_message.side_effect = OSError
+        pool.release(second)
+        self.assertRaises(OSError, pool.send, self._alert("First"))
+        self.assertEqual(pool.opened, 1)
+        pool.release(third)
+        pool.close()
+        self.assertEqual(pool.opened, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
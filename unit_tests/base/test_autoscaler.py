@@ -1,11 +1,49 @@
 #!/usr/bin/env python
 
+import json
+import os
+import socket
+import tempfile
+from jinja2 import Environment, FileSystemLoader
 from requests.exceptions import RequestException
 import requests_mock
 import unittest
 import unittest.mock as mock
 
-from reactive.autoscaler import Autoscaler
+from reactive.autoscaler import (Autoscaler, MetricValidationException,
+                                 WebhookValidationException,
+                                 _check_scaling_rules, alerts_config,
+                                 analyze_scaling_rules, host_names,
+                                 limit_steps, metric_streamers_config,
+                                 resize_step, resolve_resizes,
+                                 rule_warnings, scale_target,
+                                 scope_metrics, shard_metrics)
+from reactive.config import ConfigurationException
+from unit_tests.simulator.fakes import FakeInfluxdb
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                         "templates")
+
+CFG = {"scaling_interval": 10, "scaling_rules_strict": False}
+
+
+def _metric(cooldown=600, downsample=30, **rules):
+    return {
+        "name": "cpu",
+        "database": "telegraf",
+        "tag": "cpu",
+        "field": "usage_user",
+        "aggregate_function": "mean",
+        "downsample": downsample,
+        "data_settling": 30,
+        "cooldown": cooldown,
+        "rules": {name: {
+            "condition": condition,
+            "threshold": threshold,
+            "period": period,
+            "resize": resize
+        } for name, (condition, threshold, period, resize) in rules.items()}
+    }
 
 
 class TestAutoscaler(unittest.TestCase):
@@ -15,11 +53,12 @@ class TestAutoscaler(unittest.TestCase):
         "CHARM_DIR": "/tmp"
     })
     @mock.patch("reactive.component.Config")
-    @mock.patch("reactive.component.Compose")
+    @mock.patch("reactive.component.ComposeProject")
     def setUpClass(cls, mock_compose, mock_config):
         cls.autoscaler = Autoscaler({
             "name": "OpenStackScaler",
-            "port_autoscaler": 8080
+            "port_autoscaler": 8080,
+            "autoscaler_api_transport": "published"
         }, "testimage", "latest")
 
     def setUp(self):
@@ -58,6 +97,502 @@ class TestAutoscaler(unittest.TestCase):
                           self.autoscaler.initialize)
         self.assertEqual(mock_req.call_count, 6)
 
+    @requests_mock.mock()
+    @mock.patch("reactive.autoscaler.autoscaler_config")
+    @mock.patch("reactive.autoscaler.Config")
+    def test_restore(self, mock_req, mock_config, mock_autoscaler_config):
+        status_url = self.autoscaler._get_url("status")
+        mock_config.return_value.digest.return_value = "blueprint-hash"
+        self.autoscaler.config.digest.return_value = "config-hash"
+        self.autoscaler.config.reset_mock()
+
+        manifest = {"blueprint": "blueprint-hash", "config": "config-hash"}
+
+        def _restore(manifest):
+            content = json.dumps(manifest)
+            with mock.patch("reactive.autoscaler.open",
+                            mock.mock_open(read_data=content), create=True):
+                return self.autoscaler.restore(CFG, None, [])
+
+        # Missing manifest
+        with mock.patch("reactive.autoscaler.open", side_effect=OSError,
+                        create=True):
+            self.assertFalse(self.autoscaler.restore(CFG, None, []))
+        self.assertEqual(mock_req.call_count, 0)
+
+        # Blueprint has changed
+        self.assertFalse(_restore(dict(manifest, blueprint="other")))
+        self.assertEqual(mock_req.call_count, 0)
+
+        # Config has changed
+        self.assertFalse(_restore(dict(manifest, config="other")))
+        self.assertEqual(mock_req.call_count, 0)
+
+        # Instance is not running
+        mock_req.get(status_url, json={"state": "STOPPED"})
+        self.assertFalse(_restore(manifest))
+        self.assertEqual(mock_req.call_count, 1)
+
+        # Instance is not available, no retries
+        mock_req.get(status_url, status_code=404)
+        self.assertFalse(_restore(manifest))
+        self.assertEqual(mock_req.call_count, 2)
+        self.assertFalse(self.autoscaler.config.commit.called)
+
+        # Restored
+        mock_req.get(status_url, json={"state": "STARTED"})
+        self.assertTrue(_restore(manifest))
+        self.assertEqual(mock_req.call_count, 3)
+        self.assertTrue(self.autoscaler.config.commit.called)
+
+    @mock.patch("reactive.autoscaler.Config")
+    def test_adopt(self, mock_config):
+        mock_config.return_value.digest.return_value = "blueprint-hash"
+        unit_id = self.autoscaler.unit_id
+
+        def _write(path, data):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as json_file:
+                json.dump(data, json_file)
+
+        def _read(path):
+            with open(path) as json_file:
+                return json.load(json_file)
+
+        with tempfile.TemporaryDirectory() as storage_dir:
+            # Nothing to adopt
+            self.assertIsNone(self.autoscaler.adopt(storage_dir))
+
+            _write(os.path.join(storage_dir, "charmscaler-scaler-0.json"),
+                   {"id": "scaler-0", "blueprint": "other-hash",
+                    "config": "config-hash"})
+            _write(os.path.join(storage_dir, "instances", "scaler-0",
+                                "blueprint.json"), {"id": "scaler-0"})
+            _write(os.path.join(storage_dir, "instances", unit_id,
+                                "stale.json"), {})
+
+            self.assertEqual(self.autoscaler.adopt(storage_dir), "scaler-0")
+
+            manifest = _read(os.path.join(
+                storage_dir, "charmscaler-{}.json".format(unit_id)))
+            self.assertEqual(manifest, {"id": unit_id,
+                                        "blueprint": "blueprint-hash",
+                                        "config": "config-hash"})
+            self.assertEqual(_read(os.path.join(
+                storage_dir, "instances", unit_id, "blueprint.json")),
+                {"id": unit_id})
+            self.assertEqual(os.listdir(os.path.join(storage_dir,
+                                                     "instances")), [unit_id])
+            self.assertFalse(os.path.exists(os.path.join(
+                storage_dir, "instances", unit_id, "stale.json")))
+
+            # The own instance is left alone
+            self.assertIsNone(self.autoscaler.adopt(storage_dir))
+
+    def test_analyze_scaling_rules(self):
+        def _analyze(**kwargs):
+            return analyze_scaling_rules(CFG, [_metric(**kwargs)])
+
+        self.assertEqual(_analyze(out=("ABOVE", 80, 300, 1),
+                                  within=("BELOW", 20, 300, -1)), [])
+
+        # Inverted thresholds
+        warnings = _analyze(out=("ABOVE", 20, 300, 1),
+                            within=("BELOW", 80, 300, -1))
+        self.assertEqual(warnings, [
+            "cpu: rules 'out' and 'within' have inverted thresholds"])
+
+        # Overlapping at the threshold, or meeting without a band
+        self.assertIn("overlap at their threshold", _analyze(
+            out=("ABOVE_OR_EQUAL", 50, 300, 1),
+            within=("BELOW_OR_EQUAL", 50, 300, -1))[0])
+        self.assertIn("no band between", _analyze(
+            out=("ABOVE", 50, 300, 1),
+            within=("BELOW_OR_EQUAL", 50, 300, -1))[0])
+        self.assertIn("same side", _analyze(
+            out=("ABOVE", 80, 300, 1),
+            within=("ABOVE", 90, 300, -1))[0])
+
+        # Periods and cooldown
+        warnings = _analyze(cooldown=5, downsample=60,
+                            out=("ABOVE", 80, 30, 1))
+        self.assertEqual(len(warnings), 3)
+
+        with self.assertRaises(MetricValidationException):
+            _analyze(out=("EXACTLY", 80, 300, 1))
+
+    @mock.patch("charmhelpers.core.hookenv.log")
+    @mock.patch("reactive.autoscaler.unitdata")
+    def test_rule_warnings(self, mock_unitdata, mock_log):
+        kv = {}
+        mock_unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        mock_unitdata.kv.return_value.get.side_effect = kv.get
+
+        metrics = [_metric(out=("ABOVE", 20, 300, 1),
+                           within=("BELOW", 80, 300, -1))]
+        _check_scaling_rules(CFG, metrics)
+        self.assertEqual(mock_log.call_count, 1)
+
+        # Only read back, the rules aren't analyzed again
+        with mock.patch("reactive.autoscaler.analyze_scaling_rules") as \
+                mock_analyze:
+            self.assertEqual(rule_warnings(), [
+                "cpu: rules 'out' and 'within' have inverted thresholds"])
+            self.assertFalse(mock_analyze.called)
+
+        # Errors in strict mode, still shown in the status
+        with self.assertRaises(MetricValidationException):
+            _check_scaling_rules(dict(CFG, scaling_rules_strict=True),
+                                 metrics)
+        self.assertEqual(len(rule_warnings()), 1)
+
+    def test_webhooks(self):
+        cfg = {
+            "alert_enabled": False,
+            "alert_levels": "WARN ERROR",
+            "alert_duplicate_suppression": 60,
+            "alert_webhooks": ""
+        }
+        self.assertIsNone(alerts_config(cfg))
+
+        cfg["alert_webhooks"] = """
+            - url: https://pager.example.com/alerts
+              levels: ERROR FATAL
+              timeout: 0.5
+              username: foo
+              password: bar
+            - url: http://10.0.0.1:8080/
+        """
+        alert = alerts_config(cfg)
+        self.assertIsNone(alert["smtp"])
+        self.assertEqual(alert["webhooks"][0]["levels"], ["ERROR", "FATAL"])
+        self.assertEqual(alert["webhooks"][0]["timeout"], 500)
+        self.assertEqual(alert["webhooks"][1]["levels"], ["WARN", "ERROR"])
+        self.assertEqual(alert["webhooks"][1]["timeout"], 5000)
+
+        # The alerter config is valid JSON
+        env = Environment(loader=FileSystemLoader(TEMPLATES))
+        rendered = env.from_string(
+            '{ {% include "common/alert-config.json" %} }').render(
+                alert=alert, name="test")
+        http = json.loads(rendered)["http"]
+        self.assertEqual(http[0]["auth"]["basicCredentials"]["username"],
+                         "foo")
+        self.assertNotIn("auth", http[1])
+
+        for webhooks in ("url: http://foo", "- url: ftp://foo",
+                         "- url: http://foo\n  timeout: -1", "- [foo"):
+            cfg["alert_webhooks"] = webhooks
+            self.assertRaises(WebhookValidationException, alerts_config, cfg)
+
+    def test_limit_steps(self):
+        metrics = [_metric(out=("ABOVE", 80, 300, 5),
+                           within=("BELOW", 20, 300, -3))]
+
+        def _resizes(max_out, max_in):
+            cfg = {"scaling_max_step_out": max_out,
+                   "scaling_max_step_in": max_in}
+            rules = limit_steps(cfg, metrics)[0]["rules"]
+            return rules["out"]["resize"], rules["within"]["resize"]
+
+        self.assertEqual(_resizes(0, 0), (5, -3))
+        self.assertEqual(_resizes(2, 1), (2, -1))
+        self.assertEqual(_resizes(10, 10), (5, -3))
+        # The metric definitions themselves are left as they are
+        self.assertEqual(metrics[0]["rules"]["out"]["resize"], 5)
+
+        # Proportional resizes are left to be limited once resolved
+        metrics[0]["rules"]["out"].update(unit="percent", resize=50)
+        self.assertEqual(_resizes(2, 1), (50, -1))
+
+        self.assertRaises(MetricValidationException, _resizes, -1, 0)
+
+    def test_resize_step(self):
+        def _step(capacity, **rule):
+            return resize_step(rule, capacity)
+
+        self.assertEqual(_step(40, resize=2), 2)
+        self.assertEqual(_step(40, resize=-1, unit="instances"), -1)
+        self.assertEqual(_step(40, resize=25, unit="percent"), 10)
+        self.assertEqual(_step(10, resize=30, unit="percent"), 3)
+        self.assertEqual(_step(10, resize=-25, unit="percent"), -3)
+        self.assertEqual(_step(10, resize=-25, unit="percent",
+                               rounding="down"), -2)
+        self.assertEqual(_step(10, resize=25, unit="percent",
+                               rounding="nearest"), 3)
+        self.assertEqual(_step(10, resize=1.5, unit="factor"), 5)
+        self.assertEqual(_step(10, resize=0.5, unit="factor"), -5)
+        self.assertEqual(_step(10, resize=1, unit="factor"), 0)
+        # Small pools still move by the minimum step
+        self.assertEqual(_step(2, resize=10, unit="percent"), 1)
+        self.assertEqual(_step(2, resize=10, unit="percent", min_step=2), 2)
+        self.assertEqual(_step(0, resize=-10, unit="percent"), -1)
+
+    def test_resolve_resizes(self):
+        metric = _metric(out=("ABOVE", 80, 300, 50),
+                         in_=("BELOW", 20, 300, -10))
+        metric["rules"]["out"]["unit"] = "percent"
+        metric["rules"]["in_"]["unit"] = "percent"
+
+        rules = resolve_resizes([metric], 40)[0]["rules"]
+        self.assertEqual(rules["out"]["resize"], 20)
+        self.assertEqual(rules["in_"]["resize"], -4)
+        self.assertEqual(rules["out"]["unit"], "instances")
+        # The definitions are left alone
+        self.assertEqual(metric["rules"]["out"]["resize"], 50)
+
+        def _invalid(**rule):
+            invalid = _metric(out=("ABOVE", 80, 300, 1))
+            invalid["rules"]["out"].update(rule)
+            self.assertRaises(MetricValidationException, resolve_resizes,
+                              [invalid], 4)
+
+        _invalid(unit="units")
+        _invalid(resize=1.5)
+        _invalid(unit="percent", resize="many")
+        _invalid(unit="factor", resize=0)
+        _invalid(unit="percent", rounding="sideways")
+        _invalid(unit="percent", min_step=-1)
+
+    @mock.patch("charmhelpers.core.hookenv.relation_get")
+    @mock.patch("charmhelpers.core.hookenv.related_units")
+    @mock.patch("charmhelpers.core.hookenv.remote_service_name")
+    def test_scale_target(self, mock_service, mock_units, mock_relation_get):
+        relation = mock.MagicMock()
+        relation.conversation.return_value.relation_ids = ["scalable:1"]
+        mock_service.return_value = "app"
+        mock_units.return_value = ["app/1", "app/0"]
+        mock_relation_get.side_effect = lambda key, unit, rid: {
+            "app/0": "10.0.0.2", "app/1": "10.0.0.3"}[unit]
+
+        self.assertEqual(scale_target(relation), {
+            "application": "app",
+            "units": ["app/0", "app/1"],
+            "addresses": ["10.0.0.2", "10.0.0.3"]
+        })
+        self.assertEqual(scale_target(None)["units"], [])
+
+    @mock.patch("charmhelpers.core.hookenv.log")
+    @mock.patch("reactive.autoscaler.unitdata")
+    @mock.patch("socket.gethostbyaddr")
+    def test_host_names(self, mock_resolve, mock_unitdata, mock_log):
+        kv = {}
+        mock_unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        mock_unitdata.kv.return_value.get.side_effect = kv.get
+
+        def _resolve(address):
+            if address == "10.0.0.2":
+                return "juju-a1b2c3-2.lxd", [], [address]
+            raise socket.herror("Unknown host")
+        mock_resolve.side_effect = _resolve
+
+        names = ["juju-a1b2c3-2.lxd", "juju-a1b2c3-2", "10.0.0.2",
+                 "10.0.0.3"]
+        self.assertEqual(host_names(["10.0.0.2", "10.0.0.3"]), names)
+        self.assertIn("10.0.0.3", mock_log.call_args[0][0])
+
+        # Each address is resolved once, failures included
+        self.assertEqual(host_names(["10.0.0.2", "10.0.0.3"]), names)
+        self.assertEqual(mock_resolve.call_count, 2)
+        self.assertEqual(mock_log.call_count, 1)
+
+        # Addresses no longer given are forgotten
+        self.assertEqual(host_names(["10.0.0.3"]), ["10.0.0.3"])
+        host_names(["10.0.0.2"])
+        self.assertEqual(mock_resolve.call_count, 3)
+
+    @mock.patch("reactive.autoscaler.host_names")
+    def test_scope_metrics(self, mock_host_names):
+        target = {"application": "app", "units": ["app/0", "app/1"],
+                  "addresses": ["10.0.0.2"]}
+        mock_host_names.return_value = ["juju-a1b2c3-2", "10.0.0.2"]
+        cfg = {"metric_scope": "", "metric_application_tag": "juju_app",
+               "metric_unit_tag": "juju_unit", "metric_host_tag": "host"}
+        metrics = [_metric(), dict(_metric(), where="cpu = 'cpu-total'")]
+
+        def _where(scope, target=target):
+            scoped = scope_metrics(dict(cfg, metric_scope=scope), metrics,
+                                   target)
+            return [metric["where"] for metric in scoped]
+
+        self.assertEqual(_where(""), [None, "cpu = 'cpu-total'"])
+        self.assertEqual(_where("application"), [
+            '"juju_app" = \'app\'',
+            '("juju_app" = \'app\') AND (cpu = \'cpu-total\')'])
+        self.assertEqual(_where("units")[0],
+                         '"juju_unit" = \'app/0\' OR "juju_unit" = \'app/1\'')
+        self.assertEqual(_where("hosts")[0], '"host" = \'juju-a1b2c3-2\' OR '
+                         '"host" = \'10.0.0.2\'')
+        mock_host_names.assert_called_with(["10.0.0.2"])
+        # Without units nothing is matched rather than everything
+        self.assertEqual(_where("units", dict(target, units=[]))[0],
+                         '"juju_unit" = \'\' AND "juju_unit" != \'\'')
+        # Tag values are quoted
+        self.assertEqual(_where("application", dict(
+            target, application="it's"))[0], '"juju_app" = \'it\\\'s\'')
+
+        self.assertRaises(MetricValidationException, _where, "model")
+
+        # The conditions render to valid JSON
+        env = Environment(loader=FileSystemLoader(TEMPLATES))
+        rendered = env.from_string(
+            '[{% include "autoscaler/config-metric-streams.json" %}]').render(
+                metrics=scope_metrics(dict(cfg, metric_scope="units"),
+                                      metrics, target))
+        streams = json.loads(rendered)
+        self.assertEqual(streams[1]["query"]["where"], _where("units")[1])
+
+    def test_shard_metrics(self):
+        metrics = [dict(_metric(), name="cpu_{}".format(i),
+                        database="db{}".format(i % 3)) for i in range(9)]
+
+        def _shards(shards, shard_by):
+            return shard_metrics({"metric_streamer_shards": shards,
+                                  "metric_shard_by": shard_by}, metrics)
+
+        self.assertEqual(_shards(1, "hash"), [metrics])
+        for shard_by in ("hash", "database"):
+            sharded = _shards(2, shard_by)
+            self.assertEqual(sorted(metric["name"] for shard in sharded
+                                    for metric in shard),
+                             sorted(metric["name"] for metric in metrics))
+            # The same metric always lands in the same shard
+            self.assertEqual(_shards(2, shard_by), sharded)
+
+        # A database is never split, empty shards are left out
+        sharded = _shards(5, "database")
+        self.assertEqual(len(sharded), 3)
+        for shard in sharded:
+            self.assertEqual(len(set(metric["database"] for metric in shard)),
+                             1)
+
+        self.assertRaises(MetricValidationException, _shards, 0, "hash")
+        self.assertRaises(MetricValidationException, _shards, 2, "tag")
+
+    @mock.patch("reactive.autoscaler.healthy_replicas")
+    def test_metric_streamers_config(self, mock_replicas):
+        influxdb = FakeInfluxdb()
+        cfg = {"metric_streamer_shards": 3, "metric_shard_by": "database",
+               "query_cache_enabled": False, "query_cache_address": ""}
+        metrics = [dict(_metric(), database="db{}".format(i))
+                   for i in range(3)]
+        mock_replicas.return_value = [("10.0.0.10", 8086), ("10.0.0.11", 8087)]
+
+        streamers = metric_streamers_config(cfg, influxdb, metrics)
+        self.assertEqual([(streamer["host"], streamer["port"])
+                          for streamer in streamers],
+                         [("10.0.0.10", 8086), ("10.0.0.11", 8087),
+                          ("10.0.0.10", 8086)])
+        self.assertEqual([streamer["metrics"] for streamer in streamers],
+                         [[metric] for metric in metrics])
+        self.assertEqual(streamers[1]["username"], "charmscaler")
+
+        # With the cache every streamer goes through it
+        streamers = metric_streamers_config(
+            dict(cfg, query_cache_enabled=True), influxdb, metrics)
+        self.assertEqual(set(streamer["host"] for streamer in streamers),
+                         {"querycache"})
+
+        mock_replicas.side_effect = ValueError("invalid literal")
+        self.assertRaises(MetricValidationException, metric_streamers_config,
+                          cfg, influxdb, metrics)
+
+    @mock.patch("reactive.autoscaler.Config")
+    def test_configure_strict(self, mock_config):
+        metrics = [_metric(cooldown=5, out=("ABOVE", 80, 300, 1))]
+
+        with mock.patch.object(self.autoscaler, "send_request") as request:
+            with self.assertRaises(MetricValidationException):
+                self.autoscaler.configure(
+                    dict(CFG, scaling_rules_strict=True), None, metrics)
+            self.assertFalse(request.called)
+
+    @requests_mock.mock()
+    @mock.patch("charmhelpers.core.hookenv.log")
+    def test_provision_historian(self, mock_req, mock_log):
+        historian = {
+            "host": "influxdb",
+            "port": 8086,
+            "username": "foo",
+            "password": "bar",
+            "database": "statsdb",
+            "retention": "7d"
+        }
+        url = "http://influxdb:8086/query"
+
+        def _databases(*names):
+            return {"json": {"results": [{"series": [{
+                "name": "databases",
+                "columns": ["name"],
+                "values": [[name] for name in names]
+            }]}]}}
+
+        def _statements():
+            statements = [request.qs["q"][0] for request in
+                          mock_req.request_history]
+            mock_req.reset_mock()
+            return statements
+
+        # The database is created with the policy as its default
+        mock_req.post(url, [_databases("_internal"),
+                            {"json": {"results": [{}]}}])
+        self.autoscaler._provision_historian(historian)
+        self.assertEqual(_statements(), [
+            "show databases",
+            'create database "statsdb" with duration 7d replication 1 '
+            'name "charmscaler"'
+        ])
+
+        # An existing database keeps its default policy, the charm's policy
+        # already exists and is altered instead
+        mock_req.post(url, [
+            _databases("_internal", "statsdb"),
+            {"json": {"results": [{"error": "retention policy already "
+                                            "exists"}]}},
+            {"json": {"results": [{}]}}
+        ])
+        self.autoscaler._provision_historian(historian)
+        self.assertEqual(_statements(), [
+            "show databases",
+            'create retention policy "charmscaler" on "statsdb" duration 7d '
+            'replication 1',
+            'alter retention policy "charmscaler" on "statsdb" duration 7d '
+            'replication 1'
+        ])
+        self.assertEqual(mock_log.call_args[1]["level"], "WARNING")
+
+        # Users without the admin privilege only cause a warning
+        mock_log.reset_mock()
+        mock_req.post(url, [_databases(), {
+            "status_code": 403,
+            "json": {"error": "error authorizing query: foo not authorized "
+                              "to execute statement 'CREATE DATABASE "
+                              "statsdb', requires admin privilege"}
+        }])
+        self.autoscaler._provision_historian(historian)
+        self.assertIn("requires admin privilege", mock_log.call_args[0][0])
+        mock_req.post(url, status_code=401,
+                      json={"error": "authorization failed"})
+        self.autoscaler._provision_historian(historian)
+
+        # Other errors
+        mock_req.post(url, [_databases(), {
+            "json": {"results": [{"error": "invalid duration"}]}}])
+        self.assertRaises(ConfigurationException,
+                          self.autoscaler._provision_historian, historian)
+        mock_req.post(url, status_code=500)
+        self.assertRaises(ConfigurationException,
+                          self.autoscaler._provision_historian, historian)
+
+        # Nothing is provisioned without a retention duration
+        mock_req.reset_mock()
+        self.autoscaler._provision_historian(dict(historian, retention=""))
+        self.assertEqual(mock_req.call_count, 0)
+
+        self.assertRaises(ConfigurationException,
+                          self.autoscaler._provision_historian,
+                          dict(historian, retention="7 days"))
+
     @requests_mock.mock()
     def test_start(self, mock_req):
         url = self.autoscaler._get_url("start")
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError, RequestException
 import requests_mock
 import unittest
 import unittest.mock as mock
@@ -15,11 +15,11 @@ class TestDockerComponent(unittest.TestCase):
         cls.component = DockerComponent("test-component")
 
     def test_healthcheck(self):
-        # Not much to test at the moment. Important test in charms.docker.
+        # Not much to test at the moment. Important test in test_docker_engine.
         pass
 
     @mock.patch("reactive.component.Config")
-    @mock.patch("reactive.component.Compose")
+    @mock.patch("reactive.component.ComposeProject")
     def test_compose_up(self, mock_compose, mock_config):
         self.component.healthcheck = mock.MagicMock()
 
@@ -48,6 +48,36 @@ class TestHTTPComponent(unittest.TestCase):
         # Missing path
         self.assertRaises(NotImplementedError, self.component._get_url, "_")
 
+    @requests_mock.mock()
+    @mock.patch("reactive.component.HTTP_RETRY_LIMIT", 1)
+    @mock.patch("reactive.component.get_engine")
+    def test_direct_transport(self, mock_req, mock_engine):
+        component = HTTPComponent("test-component", 1337, {
+            "status": "status",
+        })
+        component.transport = "direct"
+        engine = mock_engine.return_value
+
+        # The published port until the container has an address
+        engine.address.return_value = None
+        self.assertEqual(component._get_url("status"),
+                         "http://localhost:1337/status")
+
+        engine.address.return_value = "172.18.0.2"
+        mock_req.get("http://172.18.0.2:80/status", status_code=200)
+        component.send_request("status")
+        component.send_request("status")
+        self.assertEqual(mock_req.call_count, 2)
+        # The address is looked up once
+        self.assertEqual(engine.address.call_count, 2)
+
+        # ...and again once the container can't be reached
+        mock_req.get("http://172.18.0.2:80/status", exc=ConnectionError)
+        self.assertRaises(RequestException, component.send_request, "status")
+        engine.address.return_value = "172.18.0.3"
+        self.assertEqual(component._get_url("status"),
+                         "http://172.18.0.3:80/status")
+
 
 class TestConfigComponent(unittest.TestCase):
     @classmethod
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from reactive.docker_engine import (CONFIG_HASH_LABEL, ComposeProject,
+                                    DockerEngine, DockerEngineError,
+                                    container_spec)
+from unit_tests.simulator.fakes import FakeEngine
+
+COMPOSE_BASE = """
+version: "2"
+
+services:
+  _base:
+    logging:
+      driver: "local"
+      options:
+        max-size: "10m"
+"""
+
+COMPOSE = """
+version: "2"
+
+services:
+  autoscaler:
+    container_name: "autoscaler"
+    extends:
+      file: "../docker-compose-base.yml"
+      service: "_base"
+    image: "testimage:{tag}"
+    volumes:
+      - "/var/log/elastisys:/var/log/elastisys"
+    environment:
+      - "HTTP_PORT=80"
+    ports:
+      - "8097:80"
+"""
+
+
+class TestDockerEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.fake = FakeEngine(os.path.join(self.tmpdir, "docker.sock"),
+                               images=["testimage:1", "testimage:2"])
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+
+        self.engine = DockerEngine(os.path.join(self.tmpdir, "docker.sock"))
+        self.addCleanup(self.engine.close)
+
+        self.workspace = os.path.join(self.tmpdir, "autoscaler")
+        os.makedirs(self.workspace)
+        with open(os.path.join(self.tmpdir, "docker-compose-base.yml"),
+                  "w") as f:
+            f.write(COMPOSE_BASE)
+        with open(os.path.join(self.workspace, ".env"), "w") as f:
+            f.write("COMPOSE_PROJECT_NAME=charmscaler\n")
+        self._render(tag=1)
+
+    def _render(self, tag):
+        with open(os.path.join(self.workspace, "docker-compose.yml"),
+                  "w") as f:
+            f.write(COMPOSE.format(tag=tag))
+
+    def test_errors(self):
+        self.assertIsNone(self.engine.inspect("missing"))
+        self.assertFalse(self.engine.health("missing"))
+        self.assertEqual(self.engine.health_status("missing"), "unhealthy")
+
+        with self.assertRaises(DockerEngineError) as ctx:
+            self.engine.start("missing")
+        self.assertEqual(ctx.exception.status, 404)
+
+    def test_pause(self):
+        self.fake.containers["autoscaler"] = {"State": {"Running": True}}
+
+        self.engine.pause("autoscaler")
+        self.assertTrue(self.fake.containers["autoscaler"]["State"]["Paused"])
+        self.engine.unpause("autoscaler")
+        self.assertFalse(
+            self.fake.containers["autoscaler"]["State"]["Paused"])
+
+        self.fake.containers["autoscaler"]["State"]["Running"] = False
+        with self.assertRaises(DockerEngineError) as ctx:
+            self.engine.pause("autoscaler")
+        self.assertEqual(ctx.exception.status, 409)
+
+    def test_stats(self):
+        self.fake.containers["autoscaler"] = {}
+        samples = list(self.engine.stats("autoscaler"))
+        self.assertEqual(samples, [{"read": str(i)} for i in range(3)])
+
+        with self.assertRaises(DockerEngineError):
+            list(self.engine.stats("missing"))
+
+    def test_logs(self):
+        self.assertEqual(self.engine.logs("missing"), [])
+
+        self.fake.containers["autoscaler"] = {"Config": {}}
+        self.fake.logs["autoscaler"] = [b"starting\n", b"OutOfMemoryError\n"]
+        self.assertEqual(self.engine.logs("autoscaler"),
+                         ["starting", "OutOfMemoryError"])
+
+    def test_address(self):
+        self.assertIsNone(self.engine.address("missing"))
+
+        self.fake.containers["charmpool"] = {"NetworkSettings": {
+            "Networks": {"charmscaler_default": {"IPAddress": "172.18.0.3"}}
+        }}
+        self.assertEqual(self.engine.address("charmpool"), "172.18.0.3")
+
+    def test_container_spec(self):
+        spec = container_spec("charmscaler", "alertrelay", {
+            "image": "python:3.6-alpine",
+            "command": "python /alertrelay/relay.py",
+            "healthcheck": {
+                "test": ["CMD", "python", "/alertrelay/relay.py", "check"],
+                "interval": "1m30s",
+                "timeout": "500ms",
+                "retries": 3
+            }
+        })
+
+        self.assertEqual(spec["Cmd"], ["python", "/alertrelay/relay.py"])
+        self.assertEqual(spec["Healthcheck"], {
+            "Test": ["CMD", "python", "/alertrelay/relay.py", "check"],
+            "Interval": 90 * 10 ** 9,
+            "Timeout": 500 * 10 ** 6,
+            "Retries": 3
+        })
+
+    def test_pull(self):
+        project = ComposeProject(self.workspace, engine=self.engine)
+        self._render(tag=3)
+
+        project.up()
+        self.assertIn("testimage:3", self.fake.images)
+        self.assertIn(("POST", "/images/create"), self.fake.requests)
+
+        # Available images are not pulled again
+        requests = len(self.fake.requests)
+        project.pull()
+        self.assertNotIn(("POST", "/images/create"),
+                         self.fake.requests[requests:])
+
+    def test_reconcile(self):
+        project = ComposeProject(self.workspace, engine=self.engine)
+
+        # Create and start
+        project.up()
+        self.assertIn("charmscaler_default", self.fake.networks)
+        container = self.fake.containers["autoscaler"]
+        self.assertTrue(container["State"]["Running"])
+        self.assertEqual(self.engine.health("autoscaler"),
+                         {"Status": "healthy"})
+        config_hash = container["Config"]["Labels"][CONFIG_HASH_LABEL]
+
+        # Unchanged definition, the container is left untouched
+        project.up()
+        self.assertIs(self.fake.containers["autoscaler"], container)
+
+        # Stopped containers are started again
+        project.stop()
+        self.assertFalse(self.engine.health("autoscaler"))
+        project.up()
+        self.assertIs(self.fake.containers["autoscaler"], container)
+        self.assertTrue(container["State"]["Running"])
+
+        # Changed definition, the container is recreated
+        self._render(tag=2)
+        project.up()
+        container = self.fake.containers["autoscaler"]
+        self.assertEqual(container["Config"]["Image"], "testimage:2")
+        self.assertNotEqual(container["Config"]["Labels"][CONFIG_HASH_LABEL],
+                            config_hash)
+
+        # Remove containers, images and the network
+        project.down(rmi=True)
+        self.assertEqual(self.fake.containers, {})
+        self.assertNotIn("testimage:2", self.fake.images)
+        self.assertNotIn("charmscaler_default", self.fake.networks)
+
+        # Every request was sent over the same connection
+        self.assertEqual(self.fake.connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
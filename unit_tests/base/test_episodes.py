@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import unittest
+
+from reactive.episodes import breaches, episodes, percentiles, report
+
+METRIC = {
+    "name": "cpu",
+    "downsample": 10,
+    "rules": {
+        "scale_out": {"condition": "ABOVE", "threshold": 80, "resize": 1},
+        "scale_in": {"condition": "BELOW", "threshold": 20, "resize": -1}
+    }
+}
+
+
+class TestEpisodes(unittest.TestCase):
+    # Breach at 20, back to normal at 60, breach again at 100 and 130
+    points = [(0, 50), (10, 50), (20, 90), (30, 95), (40, 90), (50, 85),
+              (60, 50), (70, 10), (80, 10), (90, 50), (100, 90), (110, 50),
+              (120, 50), (130, 90)]
+    # Scaled in at 107, after the second unit had become active
+    desired = [(0, 1), (45, 2), (107, 1), (115, 2)]
+    active = [(0, 1), (105, 2)]
+
+    def test_breaches(self):
+        rules = list(METRIC["rules"].values())[:1]
+        self.assertEqual(breaches(self.points, rules), [20, 100, 130])
+
+    def test_episodes(self):
+        result = episodes([20, 100, 130], self.desired, self.active)
+
+        self.assertEqual(result, [
+            # Decision at 45, the second unit was active at 105
+            {"breach": 20, "decision": 45, "active": 105, "from": 1, "to": 2},
+            {"breach": 130, "decision": None, "active": None, "from": 2,
+             "to": None}
+        ])
+
+    def test_unanswered_episode(self):
+        # Scaled in at 60 before the second unit was active, the unit
+        # which was active at 120 answers the next episode
+        desired = [(0, 1), (45, 2), (60, 1), (110, 2)]
+        active = [(0, 1), (120, 2)]
+        result = episodes([20, 100], desired, active)
+
+        self.assertEqual(result, [
+            {"breach": 20, "decision": 45, "active": None, "from": 1,
+             "to": 2},
+            {"breach": 100, "decision": 110, "active": 120, "from": 1,
+             "to": 2}
+        ])
+
+        # Units which were already active answer at once
+        self.assertEqual(episodes([100], desired, [(0, 2)])[0]["active"],
+                         110)
+
+        # Breaches without a decision are episodes of their own
+        self.assertEqual(len(episodes([20, 30], [(0, 1)], [(0, 1)])), 2)
+
+    def test_percentiles(self):
+        self.assertIsNone(percentiles([]))
+        self.assertEqual(percentiles(list(range(1, 101))),
+                         {"p50": 50, "p95": 95, "p99": 99, "max": 100})
+
+    def test_report(self):
+        result = report(METRIC, self.points, self.desired, self.active, 140)
+
+        self.assertEqual(result["unanswered"], 1)
+        self.assertEqual(result["latency"]["decision"]["p50"], 25)
+        self.assertEqual(result["latency"]["total"]["max"], 85)
+        self.assertEqual(result["step"]["max"], 1)
+        self.assertEqual(result["provisioning"], {
+            "over_seconds": 20.0,
+            "under_seconds": 60.0
+        })
+
+        result = report(METRIC, self.points, self.desired, self.active, 140,
+                        unit_capacity=50)
+        provisioning = result["provisioning"]
+        # Two units needed from 20 to 60 and from 100 to 110 while only one
+        # was active, one unit too many from 110 to 130
+        self.assertEqual(provisioning["under_seconds"], 50.0)
+        self.assertEqual(provisioning["over_seconds"], 20.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
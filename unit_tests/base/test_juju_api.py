@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import unittest
+
+from reactive.juju_api import JujuAPI, JujuAPIError, WebSocket
+from unit_tests.simulator.fakes import FakeJujuController
+
+
+class TestJujuAPI(unittest.TestCase):
+    def setUp(self):
+        self.controller = FakeJujuController().start()
+        self.addCleanup(self.controller.stop)
+
+    def _connect(self):
+        api = JujuAPI(WebSocket("127.0.0.1", self.controller.port,
+                                "/model/1234/api"))
+        self.addCleanup(api.close)
+        return api
+
+    def test_call(self):
+        api = self._connect()
+        api.login("admin", "secret")
+        self.assertEqual(self.controller.paths, ["/model/1234/api"])
+
+        # Facades are called at the highest version offered on login
+        status = api.call("Client", "FullStatus", {"patterns": []})
+        self.assertEqual(status["applications"]["app"]["units"],
+                         {"app/0": {"machine": "0"}})
+        self.assertEqual(self.controller.requests[-1]["version"], 2)
+
+        # Large messages
+        response = api.call("MachineManager", "AddMachines", {"params": [
+            {"jobs": ["JobHostUnits"]} for _ in range(2000)]})
+        self.assertEqual(len(response["machines"]), 2000)
+
+        with self.assertRaises(JujuAPIError) as context:
+            api.call("Application", "AddUnits", {
+                "application": "app", "num-units": 1,
+                "placement": [{"scope": "#", "directive": "9999"}]})
+        self.assertEqual(context.exception.code, "not found")
+
+        with self.assertRaises(JujuAPIError):
+            api.call("Storage", "ListStorageDetails")
+
+    def test_login(self):
+        with self.assertRaises(JujuAPIError) as context:
+            self._connect().login("admin", "wrong")
+        self.assertEqual(context.exception.code, "unauthorized access")
+
+    def test_connect(self):
+        cfg = {"juju_api_endpoint": "127.0.0.1:1", "juju_ca_cert": "",
+               "juju_model_uuid": "1234", "juju_username": "admin",
+               "juju_password": "secret"}
+        self.assertRaises(JujuAPIError, JujuAPI.connect, cfg)
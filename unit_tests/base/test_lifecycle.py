@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+import urllib.request
+
+from reactive.autoscaler import cloudpool_url
+from reactive.lifecycle import sync_lifecycle
+from unit_tests.simulator.fakes import FakeCharmpool
+
+GATE_SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                           "templates", "lifecyclegate", "gate.py")
+
+
+def _load_gate():
+    spec = importlib.util.spec_from_file_location("lifecyclegate_script",
+                                                  GATE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.ACK_POLL_INTERVAL = 0.05
+    return module
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.05)
+
+
+class FakeRelation:
+    """
+    The scaling-lifecycle relation data, as seen through hookenv.
+    """
+    def __init__(self, units):
+        self.settings = {}
+        self.remote = {unit: {} for unit in units}
+
+    def patch(self):
+        return [
+            mock.patch("charmhelpers.core.hookenv.relation_ids",
+                       lambda name: ["scaling-lifecycle:3"]),
+            mock.patch("charmhelpers.core.hookenv.related_units",
+                       lambda rid: sorted(self.remote)),
+            mock.patch("charmhelpers.core.hookenv.relation_get",
+                       lambda key, unit, rid: self.remote[unit].get(key)),
+            mock.patch("charmhelpers.core.hookenv.relation_set",
+                       lambda rid, settings: self.settings.update(settings))
+        ]
+
+
+class TestLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+
+        self.relation = FakeRelation(["app/0", "app/1", "app/2"])
+        for patcher in self.relation.patch():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _sync(self):
+        return sync_lifecycle(self.state_dir)
+
+    def test_cloudpool_url(self):
+        cfg = {"lifecycle_enabled": False,
+               "charmpool_url": "http://charmpool:80"}
+        self.assertEqual(cloudpool_url(cfg), "http://charmpool:80")
+        self.assertEqual(cloudpool_url(dict(cfg, lifecycle_enabled=True)),
+                         "http://lifecyclegate:80")
+
+    def test_sync(self):
+        drain = {"id": "1-1", "units": ["app/2"], "deadline": 0}
+        with open(os.path.join(self.state_dir, "requests.json"), "w") as f:
+            json.dump({"scale_out": None, "drain": drain}, f)
+
+        self.relation.remote["app/1"]["drained"] = "0-9"
+        self.relation.remote["app/2"]["drained"] = "1-1"
+        self.assertEqual(self._sync()["drain"], drain)
+
+        self.assertEqual(json.loads(self.relation.settings["drain"]), drain)
+        self.assertEqual(self.relation.settings["scale-out"], "")
+
+        # Only acknowledgements of the current drain count
+        with open(os.path.join(self.state_dir, "acks.json")) as f:
+            self.assertEqual(json.load(f), {"subscribers": 3, "drain": "1-1",
+                                            "drained": ["app/2"],
+                                            "placed": None})
+
+    def test_sync_without_gate(self):
+        state_dir = os.path.join(self.state_dir, "missing")
+        self.assertEqual(sync_lifecycle(state_dir),
+                         {"scale_out": None, "drain": None})
+        self.assertFalse(os.path.exists(state_dir))
+        self.assertEqual(self.relation.settings, {"scale-out": "",
+                                                  "drain": ""})
+
+
+class TestGateScript(unittest.TestCase):
+    def setUp(self):
+        self.charmpool = FakeCharmpool(["app/0", "app/1", "app/2"]).start()
+        self.addCleanup(self.charmpool.stop)
+
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+
+        self.relation = FakeRelation(["app/0", "app/1", "app/2"])
+        for patcher in self.relation.patch():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.gate = gate = _load_gate()
+        pool = gate.Pool("http://127.0.0.1:{}".format(self.charmpool.port))
+        self.coordinator = gate.Coordinator(pool, self.state_dir, lead=0,
+                                            drain_timeout=5).start()
+        self.server = gate.GateServer(("127.0.0.1", 0), pool,
+                                      self.coordinator)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _request(self, method, path, data=None):
+        url = "http://127.0.0.1:{}{}".format(self.server.server_address[1],
+                                             path)
+        body = None if data is None else json.dumps(data).encode("utf-8")
+        request = urllib.request.Request(
+            url, data=body, method=method,
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            content = response.read()
+            return json.loads(content.decode("utf-8")) if content else None
+
+    def _notices(self):
+        sync_lifecycle(self.state_dir)
+        return self.relation.settings
+
+    def test_scale_out(self):
+        self.coordinator.lead = 0.5
+        self._request("POST", "/pool/size", {"desiredSize": 5})
+
+        # Noticed ahead of the scale-out
+        _wait_for(lambda: self._notices()["scale-out"])
+        notice = json.loads(self.relation.settings["scale-out"])
+        self.assertEqual((notice["units"], notice["size"]), (2, 5))
+        self.assertEqual(self.charmpool.desired_size, 3)
+        # The Autoscaler sees the size the pool is on its way to
+        self.assertEqual(self._request("GET", "/pool/size")["desiredSize"], 5)
+
+        _wait_for(lambda: self.charmpool.desired_size == 5)
+        _wait_for(lambda: not self._notices()["scale-out"])
+
+    def test_scale_in(self):
+        self._request("POST", "/pool/size", {"desiredSize": 1})
+
+        # The newest units are asked to drain
+        _wait_for(lambda: self._notices()["drain"])
+        drain = json.loads(self.relation.settings["drain"])
+        self.assertEqual(drain["units"], ["app/2", "app/1"])
+
+        # Not terminated until every unit has drained
+        self.relation.remote["app/2"]["drained"] = drain["id"]
+        self._notices()
+        time.sleep(0.3)
+        self.assertEqual(len(self.charmpool.machines), 3)
+
+        self.relation.remote["app/1"]["drained"] = drain["id"]
+        self._notices()
+        _wait_for(lambda: len(self.charmpool.machines) == 1)
+        self.assertEqual(self.charmpool.machines[0]["id"], "0")
+        self.assertEqual(self.charmpool.desired_size, 1)
+
+        status = self._request("GET", "/gate/status")
+        self.assertEqual((status["drains"], status["drained"]), (1, 1))
+        self.assertIsNone(status["target"])
+
+    def test_max_inflight(self):
+        self.coordinator.max_inflight = 2
+        self._request("POST", "/pool/size", {"desiredSize": 6})
+
+        # Two machines requested, the third is held back
+        _wait_for(lambda: self.charmpool.desired_size == 5)
+        _wait_for(lambda: self._request("GET", "/gate/status")["held_back"])
+        self.charmpool.machines += [{
+            "id": str(i), "machineState": "PENDING",
+            "metadata": {"units": ["app/{}".format(i)]}
+        } for i in (3, 4)]
+        time.sleep(0.3)
+        self.assertEqual(self.charmpool.desired_size, 5)
+        self.assertEqual(self._request("GET", "/pool/size")["desiredSize"], 6)
+
+        # Requested once a pending machine is up
+        self.charmpool.machines[3]["machineState"] = "RUNNING"
+        _wait_for(lambda: self.charmpool.desired_size == 6)
+        _wait_for(lambda: self._request("GET", "/gate/status")["target"]
+                  is None)
+
+    def test_warm_spares(self):
+        self.coordinator.warm_spares = 2
+        self._request("POST", "/pool/size", {"desiredSize": 5})
+
+        # Not raised before the charm has placed units on its spares
+        _wait_for(lambda: self._notices()["scale-out"])
+        time.sleep(0.3)
+        self.assertEqual(self.charmpool.desired_size, 3)
+
+        placed = []
+        sync_lifecycle(self.state_dir, place=placed.append)
+        self.assertEqual(placed[0]["units"], 2)
+        _wait_for(lambda: self.charmpool.desired_size == 5)
+
+        # Nor held up when the charm doesn't answer
+        self.gate.PLACEMENT_TIMEOUT = 0.3
+        self._request("POST", "/pool/size", {"desiredSize": 6})
+        _wait_for(lambda: self.charmpool.desired_size == 6)
+        self.assertEqual(
+            self._request("GET", "/gate/status")["placement_timeouts"], 1)
+
+    def test_drain_timeout(self):
+        self.coordinator.drain_timeout = 0.3
+        self._request("POST", "/pool/size", {"desiredSize": 2})
+
+        # Nothing acknowledges the drain
+        _wait_for(lambda: len(self.charmpool.machines) == 2)
+        self.assertEqual(
+            self._request("GET", "/gate/status")["drain_timeouts"], 1)
+
+    def test_machine_units(self):
+        gate = _load_gate()
+        self.assertEqual(gate.machine_units(
+            {"id": "4", "metadata": {"units": ["app/3", "sub/1"]}}),
+            ["app/3", "sub/1"])
+        self.assertEqual(gate.machine_units(
+            {"id": "4", "metadata": {"units": "app/3"}}), ["app/3"])
+        self.assertEqual(gate.machine_units({"id": "4"}), [])
+
+    def test_scale_in_without_units(self):
+        del self.charmpool.machines[2]["metadata"]
+        self._request("POST", "/pool/size", {"desiredSize": 1})
+
+        # Only the unit which is known is asked to drain
+        _wait_for(lambda: self._notices()["drain"])
+        drain = json.loads(self.relation.settings["drain"])
+        self.assertEqual(drain["units"], ["app/1"])
+
+        self.relation.remote["app/1"]["drained"] = drain["id"]
+        self._notices()
+        _wait_for(lambda: len(self.charmpool.machines) == 1)
+
+    def test_passthrough(self):
+        self.assertEqual(len(self._request("GET", "/pool")["machines"]), 3)
+
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            self._request("POST", "/pool/size", {"desiredSize": -1})
+        self.assertEqual(ctx.exception.code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
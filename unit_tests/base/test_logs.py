@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+
+from reactive.config import ConfigurationRequiredException
+from reactive.logs import disk_usage, logging_config, logrotate_config
+
+
+class TestLogs(unittest.TestCase):
+    cfg = {
+        "log_driver": "local",
+        "log_max_size": "10m",
+        "log_max_file": 3,
+        "log_compress": True,
+        "log_max_age": 7,
+        "log_rotate_schedule": "*/15 * * * *"
+    }
+
+    def test_logging_config(self):
+        # Size capped driver
+        self.assertEqual(logging_config(self.cfg)["logging"], {
+            "driver": "local",
+            "options": {
+                "max-size": "10m",
+                "max-file": 3,
+                "compress": "true"
+            }
+        })
+
+        # The driver's own compression default is kept
+        cfg = dict(self.cfg, log_compress="")
+        self.assertNotIn("compress", logging_config(cfg)["logging"]["options"])
+
+        # Drivers without local log files take no rotation options
+        cfg = dict(self.cfg, log_driver="journald")
+        self.assertEqual(logging_config(cfg)["logging"], {
+            "driver": "journald",
+            "options": {}
+        })
+
+        cfg = dict(self.cfg, log_driver="")
+        self.assertRaises(ConfigurationRequiredException, logging_config, cfg)
+
+    def test_logrotate_config(self):
+        self.assertEqual(logrotate_config(self.cfg)["max_size"], "10M")
+
+        cfg = dict(self.cfg, log_max_size="512k")
+        self.assertEqual(logrotate_config(cfg)["max_size"], "512k")
+
+    def test_disk_usage(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "autoscaler"))
+            for path, size in (("a.log", 10),
+                               (os.path.join("autoscaler", "b.log"), 5)):
+                with open(os.path.join(tmpdir, path), "wb") as f:
+                    f.write(b"x" * size)
+
+            self.assertEqual(disk_usage(tmpdir), 15)
+            self.assertEqual(disk_usage(os.path.join(tmpdir, "a.log")), 10)
+            self.assertRaises(OSError, disk_usage,
+                              os.path.join(tmpdir, "missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+from urllib.parse import urlencode
+import urllib.request
+
+from reactive.autoscaler import (MetricValidationException,
+                                 metrics_influxdb_config)
+from reactive.querycache import QueryCache, compose_config
+from unit_tests.simulator.fakes import FakeInfluxdb, FakeInfluxdbServer
+
+CACHE_SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                            "templates", "querycache", "cache.py")
+
+CFG = {
+    "query_cache_enabled": True,
+    "query_cache_ttl": 0,
+    "query_cache_size": 100,
+    "query_cache_port": 0,
+    "query_cache_address": "",
+    "metric_poll_interval": 10
+}
+
+
+def _load_cache():
+    spec = importlib.util.spec_from_file_location("querycache_script",
+                                                  CACHE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_compose_config(self):
+        script = mock.MagicMock()
+        script.__str__.return_value = "/charm/files/querycache/cache.py"
+
+        config = compose_config(CFG, script)
+        self.assertEqual(config["workspace"], "/charm/files/querycache")
+        self.assertEqual((config["ttl"], config["quantum"]), (10, 10))
+        self.assertEqual(config["published_port"], 0)
+        self.assertEqual(compose_config(dict(CFG, query_cache_ttl=5),
+                                        script)["ttl"], 5)
+
+    def test_metrics_influxdb_config(self):
+        influxdb = FakeInfluxdb()
+        config = metrics_influxdb_config(CFG, influxdb)
+        self.assertEqual((config["host"], config["port"]),
+                         ("querycache", 8086))
+        self.assertEqual(config["username"], influxdb.user())
+
+        config = metrics_influxdb_config(
+            dict(CFG, query_cache_enabled=False), influxdb)
+        self.assertEqual(config["host"], influxdb.hostname())
+
+        # The cache of another CharmScaler
+        config = metrics_influxdb_config(
+            dict(CFG, query_cache_enabled=False,
+                 query_cache_address="10.0.0.5:8086"), influxdb)
+        self.assertEqual((config["host"], config["port"]),
+                         ("10.0.0.5", 8086))
+        self.assertRaises(MetricValidationException, metrics_influxdb_config,
+                          dict(CFG, query_cache_address="10.0.0.5"),
+                          influxdb)
+
+    @mock.patch("reactive.component.get_engine")
+    @mock.patch("reactive.component.ComposeProject")
+    @mock.patch("reactive.component.Config")
+    @mock.patch("reactive.querycache.Config")
+    def test_disabled(self, mock_upstream, mock_config, mock_compose,
+                      mock_engine):
+        cache = QueryCache(dict(CFG, query_cache_enabled=False), "python",
+                           "3.12-alpine")
+        cache.compose_up(CFG)
+        cache.configure(CFG, FakeInfluxdb(), [])
+
+        mock_engine.return_value.remove.assert_called_once_with(
+            "querycache", force=True)
+        self.assertFalse(mock_compose.return_value.up.called)
+        self.assertFalse(cache.script.render.called)
+        self.assertFalse(mock_upstream.return_value.render.called)
+
+
+class TestNormalise(unittest.TestCase):
+    def setUp(self):
+        self.script = _load_cache()
+
+    def test_normalise(self):
+        second = 10 ** 9
+        query = ("SELECT mean(usage) FROM cpu WHERE host = 'a' AND "
+                 "time >= '2017-07-14T02:40:03.5Z' AND "
+                 "time <= '2017-07-14T02:41:01Z' GROUP BY time(10s)")
+        start = 1500000000 * second
+
+        normalised, window = self.script.normalise(query, 30 * second)
+        self.assertEqual(normalised, (
+            "SELECT mean(usage) FROM cpu WHERE host = 'a' AND "
+            "time >= {} AND time < {} GROUP BY time(10s)").format(
+                start, start + 90 * second))
+        # Only the whole buckets are served from the normalised query, the
+        # partial ones at the edges are queried as they are
+        self.assertEqual(window, {
+            "lower": (start + 10 * second, True),
+            "upper": (start + 60 * second, False),
+            "edges": [
+                "SELECT mean(usage) FROM cpu WHERE host = 'a' AND "
+                "time >= {} AND time < {} GROUP BY time(10s)".format(
+                    start + 3500 * 10 ** 6, start + 10 * second),
+                "SELECT mean(usage) FROM cpu WHERE host = 'a' AND "
+                "time >= {} AND time < {} GROUP BY time(10s)".format(
+                    start + 60 * second, start + 61 * second + 1)
+            ]})
+
+        # Queries within the same interval are the same query
+        later = query.replace("02:40:03.5", "02:40:09").replace(
+            "02:41:01", "02:41:05")
+        self.assertEqual(self.script.normalise(later, 30 * second)[0],
+                         normalised)
+
+        # Bounds aligned to the buckets have no edges, the window is widened
+        # to multiples of both the quantum and the interval
+        self.assertEqual(self.script.normalise(
+            "SELECT max(usage) FROM cpu WHERE time >= 1500000010s AND "
+            "time < 1500000040s GROUP BY time(10s)", 20 * second),
+            ("SELECT max(usage) FROM cpu WHERE time >= {} AND time < {} "
+             "GROUP BY time(10s)".format(start, start + 40 * second),
+             {"lower": (start + 10 * second, True),
+              "upper": (start + 40 * second, False), "edges": []}))
+
+        # Epoch literals, without an upper bound
+        self.assertEqual(self.script.normalise(
+            "SELECT * FROM cpu WHERE time > 1500000003s", 10 * second),
+            ("SELECT * FROM cpu WHERE time >= {}".format(start),
+             {"lower": (start + 3 * second + 1, True), "edges": []}))
+
+        # Left as they are
+        for query in ("SELECT * FROM cpu",
+                      "SELECT * FROM cpu WHERE time > now() - 5m",
+                      "SELECT * FROM cpu WHERE time > 1s; SELECT 1",
+                      # No whole bucket in the window
+                      "SELECT mean(usage) FROM cpu WHERE time >= 3s AND "
+                      "time < 8s GROUP BY time(10s)"):
+            self.assertEqual(self.script.normalise(query, 10 * second),
+                             (query, None))
+        self.assertIsNone(self.script.normalise(query, 0)[1])
+
+    def test_trim(self):
+        second = 10 ** 9
+        content = json.dumps({"results": [{"series": [{
+            "name": "cpu",
+            "columns": ["time", "mean"],
+            "values": [["2017-07-14T02:39:50Z", 1],
+                       ["2017-07-14T02:40:00Z", 2],
+                       ["2017-07-14T02:40:10Z", 3],
+                       ["2017-07-14T02:40:20Z", 4]]
+        }]}]}).encode("utf-8")
+        start = 1500000000 * second
+        window = {"lower": (start, True), "upper": (start + 10 * second,
+                                                    False)}
+
+        def _values(content, epoch=None):
+            result = json.loads(self.script.trim(content, window, epoch)
+                                .decode("utf-8"))
+            return result["results"][0]["series"][0]["values"]
+
+        self.assertEqual([value for _, value in _values(content)], [2])
+
+        epoch = content.replace(b'"2017-07-14T02:39:50Z"', b"1499999990") \
+            .replace(b'"2017-07-14T02:40:00Z"', b"1500000000") \
+            .replace(b'"2017-07-14T02:40:10Z"', b"1500000010")
+        self.assertEqual([value for _, value in _values(epoch, "s")], [2])
+
+
+class TestCacheScript(unittest.TestCase):
+    def setUp(self):
+        self.influxdb = FakeInfluxdbServer().start()
+        self.addCleanup(self.influxdb.stop)
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        upstream = os.path.join(tmpdir, "upstream.json")
+        with open(upstream, "w") as upstream_file:
+            json.dump({"host": "127.0.0.1", "port": self.influxdb.port},
+                      upstream_file)
+
+        script = _load_cache()
+        self.cache = script.QueryCache(script.Upstream(upstream), ttl=60)
+        self.server = script.ProxyServer(("127.0.0.1", 0), self.cache)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _get(self, path):
+        url = "http://127.0.0.1:{}{}".format(self.server.server_address[1],
+                                             path)
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def _queries(self):
+        return [path for _, path in self.influxdb.requests
+                if path == "/query"]
+
+    def test_cache(self):
+        result = self._get("/query?db=telegraf&q=SELECT+1")
+        self.assertEqual(result, {"results": [{"statement_id": 0}]})
+
+        # Served from memory, regardless of the parameter order
+        self._get("/query?q=SELECT+1&db=telegraf")
+        self.assertEqual(len(self._queries()), 1)
+
+        # Another query
+        self._get("/query?db=telegraf&q=SELECT+2")
+        self.assertEqual(len(self._queries()), 2)
+
+        stats = self._get("/cache/stats")
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["entries"], 2)
+        self.assertIsNotNone(stats["latency"]["upstream"]["p50"])
+
+    def test_merge(self):
+        self.influxdb.delay = 0.5
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(
+                lambda _: self._get("/query?db=telegraf&q=SELECT+1"),
+                range(5)))
+
+        # One query for all five clients
+        self.assertEqual(len(self._queries()), 1)
+        self.assertEqual(len(set(json.dumps(r) for r in results)), 1)
+
+        stats = self._get("/cache/stats")
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["merged"], 4)
+
+    def test_normalised(self):
+        query = "SELECT mean(usage) FROM cpu WHERE time >= {}s GROUP BY " \
+            "time(10s)"
+        self.cache.quantum = 60
+
+        # Polls within the same minute share an entry
+        for start in (1500000000, 1500000010, 1500000020):
+            self._get("/query?db=telegraf&" + urlencode(
+                {"q": query.format(start)}))
+        self.assertEqual(len(self._queries()), 1)
+        self.assertEqual(self.influxdb.statements,
+                         ["SELECT mean(usage) FROM cpu WHERE time >= "
+                          "1500000000000000000 GROUP BY time(10s)"])
+
+        stats = self._get("/cache/stats")
+        self.assertEqual((stats["hits"], stats["normalised"]), (2, 3))
+
+    def test_normalised_results(self):
+        start = 1500000000 * 10 ** 9
+        self.influxdb.points["cpu"] = [(start + i * 10 ** 9, float(i * i))
+                                       for i in range(120)]
+        self.cache.quantum = 30
+        query = "SELECT mean(usage) FROM cpu WHERE time >= {} AND " \
+            "time <= 1500000061s GROUP BY time(10s) fill(none)"
+
+        def _influxdb(query):
+            url = "http://127.0.0.1:{}/query?{}".format(
+                self.influxdb.port, urlencode({"q": query, "epoch": "ns"}))
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return json.loads(response.read().decode("utf-8"))
+
+        # The same points and aggregates as InfluxDB's for the query as sent,
+        # the partial first and last buckets included
+        for lower, first in (("1500000003500ms", 0), ("1500000007s", 0),
+                             ("1500000010s", 1)):
+            result = self._get("/query?db=telegraf&" + urlencode({
+                "q": query.format(lower), "epoch": "ns"}))
+            self.assertEqual(result, _influxdb(query.format(lower)))
+            values = result["results"][0]["series"][0]["values"]
+            self.assertEqual([bucket for bucket, _ in values],
+                             [start + i * 10 ** 10 for i in range(first, 7)])
+
+        # The whole buckets came from one normalised query
+        widened = [statement for statement in self.influxdb.statements
+                   if "time < 1500000090000000000" in statement]
+        self.assertEqual(len(set(widened)), 1)
+
+    def test_upstream_error(self):
+        self.influxdb.stop()
+
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            self._get("/query?db=telegraf&q=SELECT+1")
+        self.assertEqual(ctx.exception.code, 502)
+        self.assertEqual(self._get("/cache/stats")["errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
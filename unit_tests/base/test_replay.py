@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    from tools.replay import downsample, load_series, render_metrics, replay
+except ImportError:
+    np = None
+
+from unit_tests.simulator import default_metrics
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.metrics = default_metrics()
+        self.metrics[0]["cooldown"] = 60
+
+    def _series(self, values, step=10):
+        times = np.arange(len(values)) * step + 1500000000.0
+        return {"cpu_0": (times, np.asarray(values, dtype=np.float64))}
+
+    def test_render_metrics(self):
+        streams, predictors = render_metrics(self.metrics)
+
+        self.assertEqual(streams[0]["query"]["select"], "mean(usage_user)")
+        rules = predictors[0]["parameters"]["scalingRules"]
+        self.assertEqual([rule["resize"] for rule in rules], [1, -1])
+
+    def test_downsample(self):
+        times = np.array([35.0, 0.0, 10.0, 40.0, 95.0])
+        values = np.array([4.0, 1.0, 2.0, 6.0, 7.0])
+
+        buckets, means = downsample(times, values, 30, "mean")
+        np.testing.assert_array_equal(buckets, [0, 30, 90])
+        np.testing.assert_array_equal(means, [1.5, 5, 7])
+
+        _, maxes = downsample(times, values, 30, "max")
+        np.testing.assert_array_equal(maxes, [2, 6, 7])
+
+        with self.assertRaises(ValueError):
+            downsample(times, values, 30, "stddev")
+
+    def test_load_series(self):
+        lines = ["cpu,host=a usage_user=12.5,usage_system=1 "
+                 "1500000000000000000",
+                 "mem,host=a usage_user=99 1500000010000000000",
+                 "cpu,host=a usage_user=20i 1500000010000000000"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "series.lp")
+            with open(path, "w") as series_file:
+                series_file.write("\n".join(lines))
+            times, values = load_series(path, "cpu", "usage_user")
+
+            np.testing.assert_array_equal(times, [1500000000, 1500000010])
+            np.testing.assert_array_equal(values, [12.5, 20])
+
+            # Escaped separators in tags and spaces in string fields
+            lines = [r"cpu,host=web\ 1,role=a\,b usage_user=1.5,"
+                     r'note="busy, very busy" 1500000000000000000',
+                     r"cpu\ 2,host=a usage_user=9 1500000010000000000"]
+            with open(path, "w") as series_file:
+                series_file.write("\n".join(lines))
+            times, values = load_series(path, "cpu", "usage_user")
+            np.testing.assert_array_equal(values, [1.5])
+            _, values = load_series(path, "cpu 2", "usage_user")
+            np.testing.assert_array_equal(values, [9])
+
+            # Lines without a timestamp are rejected with the line number
+            with open(path, "w") as series_file:
+                series_file.write("cpu usage_user=1")
+            with self.assertRaisesRegex(ValueError, "Line 1"):
+                load_series(path, "cpu", "usage_user")
+
+            path = os.path.join(tmpdir, "series.csv")
+            with open(path, "w") as series_file:
+                series_file.write("name,time,usage_user\n"
+                                  "cpu,2017-07-14T02:40:00Z,1\n"
+                                  "cpu,1500000030000,2\n")
+            times, values = load_series(path, "cpu", "usage_user")
+
+            np.testing.assert_array_equal(times, [1500000000, 1500000030])
+
+    def test_replay(self):
+        # Quiet, then a 15 minute spike, then quiet again
+        values = [50] * 60 + [95] * 90 + [10] * 120
+
+        report = replay(self.metrics, self._series(values), units_min=1,
+                        units_max=3, provisioning_delay=120,
+                        unit_capacity=40)
+
+        self.assertEqual(report["units"]["min"], 1)
+        self.assertEqual(report["units"]["max"], 3)
+        latency = report["reaction_latency"]
+        self.assertEqual(latency["breaches"], 1)
+        # Rule period and provisioning delay
+        self.assertGreaterEqual(latency["mean"], 300 + 120)
+        provisioning = report["provisioning"]
+        self.assertGreater(provisioning["slo_violating_intervals"], 0)
+        self.assertGreater(provisioning["over_provisioned_unit_hours"], 0)
+
+    def test_replay_from_zero_units(self):
+        # Quiet, then a spike
+        values = [10] * 30 + [95] * 60
+
+        report = replay(self.metrics, self._series(values), units_min=0,
+                        units_max=1, initial_units=0)
+
+        # The only unit coming up answers the breach
+        latency = report["reaction_latency"]
+        self.assertEqual(latency["breaches"], 1)
+        self.assertEqual(latency["unanswered"], 0)
+
+    def test_replay_cooldown(self):
+        values = [95] * 360
+
+        report = replay(self.metrics, self._series(values), units_max=100)
+        self.metrics[0]["cooldown"] = 600
+        cooled = replay(self.metrics, self._series(values), units_max=100)
+
+        self.assertGreater(report["decisions"], cooled["decisions"])
+        self.assertNotIn("provisioning", report)
+
+    def test_replay_proportional(self):
+        values = [95] * 90
+
+        report = replay(self.metrics, self._series(values), initial_units=10,
+                        units_max=100)
+        # Doubles the pool on every decision rather than adding a unit
+        self.metrics[0]["rules"]["scale_out"].update(unit="factor", resize=2)
+        doubled = replay(self.metrics, self._series(values),
+                         initial_units=10, units_max=100)
+
+        self.assertEqual(report["units"]["max"], 10 + report["decisions"])
+        # 20, 40, 80 and then the maximum
+        self.assertEqual(doubled["decisions"], 4)
+        self.assertEqual(doubled["units"]["max"], 100)
+
+    def test_replay_step_limits(self):
+        values = [95] * 90
+        self.metrics[0]["rules"]["scale_out"]["resize"] = 5
+
+        report = replay(self.metrics, self._series(values), units_max=100)
+        limited = replay(self.metrics, self._series(values), units_max=100,
+                         max_step_out=2)
+        self.assertEqual(report["units"]["max"], 1 + 5 * report["decisions"])
+        self.assertEqual(limited["units"]["max"],
+                         1 + 2 * limited["decisions"])
+
+        # Proportional resizes are limited once resolved
+        self.metrics[0]["rules"]["scale_out"].update(unit="factor", resize=2)
+        doubled = replay(self.metrics, self._series(values),
+                         initial_units=10, units_max=100, max_step_out=3)
+        self.assertEqual(doubled["units"]["max"],
+                         10 + 3 * doubled["decisions"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+from requests.exceptions import ConnectionError
+import requests_mock
+import unittest
+import unittest.mock as mock
+
+from reactive.replicas import (check_replicas, healthy_replicas,
+                               read_replicas)
+from unit_tests.simulator.fakes import FakeInfluxdb
+
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.influxdb = FakeInfluxdb()
+
+    def test_read_replicas(self):
+        def _replicas(replicas):
+            return read_replicas({"metric_read_replicas": replicas},
+                                 self.influxdb)
+
+        self.assertEqual(_replicas(""), [("10.0.0.10", 8086)])
+        self.assertEqual(
+            _replicas("10.0.0.11, 10.0.0.12:8087 10.0.0.10:8086"),
+            [("10.0.0.10", 8086), ("10.0.0.11", 8086), ("10.0.0.12", 8087)])
+        self.assertRaises(ValueError, _replicas, "10.0.0.11:http")
+
+    @requests_mock.mock()
+    @mock.patch("charmhelpers.core.hookenv.log")
+    @mock.patch("reactive.replicas.unitdata")
+    def test_check_replicas(self, mock_req, mock_unitdata, mock_log):
+        kv = {}
+        mock_unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        mock_unitdata.kv.return_value.get.side_effect = kv.get
+
+        cfg = {"metric_read_replicas": "10.0.0.11 10.0.0.12",
+               "metric_replica_failover_pings": 2}
+        replicas = [("10.0.0.10", 8086), ("10.0.0.11", 8086),
+                    ("10.0.0.12", 8086)]
+        mock_req.get("http://10.0.0.10:8086/ping", status_code=204)
+        mock_req.get("http://10.0.0.11:8086/ping", exc=ConnectionError)
+        mock_req.get("http://10.0.0.12:8086/ping", status_code=204)
+
+        # Failed over after failing the pings in a row
+        self.assertEqual(check_replicas(cfg, self.influxdb), replicas)
+        self.assertFalse(mock_log.called)
+        self.assertEqual(check_replicas(cfg, self.influxdb),
+                         [("10.0.0.10", 8086), ("10.0.0.12", 8086)])
+        self.assertIn("10.0.0.11:8086", mock_log.call_args[0][0])
+
+        # Rendering reads the outcome back without pinging
+        pings = mock_req.call_count
+        self.assertEqual(healthy_replicas(cfg, self.influxdb),
+                         [("10.0.0.10", 8086), ("10.0.0.12", 8086)])
+        self.assertEqual(mock_req.call_count, pings)
+
+        # Back once it answers again
+        mock_req.get("http://10.0.0.11:8086/ping", status_code=204)
+        self.assertEqual(check_replicas(cfg, self.influxdb), replicas)
+
+        # A single failed ping isn't enough
+        mock_req.get("http://10.0.0.12:8086/ping", exc=ConnectionError)
+        self.assertEqual(check_replicas(cfg, self.influxdb), replicas)
+        mock_req.get("http://10.0.0.12:8086/ping", status_code=204)
+        check_replicas(cfg, self.influxdb)
+        mock_req.get("http://10.0.0.12:8086/ping", exc=ConnectionError)
+        self.assertEqual(check_replicas(cfg, self.influxdb), replicas)
+
+        # Without any healthy replica they are all kept
+        mock_req.get("http://10.0.0.10:8086/ping", status_code=500)
+        mock_req.get("http://10.0.0.11:8086/ping", exc=ConnectionError)
+        check_replicas(cfg, self.influxdb)
+        self.assertEqual(check_replicas(cfg, self.influxdb), replicas)
+
+        # A single InfluxDB isn't pinged
+        pings = mock_req.call_count
+        single = dict(cfg, metric_read_replicas="")
+        self.assertEqual(check_replicas(single, self.influxdb),
+                         [("10.0.0.10", 8086)])
+        self.assertEqual(mock_req.call_count, pings)
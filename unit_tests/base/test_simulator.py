@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+import json
+import os
+import time
+import unittest
+import unittest.mock as mock
+
+from unit_tests.simulator import (Simulation, default_metrics, deploy,
+                                  reconfigure, report)
+
+
+class TestSimulator(unittest.TestCase):
+    def test_deploy(self):
+        with Simulation() as simulation:
+            deploy(simulation)
+            reconfigure(simulation, scaling_units_max=5)
+
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+            reached = [timing.state for timing in simulation.states]
+            for state in simulation.charmscaler.states:
+                self.assertIn(state, reached)
+
+            self.assertEqual(
+                simulation.autoscaler_api.instances["charmscaler-0"]["state"],
+                "STARTED")
+            for container in ("autoscaler", "charmpool"):
+                self.assertTrue(simulation.engine.containers[container]
+                                ["State"]["Running"])
+            # The historian's retention policy is opt-in
+            self.assertNotIn("SHOW DATABASES", simulation.influxdb.statements)
+
+            # One timing per hook, handler timings within the hook timings
+            self.assertEqual(len(simulation.hooks), 6)
+            self.assertLessEqual(
+                sum(timing.seconds for timing in simulation.handlers),
+                sum(timing.seconds for timing in simulation.hooks))
+            self.assertIn("db-api-relation-changed", report(simulation))
+
+    def test_warm_restart(self):
+        with Simulation() as simulation:
+            deploy(simulation)
+            requests = len(simulation.autoscaler_api.requests)
+
+            # Lose the unit state but keep the persisted Autoscaler instance
+            simulation.reset_unit_state()
+            deploy(simulation)
+
+            self.assertEqual(simulation.status, ("active", "Available"))
+            # The instance is neither reconfigured nor restarted
+            paths = [path for method, path in
+                     simulation.autoscaler_api.requests[requests:]
+                     if method == "POST"]
+            self.assertEqual(paths, ["/autoscaler/instances"])
+
+    def test_hot_standby(self):
+        with Simulation(leader=False) as simulation:
+            simulation.leader_settings["active_unit"] = "charmscaler/1"
+            deploy(simulation)
+            instance = simulation.autoscaler_api.instances["charmscaler-0"]
+
+            # Configured but not started
+            self.assertEqual(simulation.status, ("active", "Standby"))
+            self.assertIsNotNone(instance["config"])
+            self.assertEqual(instance["state"], "STOPPED")
+
+            # Elected, but the previous leader is still the active unit until
+            # leader-elected has run
+            simulation.leader = True
+            simulation.hook("update-status")
+            self.assertEqual(instance["state"], "STOPPED")
+
+            # Promoted, only the start is needed
+            requests = len(simulation.autoscaler_api.requests)
+            simulation.hook("leader-elected")
+
+            self.assertEqual(simulation.leader_settings["active_unit"],
+                             "charmscaler/0")
+            self.assertEqual(simulation.status, ("active", "Available"))
+            self.assertEqual(instance["state"], "STARTED")
+            paths = [path for method, path in
+                     simulation.autoscaler_api.requests[requests:]
+                     if method == "POST"]
+            self.assertEqual(paths, ["/autoscaler/instances/charmscaler-0/"
+                                     "start"])
+
+            # Another unit has taken over and set itself as the active unit
+            simulation.leader = False
+            simulation.leader_settings["active_unit"] = "charmscaler/1"
+            simulation.hook("leader-settings-changed")
+            self.assertEqual(instance["state"], "STOPPED")
+            self.assertEqual(simulation.status, ("active", "Standby"))
+
+    def test_docker_engine_error(self):
+        with Simulation() as simulation:
+            image = "{}:{}".format(simulation.cfg["charmpool_image"],
+                                   simulation.cfg["charmpool_version"])
+            simulation.engine.unpullable.add(image)
+            deploy(simulation)
+
+            status, msg = simulation.status
+            self.assertEqual(status, "blocked")
+            self.assertIn("pull access denied", msg)
+            self.assertNotIn("charmpool", simulation.engine.containers)
+
+            # Composed once the image can be pulled
+            simulation.engine.unpullable.clear()
+            simulation.hook("update-status")
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_async_convergence(self):
+        with Simulation(config={"async_convergence": True}) as simulation:
+            simulation.engine.health = "starting"
+            deploy(simulation)
+
+            # The hooks didn't wait for the containers
+            self.assertEqual(simulation.status,
+                             ("maintenance", "Waiting for charmpool, "
+                              "autoscaler to start"))
+            self.assertEqual(simulation.autoscaler_api.requests, [])
+
+            # The worker's update-status, once the containers are healthy
+            for container in simulation.engine.containers.values():
+                container["State"]["Health"]["Status"] = "healthy"
+            simulation.hook("update-status")
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_metric_scope(self):
+        with Simulation(config={"metric_scope": "units"}) as simulation:
+            deploy(simulation)
+            instance = simulation.autoscaler_api.instances["charmscaler-0"]
+
+            def _where():
+                streamer = instance["config"]["monitoringSubsystem"][
+                    "metricStreamers"][0]
+                return streamer["config"]["metricStreams"][0]["query"][
+                    "where"]
+
+            self.assertEqual(_where(), "\"juju_unit\" = 'scalable-app/0'")
+
+            # The started instance follows the units of the application
+            scalable_charm = simulation.relations["scalable-charm.available"]
+            scalable_charm.units["scalable-app/1"] = "10.0.0.21"
+            simulation.hook("scalable-charm-relation-joined")
+
+            self.assertIn("'scalable-app/1'", _where())
+            self.assertEqual(instance["state"], "STARTED")
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_metric_streamer_shards(self):
+        config = {"metric_streamer_shards": 2, "metric_shard_by": "hash",
+                  # Nothing listens on the replica
+                  "metric_read_replicas": "127.0.0.1:1"}
+        with Simulation(config=config,
+                        metrics=default_metrics(8)) as simulation:
+            deploy(simulation)
+            instance = simulation.autoscaler_api.instances["charmscaler-0"]
+            streamers = instance["config"]["monitoringSubsystem"][
+                "metricStreamers"]
+
+            def _ports():
+                streamers = instance["config"]["monitoringSubsystem"][
+                    "metricStreamers"]
+                return [streamer["config"]["port"] for streamer in streamers]
+
+            self.assertEqual(len(streamers), 2)
+            self.assertEqual(sum(len(streamer["config"]["metricStreams"])
+                                 for streamer in streamers), 8)
+            self.assertEqual(_ports(), [simulation.influxdb.port, 1])
+
+            # Both shards fail over to the InfluxDB of the relation once the
+            # replica has failed its pings in a row, the deployment ran the
+            # first update-status
+            simulation.hook("update-status")
+            self.assertEqual(_ports(), [simulation.influxdb.port, 1])
+            simulation.hook("update-status")
+            self.assertEqual(_ports(), [simulation.influxdb.port] * 2)
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_proportional_resize(self):
+        metrics = default_metrics()
+        metrics[0]["rules"]["scale_out"].update(unit="percent", resize=50)
+        with Simulation(metrics=metrics) as simulation:
+            deploy(simulation)
+            instance = simulation.autoscaler_api.instances["charmscaler-0"]
+
+            def _resize():
+                predictor = instance["config"]["predictionSubsystem"][
+                    "predictors"][0]
+                return [rule["resize"] for rule in
+                        predictor["parameters"]["scalingRules"]
+                        if rule["condition"] == "ABOVE"][0]
+
+            self.assertEqual(_resize(), 1)
+
+            # The resize follows the units of the application
+            scalable_charm = simulation.relations["scalable-charm.available"]
+            for i in range(1, 4):
+                scalable_charm.units["scalable-app/{}".format(i)] = \
+                    "10.0.0.{}".format(20 + i)
+            simulation.hook("scalable-charm-relation-joined")
+
+            self.assertEqual(_resize(), 2)
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_config_settle_window(self):
+        with Simulation(config={"config_settle_window": 30}) as simulation:
+            deploy(simulation)
+            api = simulation.autoscaler_api
+            requests = len(api.requests)
+
+            for units in range(11, 21):
+                reconfigure(simulation, scaling_units_max=units)
+
+            # Nothing applied yet, a few timers cover the burst
+            self.assertEqual(api.requests[requests:], [])
+            self.assertEqual(simulation.status[0], "maintenance")
+            self.assertEqual(len(simulation.timers), 1)
+
+            with mock.patch("time.time", return_value=time.time() + 31):
+                simulation.hook("update-status")
+
+            configs = [path for method, path in api.requests[requests:]
+                       if path.endswith("/config")]
+            self.assertEqual(len(configs), 1)
+            self.assertIn('"max": 20', json.dumps(
+                api.instances["charmscaler-0"]["config"]))
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_settle_window_units(self):
+        with Simulation(config={"config_settle_window": 30,
+                                "metric_scope": "units"}) as simulation:
+            deploy(simulation)
+            api = simulation.autoscaler_api
+            requests = len(api.requests)
+
+            # Units joining in a burst are applied together as well
+            scalable_charm = simulation.relations["scalable-charm.available"]
+            for i in range(1, 4):
+                scalable_charm.units["scalable-app/{}".format(i)] = \
+                    "10.0.0.{}".format(20 + i)
+                simulation.hook("scalable-charm-relation-joined")
+
+            self.assertEqual(api.requests[requests:], [])
+            self.assertEqual(simulation.status[0], "maintenance")
+
+            with mock.patch("time.time", return_value=time.time() + 31):
+                simulation.hook("update-status")
+
+            configs = [path for method, path in api.requests[requests:]
+                       if path.endswith("/config")]
+            self.assertEqual(len(configs), 1)
+            self.assertIn("'scalable-app/3'", json.dumps(
+                api.instances["charmscaler-0"]["config"]))
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+    def test_supervisor(self):
+        with Simulation(config={"supervisor_enabled": True,
+                                "supervisor_max_restarts": 2}) as simulation:
+            deploy(simulation)
+            api = simulation.autoscaler_api
+
+            def _crash():
+                container = simulation.engine.containers["autoscaler"]
+                container["State"]["Running"] = False
+                simulation.engine.logs["autoscaler"] = [
+                    b"java.lang.OutOfMemoryError\n"]
+                api.instances.clear()
+
+            # The crashed Autoscaler is restarted and its instance driven
+            # back to started within the same hook
+            _crash()
+            simulation.hook("update-status")
+            self.assertIn(("POST", "/containers/autoscaler/restart"),
+                          simulation.engine.requests)
+            self.assertEqual(api.instances["charmscaler-0"]["state"],
+                             "STARTED")
+            self.assertEqual(simulation.status, ("active", "Available"))
+
+            with open(os.path.join(simulation.tmpdir, "supervisor",
+                                   "autoscaler.log")) as crash_log:
+                self.assertIn("OutOfMemoryError", crash_log.read())
+
+            # Backing off, then a crash loop once restarted too often
+            _crash()
+            simulation.hook("update-status")
+            self.assertNotIn("charmscaler-0", api.instances)
+
+            with mock.patch("time.time", return_value=time.time() + 60):
+                simulation.hook("update-status")
+            self.assertEqual(api.instances["charmscaler-0"]["state"],
+                             "STARTED")
+
+            _crash()
+            with mock.patch("time.time", return_value=time.time() + 120):
+                simulation.hook("update-status")
+            self.assertEqual(simulation.status[0], "blocked")
+            self.assertIn("Crash loop", simulation.status[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
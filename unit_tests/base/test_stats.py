@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import unittest
+
+from reactive.stats import (FIELDS, project_fields, resource_usage,
+                            stats_summary, summarize)
+
+
+def _sample(second, cpu, system, memory, rx, read):
+    return {
+        "read": "2018-01-01T00:00:{:02d}.123456789Z".format(second),
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": cpu},
+            "system_cpu_usage": system,
+            "online_cpus": 2
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": cpu - 100},
+            "system_cpu_usage": system - 1000
+        },
+        "memory_stats": {
+            "usage": memory + 50,
+            "limit": 1000,
+            "stats": {"cache": 50, "rss": memory - 10}
+        },
+        "networks": {
+            "eth0": {"rx_bytes": rx, "tx_bytes": 0}
+        },
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"op": "Read", "value": read},
+                {"op": "Write", "value": 0}
+            ]
+        }
+    }
+
+
+class TestStats(unittest.TestCase):
+    samples = [
+        _sample(0, 1000, 10000, 100, 0, 0),
+        _sample(1, 2000, 20000, 200, 100, 10),
+        _sample(3, 3000, 30000, 300, 500, 10),
+        # Stopped container
+        {"read": "2018-01-01T00:00:04Z", "memory_stats": {}}
+    ]
+
+    def test_resource_usage(self):
+        usage = resource_usage(self.samples)
+        self.assertEqual(usage["cpu-percent"], [20.0, 20.0, 20.0])
+        self.assertEqual(usage["memory-usage"], [100, 200, 300])
+        self.assertEqual(usage["memory-rss"], [90, 190, 290])
+        self.assertEqual(usage["memory-percent"], [10.0, 20.0, 30.0])
+        # Rates between consecutive samples
+        self.assertEqual(usage["network-rx-rate"], [100.0, 200.0])
+        self.assertEqual(usage["block-read-rate"], [10.0, 0.0])
+
+    def test_summarize(self):
+        self.assertIsNone(summarize([]))
+        self.assertEqual(summarize([3, 1, 2]), {"min": 1, "mean": 2, "p95": 3})
+        self.assertEqual(summarize(list(range(1, 101)))["p95"], 95)
+
+    def test_fields(self):
+        self.assertEqual(project_fields(""), FIELDS)
+        self.assertEqual(project_fields("network cpu-percent"), (
+            "cpu-percent", "network-rx-rate", "network-tx-rate"))
+        self.assertRaises(ValueError, project_fields, "disk")
+
+        summary = stats_summary(self.samples, project_fields("cpu"))
+        self.assertEqual(list(summary.keys()), ["cpu-percent"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+import unittest.mock as mock
+
+from reactive.supervisor import CrashLoopException, Supervisor
+
+CFG = {
+    "supervisor_enabled": True,
+    "supervisor_max_restarts": 3,
+    "supervisor_restart_window": 600,
+    "supervisor_backoff": 10,
+    "supervisor_log_lines": 100
+}
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        def _patch(target):
+            patcher = mock.patch(target)
+            self.addCleanup(patcher.stop)
+            return patcher.start()
+
+        _patch("reactive.supervisor.hookenv")
+        self.engine = _patch("reactive.supervisor.get_engine").return_value
+
+        # Restart times are kept in a dict rather than the unit data store
+        self.store = {}
+        kv = _patch("reactive.supervisor.unitdata").kv.return_value
+        kv.get.side_effect = lambda key, default=None: self.store.get(
+            key, default)
+        kv.set.side_effect = self.store.__setitem__
+
+        self.supervisor = Supervisor(CFG)
+        self.supervisor.capture_logs = mock.MagicMock()
+        self.component = mock.MagicMock()
+        self.component.name = "autoscaler"
+
+    def test_unhealthy(self):
+        components = []
+        for status in ("healthy", "starting", "unhealthy"):
+            component = mock.MagicMock()
+            component.health_status.return_value = status
+            components.append(component)
+
+        # Starting containers are left alone
+        self.assertEqual(self.supervisor.unhealthy(components),
+                         components[2:])
+
+    def test_backoff(self):
+        self.assertEqual(self.supervisor.delay([]), 0)
+        self.assertEqual(self.supervisor.delay([0, 1, 2]), 40)
+        self.assertEqual(self.supervisor.delay(list(range(10))), 300)
+
+        self.assertTrue(self.supervisor.restart(self.component, now=1000))
+        self.assertTrue(self.supervisor.capture_logs.called)
+        self.engine.restart.assert_called_once_with("autoscaler")
+
+        # Backing off for 10 seconds, then 20 seconds
+        self.assertFalse(self.supervisor.restart(self.component, now=1005))
+        self.assertTrue(self.supervisor.restart(self.component, now=1010))
+        self.assertFalse(self.supervisor.restart(self.component, now=1020))
+        self.assertTrue(self.supervisor.restart(self.component, now=1030))
+        self.assertEqual(self.engine.restart.call_count, 3)
+
+        # Three restarts within the window
+        with self.assertRaises(CrashLoopException):
+            self.supervisor.restart(self.component, now=1100)
+
+        # Restarts which have left the window no longer count
+        self.assertTrue(self.supervisor.restart(self.component, now=1605))
+        self.assertEqual(self.supervisor.restarts(self.component, now=1605),
+                         [1010, 1030, 1605])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import unittest
+import unittest.mock as mock
+
+from reactive.juju_api import JujuAPI, WebSocket
+from reactive import warmpool
+from unit_tests.simulator.fakes import FakeJujuController
+
+CFG = {"warm_spare_machines": 2, "warm_spare_constraints": "mem=4G cores=2",
+       "lifecycle_enabled": True}
+
+
+class TestWarmPool(unittest.TestCase):
+    def setUp(self):
+        self.controller = FakeJujuController(units=["app/0", "app/1"]).start()
+        self.addCleanup(self.controller.stop)
+
+        self.api = JujuAPI(WebSocket("127.0.0.1", self.controller.port,
+                                     "/model/1234/api"))
+        self.api.login("admin", "secret")
+        self.addCleanup(self.api.close)
+
+        self.leader_settings = {}
+        for patcher in [
+                mock.patch("charmhelpers.core.hookenv.leader_get",
+                           self.leader_settings.get),
+                mock.patch("charmhelpers.core.hookenv.leader_set",
+                           self.leader_settings.update),
+                mock.patch("charmhelpers.core.hookenv.log")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _requests(self, method):
+        return [request["params"] for request in self.controller.requests
+                if "{}.{}".format(request["type"],
+                                  request["request"]) == method]
+
+    def test_parse_constraints(self):
+        self.assertEqual(warmpool.parse_constraints(
+            "mem=4G root-disk=20480 cpu-cores=2 tags=a,b arch=amd64 "
+            "allocate-public-ip=true"), {
+                "mem": 4096, "root-disk": 20480, "cores": 2,
+                "tags": ["a", "b"], "arch": "amd64",
+                "allocate-public-ip": True})
+        self.assertEqual(warmpool.parse_constraints(""), {})
+        self.assertRaises(ValueError, warmpool.parse_constraints, "mem")
+        self.assertRaises(ValueError, warmpool.parse_constraints, "mem=lots")
+
+    def test_replenish(self):
+        self.assertEqual(warmpool.replenish(CFG, self.api), ["2", "3"])
+        self.assertEqual(warmpool.spares(), ["2", "3"])
+        self.assertEqual(self._requests("MachineManager.AddMachines")[0][
+            "params"][0]["constraints"], {"mem": 4096, "cores": 2})
+
+        # Nothing to do while the spares are there
+        requests = len(self.controller.requests)
+        warmpool.replenish(CFG, self.api)
+        self.assertEqual(len(self.controller.requests), requests + 1)
+
+        # Used and removed spares are replaced
+        self.controller.units["app/2"] = "2"
+        self.controller.machines.remove("3")
+        self.assertEqual(warmpool.replenish(CFG, self.api), ["4", "5"])
+
+        # Surplus spares are destroyed, all of them once disabled
+        self.assertEqual(warmpool.replenish(
+            dict(CFG, warm_spare_machines=1), self.api), ["4"])
+        self.assertEqual(self.controller.machines, ["0", "1", "2", "4"])
+        self.assertEqual(warmpool.replenish(
+            dict(CFG, lifecycle_enabled=False), self.api), [])
+        self.assertEqual(self.controller.machines, ["0", "1", "2"])
+
+        # Not even the status is fetched without spares
+        requests = len(self.controller.requests)
+        warmpool.replenish(dict(CFG, warm_spare_machines=0), self.api)
+        self.assertEqual(len(self.controller.requests), requests)
+
+    def test_place(self):
+        warmpool.replenish(CFG, self.api)
+        notice = {"id": "1-1", "units": 3, "size": 5, "at": 0}
+
+        # As many units as there are spares, the rest are misses
+        self.assertEqual(warmpool.place(self.api, "app", notice), 2)
+        self.assertEqual(self.controller.units,
+                         {"app/0": "0", "app/1": "1", "app/2": "2",
+                          "app/3": "3"})
+        self.assertEqual(warmpool.spares(), [])
+
+        # A notice is placed once
+        self.assertEqual(warmpool.place(self.api, "app", notice), 0)
+
+        # Spares which are gone are skipped
+        warmpool.replenish(CFG, self.api)
+        self.controller.machines.remove("4")
+        self.assertEqual(warmpool.place(
+            self.api, "app", dict(notice, id="1-2", units=2)), 1)
+        self.assertEqual(self.controller.units["app/4"], "5")
+        self.assertEqual(warmpool.spares(), [])
+
+        self.assertEqual(warmpool.report(), {
+            "spares": 0, "hits": 3, "misses": 2, "hit-ratio": "0.60"})
+
+    def test_report(self):
+        self.assertEqual(warmpool.report(), {
+            "spares": 0, "hits": 0, "misses": 0, "hit-ratio": "n/a"})
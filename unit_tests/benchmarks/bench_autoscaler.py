@@ -0,0 +1,22 @@
+import pytest
+
+from reactive.autoscaler import (_validate_metrics, analyze_scaling_rules,
+                                 autoscaler_config)
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.mark.benchmark(group="autoscaler_config")
+def test_autoscaler_config(benchmark, cfg, influxdb, metrics):
+    config = benchmark(autoscaler_config, cfg, influxdb, metrics)
+    assert len(config["metrics"]) == len(metrics)
+
+
+@pytest.mark.benchmark(group="validate_metrics")
+def test_validate_metrics(benchmark, metrics):
+    benchmark(_validate_metrics, metrics)
+
+
+@pytest.mark.benchmark(group="analyze_scaling_rules")
+def test_analyze_scaling_rules(benchmark, cfg, metrics):
+    assert benchmark(analyze_scaling_rules, cfg, metrics) == []
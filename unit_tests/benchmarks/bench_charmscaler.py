@@ -0,0 +1,38 @@
+import importlib
+import unittest.mock as mock
+
+import pytest
+
+from charmhelpers.core import hookenv
+
+from reactive.alertrelay import AlertRelay
+from reactive.autoscaler import Autoscaler
+from reactive.charmpool import Charmpool
+from reactive.component import ConfigComponent
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture
+def charmscaler(charm, cfg):
+    with mock.patch.object(hookenv, "config", lambda: cfg):
+        module = importlib.import_module("reactive.charmscaler")
+
+    components = [mock.MagicMock(spec=AlertRelay),
+                  mock.MagicMock(spec=Charmpool),
+                  mock.MagicMock(spec=Autoscaler)]
+    with mock.patch.object(module, "components", components):
+        yield module
+
+
+@pytest.mark.benchmark(group="_execute")
+@pytest.mark.parametrize("pre_healthcheck", [True, False])
+def test_execute(benchmark, charmscaler, pre_healthcheck):
+    assert benchmark(charmscaler._execute, "compose_stop",
+                     pre_healthcheck=pre_healthcheck)
+
+
+@pytest.mark.benchmark(group="_execute_classinfo")
+def test_execute_classinfo(benchmark, charmscaler, cfg, influxdb):
+    assert benchmark(charmscaler._execute, "configure", cfg, influxdb, [],
+                     classinfo=ConfigComponent)
@@ -0,0 +1,42 @@
+import pytest
+
+from reactive.autoscaler import autoscaler_config
+from reactive.config import Config
+from reactive.helpers import data_changed
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture
+def config(charm, cfg, influxdb, metrics):
+    """
+    The Autoscaler's config, the largest config the charm renders.
+    """
+    config = Config("config.json", "autoscaler")
+    config.extend(autoscaler_config, cfg, influxdb, metrics)
+    config.render()
+    return config
+
+
+@pytest.mark.benchmark(group="render")
+def test_render(benchmark, config):
+    benchmark(config.render)
+
+
+@pytest.mark.benchmark(group="has_changed")
+def test_has_changed(benchmark, config):
+    config.commit()
+    assert not benchmark(config.has_changed)
+
+
+@pytest.mark.benchmark(group="commit")
+def test_commit(benchmark, config):
+    benchmark(config.commit)
+    assert not config.has_changed()
+
+
+@pytest.mark.benchmark(group="data_changed")
+def test_data_changed(benchmark, config):
+    with config.open() as config_file:
+        data = config_file.read()
+    assert benchmark(data_changed, config.unitdata_key, data)
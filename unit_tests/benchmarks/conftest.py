@@ -0,0 +1,95 @@
+import grp
+import os
+import pwd
+import shutil
+import tempfile
+import unittest.mock as mock
+
+import pytest
+
+from charmhelpers.core import hookenv, host, unitdata
+from charmhelpers.core.templating import render
+
+from unit_tests.simulator import CHARM_DIR, charm_config, default_metrics
+from unit_tests.simulator.fakes import FakeInfluxdb
+
+# Number of metric definitions the size dependent benchmarks are run with.
+METRIC_COUNTS = (10, 100, 1000)
+
+
+@pytest.fixture
+def charm():
+    """
+    A charm directory with the charm's templates and a unit data store of its
+    own, Juju's logging is silenced.
+
+    :returns: Path to the charm directory
+    """
+    tmpdir = tempfile.mkdtemp(prefix="charmscaler-benchmark-")
+    charm_dir = os.path.join(tmpdir, "charm")
+    os.makedirs(charm_dir)
+    os.symlink(os.path.join(CHARM_DIR, "templates"),
+               os.path.join(charm_dir, "templates"))
+
+    user = pwd.getpwuid(os.getuid()).pw_name
+    group = grp.getgrgid(os.getgid()).gr_name
+
+    def _render(source, target, context, **kwargs):
+        kwargs.update(owner=user, group=group, perms=0o644)
+        return render(source, target, context, **kwargs)
+
+    def _reset_kv():
+        if unitdata._KV is not None:
+            unitdata._KV.close()
+        unitdata._KV = None
+
+    with mock.patch.dict(os.environ, {
+            "CHARM_DIR": charm_dir,
+            "JUJU_UNIT_NAME": "charmscaler/0",
+            "UNIT_STATE_DB": os.path.join(tmpdir, ".unit-state.db")}), \
+            mock.patch.object(hookenv, "log", lambda *a, **kw: None), \
+            mock.patch.object(host, "log", lambda *a, **kw: None), \
+            mock.patch("reactive.config.render", _render):
+        _reset_kv()
+        try:
+            yield charm_dir
+        finally:
+            _reset_kv()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@pytest.fixture
+def cfg():
+    return charm_config()
+
+
+@pytest.fixture
+def influxdb():
+    return FakeInfluxdb()
+
+
+@pytest.fixture(params=METRIC_COUNTS, ids="{}-metrics".format)
+def metrics(request):
+    return default_metrics(request.param)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    """
+    Add the mean time per metric definition of the size dependent benchmarks
+    to the saved results. A per metric cost which grows with the number of
+    metrics means that the charm-side cost grows superlinearly.
+    """
+    scaling = {}
+    for bench in output_json["benchmarks"]:
+        count = (bench.get("params") or {}).get("metrics")
+        if not count:
+            continue
+        per_metric = bench["stats"]["mean"] / count
+        scaling.setdefault(bench["group"], {})[str(count)] = per_metric
+
+    for costs in scaling.values():
+        counts = sorted(costs, key=int)
+        costs["growth"] = costs[counts[-1]] / costs[counts[0]]
+
+    output_json["scaling"] = scaling
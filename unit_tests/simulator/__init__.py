@@ -0,0 +1,406 @@
+"""
+Offline simulator for the CharmScaler's reactive handlers.
+
+The handlers in reactive/charmscaler.py are dispatched by charms.reactive, just
+like in a deployed unit, while Juju, the Docker daemon, the Autoscaler REST API
+and the relation data are replaced by local stand-ins. Each hook is timed, as
+well as every handler invocation and the point in time at which each of the
+charm's states is reached.
+"""
+from collections import namedtuple
+from contextlib import ExitStack
+import grp
+import importlib
+import os
+import pwd
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest.mock as mock
+
+import yaml
+
+from charmhelpers.core import host, hookenv, unitdata
+from charmhelpers.core.templating import render
+from charms.reactive import bus, remove_state, set_state
+from charms.reactive import decorators as reactive_decorators
+
+from reactive import (autoscaler, debounce, docker_engine, lifecycle,
+                      supervisor)
+from reactive.docker_engine import DockerEngine
+from unit_tests.simulator.fakes import (FakeAutoscaler, FakeEngine,
+                                        FakeInfluxdb, FakeInfluxdbServer,
+                                        FakeScalableCharm)
+
+CHARM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                         os.pardir, os.pardir))
+
+HookTiming = namedtuple("HookTiming", ["hook", "seconds"])
+StateTiming = namedtuple("StateTiming", ["hook", "state", "seconds"])
+HandlerTiming = namedtuple("HandlerTiming", ["hook", "handler", "seconds"])
+
+
+def default_metrics(count=1):
+    """
+    Metric definitions, as provided by the charm layers built on top of this
+    one.
+
+    :param count: Number of metrics
+    :type count: int
+    :returns: list of metric definitions
+    """
+    return [{
+        "name": "cpu_{}".format(i),
+        "database": "telegraf",
+        "tag": "cpu",
+        "field": "usage_user",
+        "aggregate_function": "mean",
+        "downsample": 30,
+        "data_settling": 30,
+        "cooldown": 600,
+        "rules": {
+            "scale_out": {
+                "condition": "ABOVE",
+                "threshold": 80,
+                "period": 300,
+                "resize": 1
+            },
+            "scale_in": {
+                "condition": "BELOW",
+                "threshold": 20,
+                "period": 300,
+                "resize": -1
+            }
+        }
+    } for i in range(count)]
+
+
+def charm_config(**overrides):
+    """
+    The charm config with the defaults from config.yaml and values for the
+    options which have no defaults.
+    """
+    with open(os.path.join(CHARM_DIR, "config.yaml")) as config_file:
+        options = yaml.safe_load(config_file)["options"]
+
+    cfg = {key: option.get("default") for key, option in options.items()}
+    cfg.update({
+        "juju_api_endpoint": "10.0.0.1:17070",
+        "juju_ca_cert": "Y2VydGlmaWNhdGU=",
+        "juju_model_uuid": "00000000-0000-0000-0000-000000000000",
+        "juju_username": "admin",
+        "juju_password": "secret",
+        "autoscaler_image": "elastisys/autoscaler-server",
+        "autoscaler_version": "latest",
+        "charmpool_image": "elastisys/charmpool",
+        "charmpool_version": "latest"
+    })
+    cfg.update(overrides)
+    return cfg
+
+
+class Simulation:
+    """
+    Context manager which sets up the stand-ins and loads the reactive
+    handlers. Use :meth:`hook` to run hooks against it.
+
+    :param config: Charm config overrides
+    :type config: dict
+    :param metrics: Metric definitions, see :func:`default_metrics`
+    :type metrics: list
+    :param leader: Whether the unit is the leader, can be changed between
+                   hooks
+    :type leader: bool
+    """
+    def __init__(self, config=None, metrics=None, leader=True):
+        self.config = config or {}
+        self.metrics = default_metrics() if metrics is None else metrics
+        self.leader = leader
+        self.leader_settings = {}
+
+        self.hooks = []
+        self.states = []
+        self.handlers = []
+        self.statuses = []
+        self.timers = []
+
+        self._hook = None
+        self._hook_start = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        try:
+            self._setup()
+        except Exception:
+            self._stack.close()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    def _setup(self):
+        stack = self._stack
+
+        self.tmpdir = tempfile.mkdtemp(prefix="charmscaler-simulator-")
+        stack.callback(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+        charm_dir = os.path.join(self.tmpdir, "charm")
+        os.makedirs(charm_dir)
+        os.symlink(os.path.join(CHARM_DIR, "templates"),
+                   os.path.join(charm_dir, "templates"))
+
+        self.engine = FakeEngine(os.path.join(self.tmpdir, "docker.sock"))
+        self.engine.start()
+        stack.callback(self.engine.stop)
+
+        self.autoscaler_api = FakeAutoscaler().start()
+        stack.callback(self.autoscaler_api.stop)
+
+        self.influxdb = FakeInfluxdbServer().start()
+        stack.callback(self.influxdb.stop)
+
+        self.cfg = charm_config(port_autoscaler=self.autoscaler_api.port,
+                                **self.config)
+
+        scalable_charm = FakeScalableCharm()
+        self.relations = {
+            "scalable-charm.available": scalable_charm,
+            "db-api.available": FakeInfluxdb(hostname="127.0.0.1",
+                                             port=self.influxdb.port)
+        }
+
+        stack.enter_context(mock.patch.dict(os.environ, {
+            "CHARM_DIR": charm_dir,
+            "JUJU_UNIT_NAME": "charmscaler/0",
+            "UNIT_STATE_DB": os.path.join(self.tmpdir, ".unit-state.db")
+        }))
+        self._reset_kv()
+        stack.callback(self._reset_kv)
+
+        client = DockerEngine(self.engine.server_address)
+        stack.callback(client.close)
+
+        metrics_module = types.ModuleType("reactive.charmscaler_metrics")
+        metrics_module.get_metrics = lambda: self.metrics
+
+        user = pwd.getpwuid(os.getuid()).pw_name
+        group = grp.getgrgid(os.getgid()).gr_name
+
+        def _render(source, target, context, **kwargs):
+            # Rendered files are owned by whoever runs the simulation
+            kwargs.update(owner=user, group=group, perms=0o644)
+            return render(source, target, context, **kwargs)
+
+        for patch in (
+                mock.patch.object(hookenv, "config", lambda: self.cfg),
+                mock.patch.object(hookenv, "is_leader", lambda: self.leader),
+                mock.patch.object(hookenv, "leader_get", self._leader_get),
+                mock.patch.object(hookenv, "leader_set", self._leader_set),
+                mock.patch.object(hookenv, "log", lambda *a, **kw: None),
+                mock.patch.object(host, "log", lambda *a, **kw: None),
+                mock.patch.object(hookenv, "status_set", self._status_set),
+                mock.patch.object(hookenv, "application_version_set",
+                                  lambda version: None),
+                mock.patch.object(hookenv, "remote_service_name",
+                                  lambda relid=None: "scalable-app"),
+                mock.patch.object(hookenv, "related_units",
+                                  scalable_charm.related_units),
+                mock.patch.object(hookenv, "relation_get",
+                                  scalable_charm.relation_get),
+                mock.patch.object(reactive_decorators, "endpoint_from_flag",
+                                  self.relations.get),
+                mock.patch.object(reactive_decorators, "endpoint_from_name",
+                                  lambda name: None),
+                mock.patch.object(bus.Handler, "invoke",
+                                  self._timed_invoke(bus.Handler.invoke)),
+                mock.patch.object(docker_engine, "_engine", client),
+                mock.patch.object(autoscaler, "STORAGE_DIR",
+                                  os.path.join(self.tmpdir, "storage")),
+                mock.patch.object(supervisor, "CRASH_LOG_DIR",
+                                  os.path.join(self.tmpdir, "supervisor")),
+                mock.patch.object(lifecycle, "STATE_DIR",
+                                  os.path.join(self.tmpdir, "lifecycle")),
+                mock.patch.object(debounce, "spawn_timer", self._spawn_timer),
+                mock.patch("reactive.config.render", _render),
+                mock.patch.dict(sys.modules, {
+                    "reactive.charmscaler_metrics": metrics_module
+                })):
+            stack.enter_context(patch)
+
+        self.charmscaler = self._load_handlers()
+        stack.callback(bus.Handler.clear)
+
+        for name, value in (
+                ("_prepare_volume_directories", lambda: None),
+                ("configure_logrotate", lambda cfg: None),
+                ("remove_logrotate", lambda: None),
+                ("configure_supervisor", lambda cfg: None),
+                ("remove_supervisor", lambda: None),
+                ("configure_lifecycle_trigger", lambda cfg: None),
+                ("remove_lifecycle_trigger", lambda: None),
+                ("spawn_worker", lambda names: None),
+                ("set_state", self._timed_set_state),
+                ("RelationBase", types.SimpleNamespace(
+                    from_state=self.relations.get))):
+            stack.enter_context(mock.patch.object(self.charmscaler, name,
+                                                  value))
+
+    def _spawn_timer(self, delay):
+        # The simulation runs the update-status hook itself
+        self.timers.append(delay)
+        unitdata.kv().set(debounce.TIMER_DUE_KEY, time.time() + delay)
+
+    def _reset_kv(self):
+        if unitdata._KV is not None:
+            unitdata._KV.close()
+        unitdata._KV = None
+
+    def _load_handlers(self):
+        # Handlers are registered when the module is imported, start over
+        # with a clean registry for every simulation.
+        bus.Handler.clear()
+        if "reactive.charmscaler" in sys.modules:
+            return importlib.reload(sys.modules["reactive.charmscaler"])
+        return importlib.import_module("reactive.charmscaler")
+
+    def _leader_get(self, attribute=None):
+        if attribute is None:
+            return dict(self.leader_settings)
+        return self.leader_settings.get(attribute)
+
+    def _leader_set(self, settings=None, **kwargs):
+        # Juju refuses leadership settings from other units
+        assert self.leader, "leader-set run by a non-leader"
+        self.leader_settings.update(settings or {}, **kwargs)
+
+    def _status_set(self, workload_state, message):
+        self.statuses.append((self._hook, workload_state, message))
+
+    def _elapsed(self):
+        return time.perf_counter() - self._hook_start
+
+    def _timed_set_state(self, state, value=None):
+        set_state(state, value)
+        self.states.append(StateTiming(self._hook, state, self._elapsed()))
+
+    def _timed_invoke(self, invoke):
+        simulation = self
+
+        def timed_invoke(handler):
+            start = time.perf_counter()
+            try:
+                invoke(handler)
+            finally:
+                simulation.handlers.append(HandlerTiming(
+                    simulation._hook, handler._action.__name__,
+                    time.perf_counter() - start))
+        return timed_invoke
+
+    @property
+    def status(self):
+        """
+        The last workload status which was set, as a (state, message) tuple.
+        """
+        return self.statuses[-1][1:] if self.statuses else None
+
+    def reset_unit_state(self):
+        """
+        Throw away the unit's state, like a reinstall on a new machine would,
+        while the containers and persisted Autoscaler state are kept.
+        """
+        self._reset_kv()
+        os.remove(os.environ["UNIT_STATE_DB"])
+
+    def hook(self, name, flags=(), transient_flags=()):
+        """
+        Run a hook and dispatch the reactive handlers.
+
+        :param name: Hook name
+        :type name: str
+        :param flags: Flags which are set before the hook, e.g., relation
+                      flags set by interface layers
+        :type flags: iterable
+        :param transient_flags: Flags which are only set during the hook,
+                                e.g., config.changed
+        :type transient_flags: iterable
+        :returns: Wall time of the hook in seconds
+        """
+        os.environ["JUJU_HOOK_NAME"] = name
+        self._hook = name
+        self._hook_start = time.perf_counter()
+
+        for flag in tuple(flags) + tuple(transient_flags):
+            set_state(flag)
+
+        bus.dispatch()
+
+        for flag in transient_flags:
+            remove_state(flag)
+        unitdata.kv().flush()
+
+        seconds = self._elapsed()
+        self.hooks.append(HookTiming(name, seconds))
+        return seconds
+
+
+def deploy(simulation):
+    """
+    Run the hooks of a deployment, from install until the CharmScaler is
+    available, followed by an update-status.
+
+    :param simulation: The simulation to run the hooks in
+    :type simulation: :class:`Simulation`
+    """
+    simulation.hook("install", flags=["docker.available"])
+    simulation.hook("config-changed", transient_flags=["config.changed"])
+    simulation.hook("scalable-charm-relation-joined",
+                    flags=["scalable-charm.available"])
+    simulation.hook("db-api-relation-changed",
+                    flags=["db-api.available",
+                           "charmscaler.metrics.available"])
+    simulation.hook("update-status")
+
+
+def reconfigure(simulation, **options):
+    """
+    Change charm config options and run the config-changed hook.
+
+    :param simulation: The simulation to run the hook in
+    :type simulation: :class:`Simulation`
+    """
+    simulation.cfg.update(options)
+    simulation.hook("config-changed", transient_flags=["config.changed"])
+
+
+def report(simulation):
+    """
+    :returns: The simulation's timings as a printable report
+    """
+    lines = ["{:<40} {:>12}".format("Hook", "Time (ms)")]
+    for timing in simulation.hooks:
+        lines.append("{:<40} {:>12.2f}".format(
+            timing.hook, timing.seconds * 1000))
+
+    lines.append("")
+    lines.append("{:<32} {:<32} {:>12}".format("State", "Hook", "At (ms)"))
+    for timing in simulation.states:
+        lines.append("{:<32} {:<32} {:>12.2f}".format(
+            timing.state, timing.hook, timing.seconds * 1000))
+
+    totals = {}
+    for timing in simulation.handlers:
+        calls, seconds = totals.get(timing.handler, (0, 0.0))
+        totals[timing.handler] = (calls + 1, seconds + timing.seconds)
+
+    lines.append("")
+    lines.append("{:<40} {:>6} {:>12}".format("Handler", "Calls",
+                                              "Total (ms)"))
+    by_time = sorted(totals.items(), key=lambda item: -item[1][1])
+    for handler, (calls, seconds) in by_time:
+        lines.append("{:<40} {:>6} {:>12.2f}".format(
+            handler, calls, seconds * 1000))
+
+    return "\n".join(lines)
@@ -0,0 +1,24 @@
+import argparse
+
+from unit_tests.simulator import (Simulation, default_metrics, deploy,
+                                  reconfigure, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m unit_tests.simulator",
+        description="Run the CharmScaler's hooks against local stand-ins "
+                    "and report the wall time per hook, state and handler.")
+    parser.add_argument("--metrics", type=int, default=1,
+                        help="Number of metric definitions")
+    args = parser.parse_args()
+
+    with Simulation(metrics=default_metrics(args.metrics)) as simulation:
+        deploy(simulation)
+        reconfigure(simulation, scaling_units_max=simulation.cfg[
+            "scaling_units_max"] + 1)
+        print(report(simulation))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,545 @@
+import base64
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+import socketserver
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class JSONRequestHandler(BaseHTTPRequestHandler):
+    """
+    Base request handler for the fake servers. Keeps connections alive and
+    stays quiet.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length).decode("utf-8")) \
+            if length else None
+
+    def _reply(self, status, data=None):
+        content = b"" if data is None else json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _stream(self, items):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for item in items:
+            line = json.dumps(item).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _raw(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, method):
+        try:
+            self.route(method)
+        except ValueError as err:
+            self._reply(400, {"message": "Invalid request: {}".format(err)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def route(self, method):
+        raise NotImplementedError()
+
+
+class FakeServerMixin:
+    """
+    Runs the server in a background thread and keeps a log of the requests
+    it has handled.
+    """
+    daemon_threads = True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class FakeEngineHandler(JSONRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def route(self, method):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        body = self._read_body()
+        engine = self.server
+
+        path = re.sub(r"^/v[0-9.]+", "", unquote(url.path))
+        engine.requests.append((method, path))
+        match = re.match(r"^/containers/([^/]+)(?:/(\w+))?$", path)
+
+        if path == "/containers/create":
+            name = params["name"][0]
+            if name in engine.containers:
+                return self._reply(409, {"message": "Conflict"})
+            engine.containers[name] = {
+                "Config": {"Image": body["Image"], "Labels": body["Labels"]},
+                "State": {"Running": False,
+                          "Health": {"Status": engine.health}}
+            }
+            return self._reply(201, {"Id": name})
+
+        if match and match.group(1) in engine.containers:
+            name, action = match.groups()
+            container = engine.containers[name]
+            if method == "GET" and action == "json":
+                return self._reply(200, container)
+            if method == "GET" and action == "stats":
+                return self._stream([{"read": str(i)} for i in range(3)])
+            if method == "GET" and action == "logs":
+                # Multiplexed stdout stream, one frame per line
+                return self._raw(b"".join(
+                    b"\x01\x00\x00\x00" + len(line).to_bytes(4, "big") +
+                    line for line in engine.logs.get(name, [])))
+            if method == "POST" and action in ("start", "stop", "restart"):
+                container["State"]["Running"] = action != "stop"
+                container["State"]["Health"] = {"Status": engine.health}
+                return self._reply(204)
+            if method == "POST" and action in ("pause", "unpause"):
+                if not container["State"]["Running"]:
+                    return self._reply(409, {"message": "Not running"})
+                container["State"]["Paused"] = action == "pause"
+                return self._reply(204)
+            if method == "DELETE" and action is None:
+                del engine.containers[name]
+                return self._reply(204)
+
+        if path.startswith("/networks"):
+            name = path.split("/")[-1]
+            if method == "POST":
+                engine.networks.add(body["Name"])
+                return self._reply(201, {"Id": body["Name"]})
+            if name in engine.networks:
+                if method == "DELETE":
+                    engine.networks.remove(name)
+                    return self._reply(204)
+                return self._reply(200, {"Name": name})
+
+        if path == "/images/create" and method == "POST":
+            image = "{}:{}".format(params["fromImage"][0], params["tag"][0])
+            if image in engine.unpullable:
+                return self._stream([{"error": "pull access denied for "
+                                               "{}".format(image)}])
+            engine.images.add(image)
+            return self._stream([{"status": "Pulling from {}".format(image)},
+                                 {"status": "Downloaded newer image"}])
+
+        match = re.match(r"^/images/(.+?)(/json)?$", path)
+        if match and match.group(1) in engine.images:
+            image = match.group(1)
+            if method == "GET" and match.group(2):
+                return self._reply(200, {"RepoTags": [image]})
+            if method == "DELETE":
+                engine.images.remove(image)
+                return self._reply(200, [{"Untagged": image}])
+
+        self._reply(404, {"message": "No such object"})
+
+
+class FakeEngine(FakeServerMixin, socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+    """
+    In-memory stand-in for the Docker Engine API, served on a unix socket.
+    Containers report the health status in :attr:`health`, healthy unless
+    it is changed, as soon as they are started. Their logs are the lines in
+    :attr:`logs` by container name. Pulls of the images in :attr:`unpullable`
+    fail.
+
+    :param path: Path of the unix socket
+    :type path: str
+    :param images: Images which are available locally
+    :type images: iterable
+    """
+    def __init__(self, path, images=()):
+        self.containers = {}
+        self.networks = set()
+        self.images = set(images)
+        self.unpullable = set()
+        self.health = "healthy"
+        self.logs = {}
+        self.requests = []
+        self.connections = 0
+        super().__init__(path, FakeEngineHandler)
+
+
+class FakeAutoscalerHandler(JSONRequestHandler):
+    def route(self, method):
+        path = urlparse(self.path).path
+        body = self._read_body()
+        api = self.server
+        api.requests.append((method, path))
+
+        if path == "/autoscaler/instances" and method == "POST":
+            if body["id"] in api.instances:
+                return self._reply(400, {"message": "Instance exists"})
+            api.instances[body["id"]] = {"state": "STOPPED", "config": None}
+            return self._reply(201, body)
+
+        match = re.match(r"^/autoscaler/instances/([^/]+)/(\w+)$", path)
+        if match and match.group(1) in api.instances:
+            instance = api.instances[match.group(1)]
+            action = match.group(2)
+            if method == "GET" and action == "status":
+                return self._reply(200, {"state": instance["state"],
+                                         "health": "OK"})
+            if method == "POST" and action == "config":
+                instance["config"] = body
+                return self._reply(200, body)
+            if method == "POST" and action in ("start", "stop"):
+                if action == "start" and instance["config"] is None:
+                    return self._reply(400, {"message": "Not configured"})
+                instance["state"] = "STARTED" if action == "start" \
+                    else "STOPPED"
+                return self._reply(200)
+
+        self._reply(404, {"message": "Not found"})
+
+
+class FakeAutoscaler(FakeServerMixin, socketserver.ThreadingMixIn,
+                     HTTPServer):
+    """
+    In-memory stand-in for the Autoscaler REST API.
+    """
+    def __init__(self):
+        self.instances = {}
+        self.requests = []
+        self.connections = 0
+        super().__init__(("127.0.0.1", 0), FakeAutoscalerHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeCharmpoolHandler(JSONRequestHandler):
+    def route(self, method):
+        path = urlparse(self.path).path
+        api = self.server
+        body = self._read_body()
+        api.requests.append((method, path, body))
+
+        if method == "GET" and path == "/pool/size":
+            return self._reply(200, {"desiredSize": api.desired_size,
+                                     "allocated": len(api.machines),
+                                     "active": len(api.machines)})
+        if method == "GET" and path == "/pool":
+            return self._reply(200, {"machines": api.machines})
+        if method == "POST" and path == "/pool/size":
+            api.desired_size = body["desiredSize"]
+            return self._reply(200)
+
+        match = re.match(r"^/pool/(.+)/terminate$", path)
+        if method == "POST" and match:
+            machine = unquote(match.group(1))
+            api.machines = [m for m in api.machines if m["id"] != machine]
+            if body.get("decrementDesiredSize"):
+                api.desired_size -= 1
+            return self._reply(200)
+
+        self._reply(404, {"message": "Not found"})
+
+
+class FakeCharmpool(FakeServerMixin, socketserver.ThreadingMixIn,
+                    HTTPServer):
+    """
+    In-memory stand-in for the Charmpool's cloud pool REST API.
+    """
+    def __init__(self, units=("app/0", "app/1")):
+        self.machines = [{
+            "id": str(i),
+            "machineState": "RUNNING",
+            "launchTime": "2018-01-01T00:00:0{}Z".format(i),
+            "metadata": {"units": [unit]}
+        } for i, unit in enumerate(units)]
+        self.desired_size = len(units)
+        self.requests = []
+        super().__init__(("127.0.0.1", 0), FakeCharmpoolHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeJujuControllerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        headers = {}
+        self.server.paths.append(self.rfile.readline().decode().split()[1])
+        for line in iter(self.rfile.readline, b"\r\n"):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1(
+            (headers["sec-websocket-key"] +
+             "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                         b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2 or header[0] & 0x0F == 0x8:
+                return
+            length = header[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4)
+            payload = bytes(byte ^ mask[i % 4] for i, byte in
+                            enumerate(self.rfile.read(length)))
+
+            request = json.loads(payload.decode("utf-8"))
+            self.server.requests.append(request)
+            reply = dict(self.server.call(request),
+                         **{"request-id": request["request-id"]})
+            content = json.dumps(reply).encode("utf-8")
+            if len(content) < 126:
+                frame = struct.pack("!BB", 0x81, len(content))
+            else:
+                frame = struct.pack("!BBH", 0x81, 126, len(content))
+            self.wfile.write(frame + content)
+
+
+class FakeJujuController(FakeServerMixin, socketserver.ThreadingMixIn,
+                         socketserver.TCPServer):
+    """
+    In-memory stand-in for a Juju controller's model API, over a WebSocket
+    without TLS. Holds the model's machines and the units of one
+    application.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, application="app", units=("app/0",)):
+        self.application = application
+        self.units = {unit: str(i) for i, unit in enumerate(units)}
+        self.machines = [str(i) for i in range(len(units))]
+        self._next_machine = len(units)
+        self.password = "secret"
+        self.paths = []
+        self.requests = []
+        super().__init__(("127.0.0.1", 0), FakeJujuControllerHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def _add_machine(self):
+        # Machine ids are never reused
+        machine = str(self._next_machine)
+        self._next_machine += 1
+        self.machines.append(machine)
+        return machine
+
+    def call(self, request):
+        method = "{}.{}".format(request["type"], request["request"])
+        params = request["params"]
+
+        if method == "Admin.Login":
+            if params["credentials"] != self.password:
+                return {"error": "invalid entity name or password",
+                        "error-code": "unauthorized access"}
+            return {"response": {"facades": [
+                {"name": name, "versions": [1, 2]} for name in
+                ("Client", "MachineManager", "Application")]}}
+        if method == "Client.FullStatus":
+            return {"response": {
+                "machines": {machine: {"id": machine}
+                             for machine in self.machines},
+                "applications": {self.application: {"units": {
+                    unit: {"machine": machine}
+                    for unit, machine in self.units.items()}}}}}
+        if method == "MachineManager.AddMachines":
+            return {"response": {"machines": [
+                {"machine": self._add_machine()} for _ in params["params"]]}}
+        if method == "MachineManager.DestroyMachineWithParams":
+            for tag in params["machine-tags"]:
+                self.machines.remove(tag[len("machine-"):])
+            return {"response": {}}
+        if method == "Application.AddUnits":
+            machine = params["placement"][0]["directive"]
+            if machine not in self.machines:
+                return {"error": "machine {} not found".format(machine),
+                        "error-code": "not found"}
+            unit = "{}/{}".format(self.application, len(self.units))
+            self.units[unit] = machine
+            return {"response": {"units": [unit]}}
+
+        return {"error": "unknown method {}".format(method),
+                "error-code": "not implemented"}
+
+
+_AGGREGATES = {
+    "mean": lambda values: sum(values) / len(values),
+    "sum": sum,
+    "count": len,
+    "max": max,
+    "min": min
+}
+
+_SELECT = re.compile(r"^\s*SELECT (\w+)\((\w+)\) FROM (\w+) WHERE (.*) "
+                     r"GROUP BY time\((\d+)s\)", re.IGNORECASE)
+
+_TIME_CONDITION = re.compile(r"time\s*(>=|>|<=|<)\s*(\d+)(ns|ms|s)?\b")
+
+_NANOSECONDS = {"ns": 1, "ms": 10 ** 6, "s": 10 ** 9}
+
+_OPERATORS = {
+    ">=": lambda a, b: a >= b,
+    ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b,
+    "<": lambda a, b: a < b
+}
+
+
+def _evaluate(statement, points):
+    """
+    Evaluates `SELECT <aggregate>(<field>) FROM <measurement> WHERE <time
+    bounds> GROUP BY time(<n>s)` like InfluxDB over the points, a dict of
+    measurements with lists of (nanoseconds, value) tuples. Times are
+    returned as nanoseconds, as with epoch=ns, and buckets without points
+    are left out, as with fill(none).
+    """
+    match = _SELECT.match(statement)
+    if not match or match.group(3) not in points:
+        return {}
+    aggregate, field, measurement, where, interval = match.groups()
+    interval = int(interval) * 10 ** 9
+
+    conditions = [(_OPERATORS[operator], int(value) *
+                   _NANOSECONDS[unit or "ns"]) for operator, value, unit
+                  in _TIME_CONDITION.findall(where)]
+
+    buckets = {}
+    for nanoseconds, value in points[measurement]:
+        if all(holds(nanoseconds, bound) for holds, bound in conditions):
+            buckets.setdefault(nanoseconds // interval * interval,
+                               []).append(value)
+
+    return {"series": [{
+        "name": measurement,
+        "columns": ["time", aggregate],
+        "values": [[bucket, _AGGREGATES[aggregate](values)]
+                   for bucket, values in sorted(buckets.items())]
+    }]} if buckets else {}
+
+
+class FakeInfluxdbHandler(JSONRequestHandler):
+    def route(self, method):
+        url = urlparse(self.path)
+        api = self.server
+        api.requests.append((method, url.path))
+
+        if url.path == "/query":
+            time.sleep(api.delay)
+            length = int(self.headers.get("Content-Length", 0))
+            params = parse_qs(url.query)
+            params.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+            statements = params.get("q", [""])[0].split(";")
+            api.statements.extend(statements)
+            return self._reply(200, {"results": [
+                dict(_evaluate(statement, api.points), statement_id=i)
+                for i, statement in enumerate(statements)
+            ]})
+        if url.path == "/ping":
+            return self._reply(204)
+
+        self._reply(404, {"error": "Not found"})
+
+
+class FakeInfluxdbServer(FakeServerMixin, socketserver.ThreadingMixIn,
+                         HTTPServer):
+    """
+    Stand-in for the InfluxDB HTTP API, every query succeeds after
+    :attr:`delay` seconds. Only aggregates grouped by time over the
+    :attr:`points` have any results.
+    """
+    def __init__(self):
+        self.delay = 0
+        self.points = {}
+        self.requests = []
+        self.statements = []
+        super().__init__(("127.0.0.1", 0), FakeInfluxdbHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeConversation:
+    def __init__(self, relation_ids):
+        self.relation_ids = relation_ids
+
+
+class FakeScalableCharm:
+    """
+    Stand-in for the juju-info relation to the application being scaled.
+
+    :var units: dict with the private address of each related unit
+    """
+    def __init__(self, relation_id="scalable-charm:1"):
+        self.relation_id = relation_id
+        self.units = {"scalable-app/0": "10.0.0.20"}
+
+    def related_units(self, relid=None):
+        return list(self.units)
+
+    def relation_get(self, attribute=None, unit=None, rid=None):
+        return self.units.get(unit)
+
+    def conversation(self):
+        return FakeConversation([self.relation_id])
+
+
+class FakeInfluxdb:
+    """
+    Stand-in for the influxdb-api relation data.
+    """
+    def __init__(self, hostname="10.0.0.10", port=8086, user="charmscaler",
+                 password="secret"):
+        self._data = (hostname, port, user, password)
+
+    def hostname(self):
+        return self._data[0]
+
+    def port(self):
+        return self._data[1]
+
+    def user(self):
+        return self._data[2]
+
+    def password(self):
+        return self._data[3]